@@ -2,32 +2,44 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlmodel import Session, select
-from app.core.database import get_session
+from sqlmodel import select
+from app.core.auth_cache import token_cache, user_cache
+from app.core.database import AsyncSessionLocal
 from app.core.security import SECRET_KEY, ALGORITHM
 from app.models.tables import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    session: Session = Depends(get_session)
-) -> User:
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
+    """
+    校验 Token 并返回当前用户：
+    1. Token 缓存命中时跳过 JWT 解码 (按 Token 自身的 exp 过期)
+    2. 用户信息缓存命中时不查数据库 (TTL 见 AUTH_USER_CACHE_TTL)，未命中才开一个异步 Session 查询
+    3. 已停用的账号直接拒绝
+    """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="无法验证凭证",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-        
-    statement = select(User).where(User.username == username)
-    user = session.exec(statement).first()
+        token_cache.put(token, username, float(payload.get("exp", 0)))
+
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
-    return user
\ No newline at end of file
+        async with AsyncSessionLocal() as session:
+            user = (await session.exec(select(User).where(User.username == username))).first()
+        if user is None:
+            raise credentials_exception
+        user_cache.put(user)
+    if not user.is_active:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="账号已停用")
+    return user
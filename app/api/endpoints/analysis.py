@@ -1,60 +1,126 @@
-from fastapi import APIRouter, Depends
-from sqlmodel import Session, select
-from datetime import datetime, time
-from app.core.database import get_session
-from app.core.config import load_thresholds #读取电价等参数
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from datetime import datetime, time, timedelta
+from app.core.database import get_async_session
+from app.core.config import config_service #读取电价等参数 (内存缓存)
 from app.models.tables import DeviceData, Device # 读取设备信息表和设备数据表
+from app.services.device_snapshot import device_snapshots # Redis 设备实时快照
+from app.services.device_registry import device_registry # 进程内设备注册表
+from app.services.aggregates import query_series # 连续聚合查询层
 
 router = APIRouter()
 
 @router.get("/{device_id}")
-def analyze_device(device_id: int, session: Session = Depends(get_session)):
-    # 1. 先查设备状态
-    device = session.get(Device, device_id)
-    is_active = device.is_active if device else False # 获取开关状态
-
-    # 加载配置
-    settings = load_thresholds()
-    price_per_kwh = settings.get("default", {}).get("electricity_price", 0.85)
+async def analyze_device(device_id: int, session: AsyncSession = Depends(get_async_session)):
+    """
+    设备实时分析 (仪表盘轮询)：
+    - 优先读取入库进程维护的 Redis 快照 (一次 HGETALL，与 devicedata 表的大小无关)
+    - 快照缺失的部分 (设备状态 / 今日首条读数 / 最后读数) 才回退查询数据库，并回填到快照
+    """
+    # 加载配置 (内存缓存，不再每次读文件)
+    price_per_kwh = config_service.electricity_price
 
     now = datetime.now()
-    today_start = datetime.combine(now.date(), time.min)
-    
-    # 2. 获取数据库里【最后一条】数据
+    today = now.date()
+    today_start = datetime.combine(today, time.min)
+
+    snapshot = await device_snapshots.read(device_id) or {}
+
+    # 1. 设备状态
+    if "is_active" in snapshot:
+        is_active = snapshot["is_active"] == "1"
+    else:
+        device = device_registry.get(device_id) if device_registry.loaded else await session.get(Device, device_id)
+        is_active = device.is_active if device else False # 获取开关状态
+        if device:
+            await device_snapshots.seed(device_id, is_active=is_active)
+
+    # 2. 最后一条数据 + 今日首条电能
     # 哪怕它是 1 小时前的数据，也照样拿出来，不要改它
-    latest = session.exec(
-        select(DeviceData)
-        .where(DeviceData.device_id == device_id)
-        .order_by(DeviceData.timestamp.desc())
-        .limit(1)
-    ).first()
-    
-    if not latest:
-        return {
-            "device_id": device_id,
-            "is_active": is_active, # 把状态告诉前端
-            "current_power": 0, "today_energy": 0, "today_cost": 0,
-            "voltage": 0, "current": 0
-        }
-
-    # 3. 计算今日能耗
-    first_today = session.exec(
-        select(DeviceData)
-        .where(DeviceData.device_id == device_id)
-        .where(DeviceData.timestamp >= today_start)
-        .order_by(DeviceData.timestamp.asc())
-        .limit(1)
-    ).first()
-    
-    today_kwh = (latest.energy - first_today.energy) if first_today else 0
+    if "ts" in snapshot:
+        voltage = float(snapshot["voltage"])
+        current = float(snapshot["current"])
+        power = float(snapshot["power"])
+        energy = float(snapshot["energy"])
+        snapshot_day = snapshot.get("today")
+        if snapshot_day != today.isoformat():
+            # 今天还没有数据
+            today_kwh = 0
+        elif snapshot.get("first_exact") == "1":
+            today_kwh = energy - float(snapshot["today_first_energy"])
+        else:
+            # 快照是今天中途才建立的，今日首条读数以数据库为准 (查一次后回填)
+            first_today = (await session.exec(
+                select(DeviceData)
+                .where(DeviceData.device_id == device_id)
+                .where(DeviceData.timestamp >= today_start)
+                .order_by(DeviceData.timestamp.asc())
+                .limit(1)
+            )).first()
+            today_kwh = (energy - first_today.energy) if first_today else 0
+            if first_today:
+                await device_snapshots.seed(device_id, today=today, first_energy=first_today.energy)
+    else:
+        latest = (await session.exec(
+            select(DeviceData)
+            .where(DeviceData.device_id == device_id)
+            .order_by(DeviceData.timestamp.desc())
+            .limit(1)
+        )).first()
+
+        if not latest:
+            return {
+                "device_id": device_id,
+                "is_active": is_active, # 把状态告诉前端
+                "current_power": 0, "today_energy": 0, "today_cost": 0,
+                "voltage": 0, "current": 0
+            }
+
+        # 3. 计算今日能耗
+        first_today = (await session.exec(
+            select(DeviceData)
+            .where(DeviceData.device_id == device_id)
+            .where(DeviceData.timestamp >= today_start)
+            .order_by(DeviceData.timestamp.asc())
+            .limit(1)
+        )).first()
+
+        voltage, current, power, energy = latest.voltage, latest.current, latest.power, latest.energy
+        today_kwh = (latest.energy - first_today.energy) if first_today else 0
+        await device_snapshots.seed_latest(
+            device_id, latest.timestamp, voltage, current, power, energy,
+            first_energy=first_today.energy if first_today else None,
+        )
+
     today_cost = today_kwh * price_per_kwh
 
     return {
         "device_id": device_id,
         "is_active": is_active,     # 👈 关键：告诉前端设备是开是关
-        "current_power": round(latest.power, 2), # 👈 关键：直接返回最后的值，不归零
-        "voltage": round(latest.voltage, 1),
-        "current": round(latest.current, 2),
+        "current_power": round(power, 2), # 👈 关键：直接返回最后的值，不归零
+        "voltage": round(voltage, 1),
+        "current": round(current, 2),
         "today_energy": round(today_kwh, 2),
         "today_cost": round(today_cost, 2),
-    }
\ No newline at end of file
+    }
+
+@router.get("/{device_id}/trend")
+async def device_trend(
+    device_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    max_points: int = Query(500, ge=2, le=10000),
+    resolution: Optional[int] = Query(None, ge=1, description="期望的最小桶宽 (秒)"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    趋势统计 (默认最近 24 小时)：自动选择满足分辨率的最粗连续聚合 (1 天 / 1 小时 / 1 分钟)，
+    一个月的曲线只需读取几百行聚合结果，而不是上百万条原始数据
+    """
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必须早于 end")
+    return await query_series(session, device_id, start, end, max_points=max_points, resolution=resolution)
@@ -1,26 +1,41 @@
 # app/api/endpoints/auth.py
+import asyncio
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlmodel import Session, select
-from app.core.database import get_session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.auth_cache import login_executor, login_slots, user_cache
+from app.core.database import get_async_session
 from app.core.security import verify_password, create_access_token
 from app.models.tables import User
 
 router = APIRouter()
 
 @router.post("/login", response_model=dict)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    session: Session = Depends(get_session)
+    session: AsyncSession = Depends(get_async_session)
 ):
     # 1. 查用户
     statement = select(User).where(User.username == form_data.username)
-    user = session.exec(statement).first()
-    
-    # 2. 验密码
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = (await session.exec(statement)).first()
+
+    # 2. 验密码：bcrypt 很慢 (几十到上百毫秒)，放到专用线程池里执行，登录高峰不会拖慢其他接口
+    #    排队的校验超过上限时直接拒绝，而不是无限堆积
+    if not login_slots.acquire(blocking=False):
+        raise HTTPException(status_code=503, detail="登录请求过多，请稍后再试")
+    try:
+        valid = user is not None and await asyncio.get_running_loop().run_in_executor(
+            login_executor, verify_password, form_data.password, user.hashed_password
+        )
+    finally:
+        login_slots.release()
+    if not valid:
         raise HTTPException(status_code=400, detail="用户名或密码错误")
-    
-    # 3. 发 Token
+    if not user.is_active:
+        raise HTTPException(status_code=400, detail="账号已停用")
+
+    # 3. 发 Token (顺便预热用户缓存，登录后的第一个请求不用再查库)
+    user_cache.put(user)
     access_token = create_access_token(data={"sub": user.username})
-    return {"access_token": access_token, "token_type": "bearer"}
\ No newline at end of file
+    return {"access_token": access_token, "token_type": "bearer"}
@@ -1,44 +1,70 @@
-from typing import List
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import Session, select
-from app.core.database import get_session
+import asyncio
+import time
+from typing import List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import SQLModel, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.database import get_async_session
 from app.models.tables import Device
-from app.services.mqtt_publisher import publish_control_command
+from app.services.mqtt_publisher import CONTROL_ACTIONS, MQTT_ACK_TIMEOUT, command_publisher
+from app.services.device_snapshot import device_snapshots
+from app.services.device_health import delete_health
+from app.services.device_registry import device_registry
+from app.core.logger import logger
 
 router = APIRouter()
 
 @router.post("/", response_model=Device)
-def create_device(device: Device, session: Session = Depends(get_session)):
+async def create_device(device: Device, session: AsyncSession = Depends(get_async_session)):
     session.add(device)
     try:
-        session.commit()
-        session.refresh(device)
+        await session.commit()
+        await session.refresh(device)
+        await run_in_threadpool(device_registry.notify_changed, device.id)
         return device
     except Exception:
-        session.rollback()
-        existing = session.exec(select(Device).where(Device.sn == device.sn)).first()
+        await session.rollback()
+        existing = (await session.exec(select(Device).where(Device.sn == device.sn))).first()
         if existing: return existing
         raise HTTPException(status_code=400, detail="添加失败")
 
 @router.get("/", response_model=List[Device])
-def read_devices(session: Session = Depends(get_session)):
-    return session.exec(select(Device).order_by(Device.id)).all()
+async def read_devices(
+    if_none_match: Optional[str] = Header(None),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    设备列表：直接返回设备注册表里预先序列化好的响应体，带 ETag
+    前端轮询时携带 If-None-Match，设备没有变化则返回 304 (无响应体)
+    """
+    snapshot = device_registry.snapshot
+    if snapshot is None:
+        # 注册表尚未加载 (启动时数据库不可用)，退回直接查询
+        return (await session.exec(select(Device).order_by(Device.id))).all()
+    headers = {"ETag": snapshot.etag, "Cache-Control": "no-cache"}
+    if if_none_match and snapshot.etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
 
 # --- 👇 新增代码：删除设备 ---
 @router.delete("/{device_id}")
-def delete_device(device_id: int, session: Session = Depends(get_session)):
-    device = session.get(Device, device_id)
+async def delete_device(device_id: int, session: AsyncSession = Depends(get_async_session)):
+    device = await session.get(Device, device_id)
     if not device:
         raise HTTPException(status_code=404, detail="设备不存在")
-    session.delete(device)
-    session.commit()
+    await delete_health(session, device_id)
+    await session.delete(device)
+    await session.commit()
+    await device_snapshots.delete(device_id)
+    await run_in_threadpool(device_registry.notify_changed, device_id)
     return {"ok": True, "message": f"设备 {device.name} 已删除"}
 
 # --- 👇 新增代码：修改设备信息 ---
 @router.put("/{device_id}", response_model=Device)
-def update_device(device_id: int, device_req: Device, session: Session = Depends(get_session)):
+async def update_device(device_id: int, device_req: Device, session: AsyncSession = Depends(get_async_session)):
     # 1. 查
-    db_device = session.get(Device, device_id)
+    db_device = await session.get(Device, device_id)
     if not db_device:
         raise HTTPException(status_code=404, detail="设备不存在")
     
@@ -49,28 +75,106 @@ def update_device(device_id: int, device_req: Device, session: Session = Depends
     
     # 3. 存
     session.add(db_device)
-    session.commit()
-    session.refresh(db_device)
+    await session.commit()
+    await session.refresh(db_device)
+    await run_in_threadpool(device_registry.notify_changed, device_id)
     return db_device
 
 # ---设备切换启停---
 @router.post("/{device_id}/toggle")
-def toggle_device_status(device_id: int, active: bool, session: Session = Depends(get_session)):
-    device = session.get(Device, device_id)
-    if not device:
+async def toggle_device_status(device_id: int, active: bool, session: AsyncSession = Depends(get_async_session)):
+    if not device_registry.exists(device_id):
         raise HTTPException(status_code=404, detail="设备不存在")
 
-    # 1. 更新数据库状态
-    device.is_active = active
-    session.add(device)
-    session.commit()
-    session.refresh(device)
+    # 1. 更新数据库状态 (一条 UPDATE，不再先查再改)
+    result = await session.exec(update(Device).where(Device.id == device_id).values(is_active=active))
+    await session.commit()
+    if not result.rowcount:
+        raise HTTPException(status_code=404, detail="设备不存在")
+    await device_snapshots.set_active(device_id, active)  # 同步 Redis 快照，仪表盘立即看到新状态
+    await run_in_threadpool(device_registry.notify_changed, device_id)
+    device = device_registry.get(device_id) or await session.get(Device, device_id)
 
     status_text = "启动" if active else "停止"
     action_code = "start" if active else "stop"
 
-    # 👇 2. 发送 MQTT 指令 (反向控制核心)
-    publish_control_command(device.id, action_code)
+    # 👇 2. 发送 MQTT 指令 (反向控制核心)：走常驻连接，等待 broker 的 PUBACK (有超时，不会卡住请求)
+    ack = await command_publisher.send(device_id, action_code)
+    if ack["ok"]:
+        print(f"📡 [指令下发] To ID:{device_id} -> {action_code} (PUBACK {ack['latency_ms']}ms)")
+    else:
+        logger.warning(f"⚠️ [指令下发] To ID:{device_id} -> {action_code} 未确认: {ack['error']}")
 
     print(f"✅ 设备{device.name} (ID:{device_id}) 状态已更新为: {status_text}")
-    return device
\ No newline at end of file
+    return device
+
+
+# ---批量启停 (按设备 ID 列表 / 设备类型 / 安装位置选择)---
+class BulkControlRequest(SQLModel):
+    action: str                              # "start" | "stop"
+    device_ids: Optional[List[int]] = None
+    device_type: Optional[str] = None
+    location: Optional[str] = None
+    update_status: bool = True               # 同时更新数据库里的 is_active
+    timeout: float = MQTT_ACK_TIMEOUT         # 等待 PUBACK 的秒数
+
+
+@router.post("/control/bulk")
+async def bulk_control(req: BulkControlRequest, session: AsyncSession = Depends(get_async_session)):
+    """
+    批量下发启停指令：一次性发出全部指令，再统一等待 PUBACK，
+    返回每台设备的确认耗时 (未确认的给出原因)
+    """
+    if req.action not in CONTROL_ACTIONS:
+        raise HTTPException(status_code=400, detail=f"action 只能是 {' / '.join(CONTROL_ACTIONS)}")
+    if req.device_ids is None and req.device_type is None and req.location is None:
+        raise HTTPException(status_code=400, detail="请至少指定 device_ids / device_type / location 之一")
+    if not 0 < req.timeout <= 60:
+        raise HTTPException(status_code=400, detail="timeout 需在 (0, 60] 秒之间")
+
+    # 1. 选出目标设备 (优先用进程内注册表，未加载时查库)
+    if device_registry.loaded:
+        devices = list(device_registry.snapshot.by_id.values())
+    else:
+        devices = (await session.exec(select(Device))).all()
+    wanted = set(req.device_ids) if req.device_ids is not None else None
+    targets = sorted(
+        d.id for d in devices
+        if (wanted is None or d.id in wanted)
+        and (req.device_type is None or d.device_type == req.device_type)
+        and (req.location is None or d.location == req.location)
+    )
+    missing = sorted(wanted - {d.id for d in devices}) if wanted is not None else []  # 不存在的设备 ID
+    if not targets:
+        raise HTTPException(status_code=404, detail="没有匹配的设备")
+
+    started = time.perf_counter()
+    active = req.action == "start"
+    # 2. 一条 UPDATE 更新全部目标设备的状态
+    if req.update_status:
+        await session.exec(update(Device).where(Device.id.in_(targets)).values(is_active=active))
+        await session.commit()
+        await asyncio.gather(*(device_snapshots.set_active(device_id, active) for device_id in targets))
+        await run_in_threadpool(device_registry.notify_changed, None)
+
+    # 3. 批量下发并等待确认
+    results = await command_publisher.send_many([(device_id, req.action) for device_id in targets], req.timeout)
+    latencies = sorted(r["latency_ms"] for r in results if r["ok"])
+    acked = len(latencies)
+    summary = {
+        "action": req.action,
+        "requested": len(targets),
+        "acked": acked,
+        "failed": len(results) - acked,
+        "missing": missing,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        "latency_ms": {
+            "min": latencies[0] if latencies else None,
+            "p50": latencies[len(latencies) // 2] if latencies else None,
+            "p95": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else None,
+            "max": latencies[-1] if latencies else None,
+        },
+        "results": results,
+    }
+    print(f"📡 [批量指令] {req.action} x{len(targets)}: 确认 {acked}, 失败 {summary['failed']}, 耗时 {summary['elapsed_ms']}ms")
+    return summary
\ No newline at end of file
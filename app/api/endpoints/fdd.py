@@ -1,38 +1,111 @@
-from fastapi import APIRouter, Depends
-from sqlmodel import Session, select, func
-from app.core.database import get_session
-from app.models.tables import Alarm, Device
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.database import get_async_session
+from app.models.tables import FddFinding
+from app.services import fdd_backfill
+from app.services.device_health import read_health, rebuild_health, window_stats
 
 router = APIRouter()
 
 @router.get("/stats")
-def fault_diagnosis_stats(session: Session = Depends(get_session)):
+async def fault_diagnosis_stats(
+    hours: Optional[int] = Query(None, ge=1, le=24 * 366, description="只统计最近 N 小时的报警 (不传则读取增量维护的健康度)"),
+    session: AsyncSession = Depends(get_async_session),
+):
     """
-    FDD 分析：统计每个设备的报警次数，找出“故障王”
+    FDD 分析：每台设备的报警次数与健康度，按健康度从低到高排序，找出“故障王”
+    - 默认: 读取入库报警路径增量维护的健康度表 (扣分随时间衰减)，耗时与报警表大小无关
+    - hours=N: 对最近 N 小时的报警做一次 GROUP BY + JOIN 统计
     """
-    # SQL 逻辑: SELECT device_id, count(*) FROM alarm GROUP BY device_id
-    # 注意：这里需要稍微复杂的 SQLAlchemy 语法
-    
-    # 1. 统计每个 ID 的报警数
-    statement = (
-        select(Alarm.device_id, func.count(Alarm.id).label("count"))
-        .group_by(Alarm.device_id)
-        .order_by(func.count(Alarm.id).desc())
-    )
-    results = session.exec(statement).all()
-    
-    # 2. 组装数据，加上设备名称
-    diagnosis_report = []
-    for dev_id, count in results:
-        # 查询设备名称
-        dev = session.get(Device, dev_id)
-        dev_name = dev.name if dev else f"未知设备({dev_id})"
-        
-        diagnosis_report.append({
-            "device_id": dev_id,
-            "device_name": dev_name,
-            "alarm_count": count,
-            "health_score": max(0, 100 - count * 5) # 简单算法：一次报警扣5分
-        })
-        
-    return diagnosis_report
\ No newline at end of file
+    if hours:
+        return await window_stats(session, hours)
+    return await read_health(session)
+
+@router.post("/health/rebuild")
+async def rebuild_device_health(
+    hours: Optional[int] = Query(None, ge=1, description="只使用最近 N 小时的报警重建 (不传则使用全部历史)"),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """管理员从报警表重建健康度 (例如手工清理过报警表之后)"""
+    return {"ok": True, **await rebuild_health(session, hours)}
+
+
+# =================================================================
+# 离线回溯：用当前的阈值配置 / 检测参数重新诊断历史数据
+# =================================================================
+class BackfillRequest(SQLModel):
+    start: datetime
+    end: datetime
+    device_ids: Optional[List[int]] = None
+    workers: Optional[int] = None
+
+@router.post("/backfill")
+async def create_backfill(req: BackfillRequest):
+    """创建并在后台启动一次回溯任务 (进程池并行，按 chunk 逐段处理)，立即返回任务 ID"""
+    if req.end <= req.start:
+        raise HTTPException(status_code=400, detail="end 必须晚于 start")
+    run = await run_in_threadpool(fdd_backfill.create_run, req.start, req.end, req.device_ids)
+    fdd_backfill.start_in_background(run.id, workers=req.workers)
+    return await run_in_threadpool(fdd_backfill.run_progress, run.id)
+
+@router.get("/backfill")
+async def list_backfills(limit: int = Query(50, ge=1, le=500)):
+    return await run_in_threadpool(fdd_backfill.list_runs, limit)
+
+@router.get("/backfill/{run_id}")
+async def read_backfill(run_id: str):
+    """任务进度：完成设备数 / 已处理行数 / 检测结果数 / 按时间覆盖率计算的进度"""
+    progress = await run_in_threadpool(fdd_backfill.run_progress, run_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="回溯任务不存在")
+    return progress
+
+@router.post("/backfill/{run_id}/resume")
+async def resume_backfill(run_id: str, workers: Optional[int] = None, force: bool = False):
+    """
+    继续执行被取消 / 失败 / 进程重启中断的任务：已完成的设备跳过，其余设备从最后提交的分片之后继续
+    - force=True: 接管状态仍为 running 的任务 (原执行进程已经不存在时使用)
+    """
+    progress = await run_in_threadpool(fdd_backfill.run_progress, run_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="回溯任务不存在")
+    if progress["status"] == fdd_backfill.DONE:
+        raise HTTPException(status_code=409, detail="回溯任务已完成")
+    if progress["status"] == fdd_backfill.RUNNING and not force:
+        raise HTTPException(status_code=409, detail="回溯任务正在执行")
+    started = fdd_backfill.start_in_background(run_id, workers=workers, force=force)
+    return {"ok": started, **progress}
+
+@router.post("/backfill/{run_id}/cancel")
+async def cancel_backfill(run_id: str):
+    if not await run_in_threadpool(fdd_backfill.cancel_run, run_id):
+        raise HTTPException(status_code=409, detail="回溯任务不存在或已结束")
+    return {"ok": True}
+
+@router.delete("/backfill/{run_id}")
+async def delete_backfill(run_id: str):
+    """删除回溯任务及其检测结果 (执行中的任务需先取消)"""
+    if not await run_in_threadpool(fdd_backfill.delete_run, run_id):
+        raise HTTPException(status_code=409, detail="回溯任务不存在或正在执行")
+    return {"ok": True}
+
+@router.get("/findings")
+async def read_findings(
+    run_id: str,
+    device_id: Optional[int] = None,
+    rule_code: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=10000),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """回溯检测结果 (按开始时间排序)"""
+    statement = select(FddFinding).where(FddFinding.run_id == run_id)
+    if device_id is not None:
+        statement = statement.where(FddFinding.device_id == device_id)
+    if rule_code:
+        statement = statement.where(FddFinding.rule_code == rule_code)
+    statement = statement.order_by(FddFinding.start_ts).limit(limit)
+    return (await session.exec(statement)).all()
@@ -1,54 +1,176 @@
-import csv
-import io
-from fastapi import APIRouter, Depends
+import os
+import re
+from datetime import datetime
+from typing import List, Optional
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from sqlmodel import Session, select
-from app.core.database import get_session
-from app.models.tables import DeviceData, Device
+from sqlmodel import SQLModel
+from app.services.export_jobs import DONE, ExportQueueFull, export_jobs
+from app.services.export_service import ExportSpec, ExportSpecError, arrow_schema, iter_csv, iter_export
 
 router = APIRouter()
 
 @router.get("/export_csv")
-def export_telemetry_csv(session: Session = Depends(get_session)):
+def export_telemetry_csv(
+    device_ids: Optional[List[int]] = Query(None, description="设备ID，可重复传入: ?device_ids=1&device_ids=2"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    columns: Optional[str] = Query(None, description="逗号分隔的列名，默认全部: timestamp,device_id,device_name,voltage,current,power,energy"),
+    gzip: bool = False,
+):
     """
-    导出所有设备的历史数据为 CSV 文件
+    导出设备历史数据为 CSV 文件 (流式)
+    - 服务端游标分批读取，边查边写，内存占用与导出行数无关
+    - gzip=True 时返回边生成边压缩的 .csv.gz
     """
-    # 1. 创建内存中的 CSV 缓冲区
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # 2. 写入表头
-    writer.writerow(["时间", "设备ID", "设备名称", "电压(V)", "电流(A)", "功率(kW)", "能耗(kWh)"])
-    
-    # 3. 查询数据 (为了演示只取最近 1000 条，防止卡死)
-    # 联表查询：我们需要 Device 表里的 name
-    statement = (
-        select(DeviceData, Device.name)
-        .join(Device, Device.id == DeviceData.device_id)
-        .order_by(DeviceData.timestamp.desc())
-        .limit(1000)
-    )
-    results = session.exec(statement).all()
-    
-    # 4. 写入数据行
-    for data, dev_name in results:
-        writer.writerow([
-            data.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-            data.device_id,
-            dev_name,
-            data.voltage,
-            data.current,
-            data.power,
-            data.energy
-        ])
-    
-    # 5. 重置指针到开头
-    output.seek(0)
-    
-    # 6.以此流的形式返回，浏览器会自动触发下载
+    try:
+        spec = ExportSpec.build(device_ids=device_ids, start=start, end=end, columns=columns, gzip=gzip)
+    except ExportSpecError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # 以此流的形式返回，浏览器会自动触发下载 (同步生成器由 Starlette 放到线程池里迭代，不阻塞事件循环)
     response = StreamingResponse(
-        iter([output.getvalue()]), 
-        media_type="text/csv"
+        iter_csv(spec),
+        media_type="application/gzip" if spec.gzip else "text/csv; charset=utf-8"
     )
-    response.headers["Content-Disposition"] = "attachment; filename=energy_report.csv"
-    return response
\ No newline at end of file
+    filename = spec.filename(".csv.gz" if spec.gzip else ".csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+    return response
+
+@router.get("/export")
+def export_dataset(
+    dataset: str = Query("telemetry", description="telemetry (遥测数据) / alarms (报警记录)"),
+    format: str = Query("csv", description="csv / parquet / arrow (Arrow IPC stream)"),
+    device_ids: Optional[List[int]] = Query(None),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    columns: Optional[str] = Query(None, description="逗号分隔的列名，默认全部"),
+    gzip: bool = Query(False, description="仅对 csv 生效"),
+):
+    """
+    通用导出：遥测 / 报警 两个数据集，支持 CSV 与列式格式
+    - parquet: 带类型的列 (timestamp[us] / int32 / float32)，按 row group 分批写出并压缩 (默认 zstd)
+    - arrow: Arrow IPC stream，每个数据库分批对应一个 RecordBatch
+    """
+    try:
+        spec = ExportSpec.build(
+            device_ids=device_ids, start=start, end=end, columns=columns, gzip=gzip,
+            dataset=dataset, format=format,
+        )
+        if spec.format != "csv":
+            arrow_schema(spec)  # 提前检查 pyarrow 是否可用，避免开始传输后才报错
+    except ExportSpecError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+
+    response = StreamingResponse(iter_export(spec), media_type=spec.media_type)
+    response.headers["Content-Disposition"] = f"attachment; filename={spec.filename()}"
+    return response
+
+
+# =================================================================
+# 后台导出任务：提交 -> 轮询进度 -> 下载 (支持断点续传)
+# =================================================================
+class ExportJobRequest(SQLModel):
+    dataset: str = "telemetry"
+    format: str = "csv"
+    device_ids: Optional[List[int]] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    columns: Optional[str] = None
+    gzip: bool = False
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+@router.post("/jobs")
+async def create_export_job(req: ExportJobRequest):
+    """提交后台导出任务；相同条件的任务正在执行，或时间范围已结束且结果未过期时，直接返回已有任务 (deduplicated=true)"""
+    try:
+        spec = ExportSpec.build(
+            device_ids=req.device_ids, start=req.start, end=req.end, columns=req.columns,
+            gzip=req.gzip, dataset=req.dataset, format=req.format,
+        )
+        if spec.format != "csv":
+            arrow_schema(spec)
+        job, deduplicated = export_jobs.submit(spec)
+    except ExportSpecError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExportQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    return {**job.to_dict(), "deduplicated": deduplicated}
+
+@router.get("/jobs")
+async def list_export_jobs():
+    return [job.to_dict() for job in export_jobs.list()]
+
+@router.get("/jobs/{job_id}")
+async def read_export_job(job_id: str):
+    """任务进度：已写入行数 / 字节数、预计总行数、进度比例、预计剩余秒数"""
+    job = export_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="导出任务不存在或已过期")
+    return job.to_dict()
+
+@router.delete("/jobs/{job_id}")
+async def cancel_export_job(job_id: str):
+    job = await run_in_threadpool(export_jobs.cancel, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="导出任务不存在或已过期")
+    return job.to_dict()
+
+def _parse_range(header: str, size: int):
+    """解析单段 Range: bytes=start-end / bytes=start- / bytes=-suffix，返回 (start, end) 闭区间"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+    else:
+        start = max(size - int(match.group(2)), 0)
+        end = size - 1
+    if start >= size or start > end:
+        return None
+    return start, min(end, size - 1)
+
+def _iter_file(path: str, start: int, length: int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(DOWNLOAD_CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+@router.get("/jobs/{job_id}/download")
+async def download_export_job(job_id: str, range: Optional[str] = Header(None)):
+    """下载导出结果，支持 HTTP Range (断点续传 / 分段下载)"""
+    job = export_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="导出任务不存在或已过期")
+    if job.status != DONE or not os.path.exists(job.path):
+        raise HTTPException(status_code=409, detail=f"导出任务尚未完成 (当前状态: {job.status})")
+
+    size = os.path.getsize(job.path)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Disposition": f"attachment; filename={job.spec.filename()}",
+    }
+    if range:
+        byte_range = _parse_range(range, size)
+        if byte_range is None:
+            raise HTTPException(status_code=416, detail="Range 无效", headers={"Content-Range": f"bytes */{size}"})
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+            _iter_file(job.path, start, end - start + 1), status_code=206,
+            media_type=job.spec.media_type, headers=headers,
+        )
+    headers["Content-Length"] = str(size)
+    return StreamingResponse(_iter_file(job.path, 0, size), media_type=job.spec.media_type, headers=headers)
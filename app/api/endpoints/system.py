@@ -0,0 +1,119 @@
+import json
+import time
+from typing import Optional
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from app.core.auth_cache import auth_invalidation, token_cache, user_cache
+from app.core.config import config_service
+from app.core.database import engine
+from app.core.redis import RedisClient
+from app.core.socket_manager import manager, ws_bridge
+from app.core.timescale import apply_lifecycle_policies, compress_chunks, storage_stats
+from app.core.ws_backplane import ws_backplane
+from app.services.alarm_state import alarm_tracker
+from app.services.anomaly import anomaly_detector
+from app.services.device_snapshot import device_snapshots
+from app.services.device_registry import device_registry
+from app.services.mqtt_publisher import command_publisher
+from app.services.mqtt_worker import CONSUMER_STATS_KEY, CONSUMER_STATS_INTERVAL, consumer_stats
+
+router = APIRouter()
+
+@router.get("/config")
+def read_config_info():
+    """查看当前生效的阈值配置版本"""
+    return config_service.info()
+
+@router.post("/config/reload")
+def reload_config(force: bool = True):
+    """
+    管理员手动重新加载 config/settings.json
+    - force=True: 不管文件有没有变化都重新解析
+    - force=False: 仅在文件 inode/mtime 变化时重新加载
+    - 文件读取 / 解析失败时返回 422，当前生效的配置保持不变
+    """
+    reloaded = config_service.reload(force=force)
+    if config_service.last_error:
+        raise HTTPException(
+            status_code=422,
+            detail=f"配置文件加载失败，仍使用 version={config_service.version} 的配置: {config_service.last_error}",
+        )
+    return {"ok": True, "reloaded": reloaded, **config_service.info()}
+
+@router.get("/ingest")
+async def read_ingest_stats():
+    """
+    入库运行状态：
+    - local: 当前 API 进程内的消费统计 / 入库管道 / 报警状态机
+    - consumers: 所有消费者进程 (含 scripts/run_consumers.py 启动的) 最近一次上报的状态与消费延迟
+    """
+    consumers = []
+    try:
+        raw = await RedisClient.get_client().hgetall(CONSUMER_STATS_KEY)
+        now = time.time()
+        for name, value in sorted(raw.items()):
+            item = json.loads(value)
+            item["name"] = name
+            # 超过 3 个上报周期没有更新，视为已下线
+            item["stale"] = now - item.get("reported_at", 0) > CONSUMER_STATS_INTERVAL * 3
+            consumers.append(item)
+    except Exception as e:
+        consumers = [{"error": f"Redis 不可用: {e}"}]
+
+    local = consumer_stats.snapshot()
+    local["alarms"] = alarm_tracker.stats()
+    local["snapshots"] = device_snapshots.stats()
+    local["anomaly"] = anomaly_detector.stats()
+    local["registry"] = device_registry.stats()
+    local["control"] = command_publisher.stats()
+    return {"local": local, "consumers": consumers}
+
+@router.post("/anomaly/reset")
+async def reset_anomaly_state(device_id: Optional[int] = None):
+    """
+    清空在线异常检测状态，设备重新学习基线 (更换传感器 / 设备检修后使用)
+    - device_id 为空时清空全部设备
+    - 当前进程立即生效，并清除所有消费者进程在 Redis 中的检查点；
+      运行中的消费者进程在下一次检查点 (ANOMALY_CHECKPOINT_INTERVAL) 时处理重置请求
+    """
+    await run_in_threadpool(anomaly_detector.reset, device_id)
+    return {"ok": True, "device_id": device_id}
+
+@router.get("/websocket")
+def read_websocket_stats():
+    """
+    WebSocket 运行统计：
+    - bridge: MQTT -> 事件循环 桥接队列 (入队 / 丢弃 / 合并 / 排队延迟)
+    - fanout: 连接数、慢客户端驱逐次数、广播 -> 发出 的 p50 / p99 延迟
+    - backplane: Redis pub/sub 发布 / 订阅条数、接收速率、跨进程延迟、重连次数
+    """
+    return {"bridge": ws_bridge.stats(), "fanout": manager.stats(), "backplane": ws_backplane.stats()}
+
+
+@router.get("/auth")
+def read_auth_cache_stats():
+    """认证缓存命中率，以及跨进程账号失效通知的接收情况"""
+    return {"tokens": token_cache.stats(), "users": user_cache.stats(), "invalidation": auth_invalidation.stats()}
+
+@router.get("/storage")
+async def read_storage_stats(limit: int = 100):
+    """
+    TimescaleDB 存储概况：原始超表 / 连续聚合的体积、压缩率、最近 limit 个 chunk 的大小与压缩前后字节数、后台策略运行状态
+    """
+    try:
+        return await run_in_threadpool(storage_stats, engine, max(1, min(limit, 1000)))
+    except Exception as e:
+        raise HTTPException(status_code=501, detail=f"存储统计不可用 (需要 TimescaleDB): {e}")
+
+@router.post("/storage/policies")
+async def reapply_storage_policies():
+    """按当前配置 (TS_CHUNK_INTERVAL / TS_COMPRESS_AFTER / TS_RAW_RETENTION) 重新应用生命周期策略，已一致的项自动跳过"""
+    return await run_in_threadpool(apply_lifecycle_policies, engine)
+
+@router.post("/storage/compress")
+async def compress_storage_now(older_than: str = "7 days"):
+    """立即压缩早于 older_than 的全部未压缩 chunk (例如调整压缩策略后手动补压历史数据)"""
+    try:
+        return await run_in_threadpool(compress_chunks, engine, older_than)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"压缩失败: {e}")
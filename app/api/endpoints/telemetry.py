@@ -1,15 +1,29 @@
-from typing import List
-from fastapi import APIRouter, Depends
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select
-from app.core.database import get_session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.database import engine, get_session, get_async_session
 from app.models.tables import DeviceData
-from app.services.data_processor import process_device_data
+from app.services.data_processor import process_device_data, process_device_batch
+from app.services.device_registry import device_registry
+from app.services.history import query_history
+from app.services.telemetry_decoder import (
+    MAX_BATCH_BYTES, NdjsonDecoder, PayloadTooLarge, decode_items, iter_json_array, iter_msgpack
+)
 
 router = APIRouter()
 
+HISTORY_DEFAULT_POINTS = 1000
+HISTORY_MAX_POINTS = 20000
+
 # --- 接口 1: 模拟器上传数据用 (POST) ---
 @router.post("/", response_model=DeviceData)
 def upload_telemetry(data: DeviceData, session: Session = Depends(get_session)):
+    if not device_registry.exists(data.device_id):
+        raise HTTPException(status_code=404, detail=f"未注册的设备 ID: {data.device_id}")
     # ✅ 直接调用公共服务，逻辑全都在那边处理
     return process_device_data(
         session=session,
@@ -21,15 +35,94 @@ def upload_telemetry(data: DeviceData, session: Session = Depends(get_session)):
         timestamp=data.timestamp
     )
 
+def _write_batch(rows) -> int:
+    with Session(engine) as session:
+        return process_device_batch(session, rows)
+
+async def _limited_stream(request: Request) -> AsyncIterator[bytes]:
+    """按块读取请求体，累计超过 MAX_BATCH_BYTES 立即中止 (Content-Length 超限的请求不读请求体直接拒绝)"""
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > MAX_BATCH_BYTES:
+        raise PayloadTooLarge(f"请求体最大 {MAX_BATCH_BYTES} 字节")
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > MAX_BATCH_BYTES:
+            raise PayloadTooLarge(f"请求体最大 {MAX_BATCH_BYTES} 字节")
+        yield chunk
+
+# --- 接口 1.1: 网关批量上传 (POST) ---
+# 支持三种请求体:
+# - application/json:       [{"device_id":1,"voltage":..}, ...] 或 [[device_id, ts, v, i, p, e], ...]
+# - application/x-ndjson:   每行一条 JSON，按分块流式解析
+# - application/msgpack:    与 JSON 数组结构相同的 msgpack 编码
+# 条数 / 请求体大小超过 TELEMETRY_BATCH_MAX_ITEMS / TELEMETRY_BATCH_MAX_BYTES 时返回 413
+@router.post("/batch")
+async def upload_telemetry_batch(request: Request):
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip().lower()
+    try:
+        if content_type in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+            decoder = NdjsonDecoder()
+            async for chunk in _limited_stream(request):
+                decoder.feed(chunk)
+            items = decoder.close()
+        else:
+            body = b"".join([chunk async for chunk in _limited_stream(request)])
+            if content_type in ("application/msgpack", "application/x-msgpack"):
+                items = iter_msgpack(body)
+            else:
+                items = iter_json_array(body)
+        rows, rejects = decode_items(items, known=device_registry.exists)
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"请求体解析失败: {e}")
+
+    # 整批读数一条 COPY / INSERT 落库，报警走与 process_device_data 相同的规则引擎和状态机
+    alarms = 0
+    if rows:
+        try:
+            alarms = await run_in_threadpool(_write_batch, rows)
+        except IntegrityError:
+            # 注册表还没收到刚删除设备的通知时，仍由数据库外键兜底
+            raise HTTPException(status_code=422, detail="批次中包含未注册的设备 ID")
+
+    return {
+        "accepted": len(rows),
+        "rejected": len(items) - len(rows),
+        "alarms": alarms,
+        "errors": rejects,  # [[下标, 原因], ...]
+    }
+
 # --- 接口 2: 前端图表获取历史数据用 (GET) ---
-# (这部分代码保持不变，不需要修改)
-@router.get("/{device_id}", response_model=List[DeviceData])
-def read_device_history(device_id: int, limit: int = 50, session: Session = Depends(get_session)):
-    statement = (
-        select(DeviceData)
-        .where(DeviceData.device_id == device_id)
-        .order_by(DeviceData.timestamp.desc())
-        .limit(limit)
-    )
-    results = session.exec(statement).all()
-    return list(reversed(results))
\ No newline at end of file
+@router.get("/{device_id}")
+async def read_device_history(
+    device_id: int,
+    limit: int = 50,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    max_points: Optional[int] = Query(None, ge=3, le=HISTORY_MAX_POINTS),
+    session: AsyncSession = Depends(get_async_session),
+):
+    """
+    - 不带 start / end / max_points: 保持原来的行为，返回最近 limit 条记录 (按时间升序的行列表)
+    - 带时间范围: 服务端降采样后返回列式数组 {timestamps: [...], voltage: [...], ...}
+      start 默认 end 前 24 小时，end 默认当前时间，max_points 默认 1000
+    """
+    if start is None and end is None and max_points is None:
+        statement = (
+            select(DeviceData)
+            .where(DeviceData.device_id == device_id)
+            .order_by(DeviceData.timestamp.desc())
+            .limit(limit)
+        )
+        results = (await session.exec(statement)).all()
+        return list(reversed(results))
+
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start 必须早于 end")
+    return await query_history(session, device_id, start, end, max_points or HISTORY_DEFAULT_POINTS)
@@ -0,0 +1,207 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+from app.core.logger import logger
+from app.core.redis import RedisClient
+from app.models.tables import User
+
+# 认证缓存配置 (可通过环境变量调整)
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))  # 已验证 Token 的 LRU 容量
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))       # 用户信息缓存秒数 (Redis 不可用时其他进程的最长生效延迟)
+AUTH_LOGIN_WORKERS = int(os.getenv("AUTH_LOGIN_WORKERS", "2"))            # bcrypt 校验专用线程数
+AUTH_LOGIN_MAX_PENDING = int(os.getenv("AUTH_LOGIN_MAX_PENDING", "32"))   # 排队中的登录校验上限，超过直接返回 503
+# 账号失效通知频道：某个进程停用 / 删除 / 改密后发布用户名，各 API 进程收到后清除自己的缓存
+AUTH_INVALIDATE_CHANNEL = os.getenv("AUTH_INVALIDATE_CHANNEL", "ems:auth:invalidate")
+
+
+def token_key(token: str) -> str:
+    """缓存键使用 Token 的哈希，内存里不保留原始 Token"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """
+    已验证 JWT 的 LRU 缓存：token 哈希 -> (用户名, exp)
+    - 命中时跳过签名校验与解码；条目在 Token 自身的 exp 到期后失效
+    - 容量满时淘汰最久未使用的条目
+    """
+
+    def __init__(self, max_size: int = AUTH_TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[str]:
+        key = token_key(token)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            username, exp = item
+            if exp <= time.time():
+                del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return username
+
+    def put(self, token: str, username: str, exp: float):
+        key = token_key(token)
+        with self._lock:
+            self._items[key] = (username, exp)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def invalidate_user(self, username: str):
+        with self._lock:
+            for key in [k for k, (name, _exp) in self._items.items() if name == username]:
+                del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+class UserCache:
+    """
+    用户信息缓存：用户名 -> (脱离 Session 的 User 副本, 过期时间)
+    账号被停用 / 删除时经 invalidate_user() 立即失效 (其他进程通过 Redis 通知同步失效)
+    """
+
+    def __init__(self, ttl: float = AUTH_USER_CACHE_TTL):
+        self.ttl = ttl
+        self._items: Dict[str, Tuple[User, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, username: str) -> Optional[User]:
+        with self._lock:
+            item = self._items.get(username)
+            if item is None or item[1] <= time.monotonic():
+                self._items.pop(username, None)
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0]
+
+    def put(self, user: User):
+        # 缓存副本不带密码哈希，也不绑定任何数据库 Session
+        principal = User(id=user.id, username=user.username, hashed_password="", is_active=user.is_active)
+        with self._lock:
+            self._items[user.username] = (principal, time.monotonic() + self.ttl)
+
+    def invalidate(self, username: str):
+        with self._lock:
+            self._items.pop(username, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "ttl": self.ttl, "hits": self.hits, "misses": self.misses}
+
+
+# 全局单例
+token_cache = TokenCache()
+user_cache = UserCache()
+
+# bcrypt 校验专用的小线程池：登录高峰只会占满这几个线程，不会挤占 FastAPI 默认线程池 / 事件循环
+login_executor = ThreadPoolExecutor(max_workers=AUTH_LOGIN_WORKERS, thread_name_prefix="bcrypt")
+login_slots = threading.BoundedSemaphore(AUTH_LOGIN_MAX_PENDING)
+
+
+def _invalidate_local(username: str):
+    user_cache.invalidate(username)
+    token_cache.invalidate_user(username)
+
+
+def invalidate_user(username: str):
+    """
+    账号停用 / 删除 / 改密的事务提交后调用：清除本进程该用户的缓存信息与已缓存的 Token，
+    并通过 Redis 通知其他 API 进程 (通知发布失败时其他进程最迟 AUTH_USER_CACHE_TTL 秒后生效)
+    """
+    _invalidate_local(username)
+    try:
+        RedisClient.get_sync_client().publish(AUTH_INVALIDATE_CHANNEL, username)
+    except Exception as e:
+        auth_invalidation.errors += 1
+        logger.warning(f"⚠️ [Auth] 账号失效通知发布失败，其他进程最迟 {AUTH_USER_CACHE_TTL:.0f}s 后生效: {e}")
+
+
+class AuthInvalidationListener:
+    """
+    后台线程订阅账号失效通知频道，收到用户名后清除本进程的缓存
+    订阅断线期间可能错过通知，重新连上后整体清空用户缓存 (下一次请求重新查库)
+    """
+
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.notifications = 0
+        self.errors = 0
+
+    def start(self):
+        """启动订阅线程 (重复调用是安全的)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="auth-invalidate", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=3)
+            self._thread = None
+
+    def _listen(self):
+        backoff = 1.0
+        while not self._stop.is_set():
+            pubsub = None
+            try:
+                pubsub = RedisClient.get_sync_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(AUTH_INVALIDATE_CHANNEL)
+                if backoff > 1.0:
+                    user_cache.clear()
+                backoff = 1.0
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        self.notifications += 1
+                        _invalidate_local(message["data"])
+            except Exception as e:
+                self.errors += 1
+                logger.debug(f"[Auth] 失效通知订阅断开，{backoff:.0f}s 后重连: {e}")
+                if self._stop.wait(backoff):
+                    break
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.reset()
+                    except Exception:
+                        pass
+
+    def stats(self) -> dict:
+        return {
+            "listening": bool(self._thread and self._thread.is_alive()),
+            "notifications": self.notifications,
+            "errors": self.errors,
+        }
+
+
+auth_invalidation = AuthInvalidationListener()
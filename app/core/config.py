@@ -1,21 +1,201 @@
 import json
 import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+from app.core.logger import logger
 
 # 自动获取项目根目录 (即 main.py 所在的文件夹)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # 获取三次父目录 以保证其可移植性
 CONFIG_PATH = os.path.join(BASE_DIR, "config", "settings.json")
 
-def load_thresholds():
-    """从 config/settings.json 加载报警阈值配置"""
+# 热点路径上最多每隔多少秒 stat 一次配置文件 (0 表示每次调用都检查)
+CONFIG_CHECK_INTERVAL = float(os.getenv("CONFIG_CHECK_INTERVAL", "1.0"))
+
+# 没有配置文件 / 配置缺项时使用的内置默认值
+BUILTIN_DEFAULTS = {
+    "voltage_min": 190.0,
+    "voltage_max": 250.0,
+    "current_max": 45.0,
+    "electricity_price": 0.85,
+    # 以下规则默认关闭: 功率上限 / 电流变化率上限 (A/s) 为无穷大，卡死判定样本数为 0
+    "power_max": float("inf"),
+    "current_rate_max": float("inf"),
+    "stuck_samples": 0,
+}
+
+
+@dataclass(frozen=True)
+class DeviceLimits:
+    """单个设备最终生效的阈值 (已经合并了 default 回退值)"""
+    device_id: Optional[int]
+    current_max: float
+    voltage_min: float
+    voltage_max: float
+    power_max: float = BUILTIN_DEFAULTS["power_max"]
+    current_rate_max: float = BUILTIN_DEFAULTS["current_rate_max"]
+    stuck_samples: int = 0
+    name: Optional[str] = None
+
+
+def _read_config_file() -> dict:
+    """
+    从 config/settings.json 读取原始配置
+    文件不存在时返回空配置 (全部使用内置默认值)；文件存在但读不出来 / 不是合法的 JSON 对象时抛出异常，
+    由调用方保留当前生效的配置 (编辑器保存到一半、手误写错时不能把阈值悄悄重置成默认值)
+    """
+    # 检查文件是否存在
+    if not os.path.exists(CONFIG_PATH):
+        print(f"⚠️ 配置文件未找到: {CONFIG_PATH}")
+        return {}
+
+    with open(CONFIG_PATH, "r", encoding="utf-8") as f:
+        settings = json.load(f)
+    if not isinstance(settings, dict):
+        raise ValueError(f"配置文件顶层必须是 JSON 对象，实际为 {type(settings).__name__}")
+    return settings
+
+
+def _file_stamp() -> Optional[Tuple[int, int, int]]:
+    """文件指纹 (inode, mtime_ns, size)，任一变化即视为配置被修改/替换"""
     try:
-        # 检查文件是否存在
-        if not os.path.exists(CONFIG_PATH):
-            print(f"⚠️ 配置文件未找到: {CONFIG_PATH}")
-            return {}
-            
-        with open(CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception as e:
-        print(f"⚠️ 配置文件读取失败: {e}")
-        return {}
\ No newline at end of file
+        st = os.stat(CONFIG_PATH)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+class ConfigService:
+    """
+    阈值/电价配置服务：
+    - 解析后的配置常驻内存，并预先算好每个设备的 DeviceLimits
+    - 只有在文件 inode/mtime 变化 (或管理员手动触发) 时才重新加载
+    - version 每次重新加载后 +1，下游缓存可据此判断是否需要重建
+    - 文件读取 / 解析失败时保留当前配置与 version，错误记录在 last_error；
+      文件再次变化 (或手动 force) 之前不会重复解析同一份坏文件
+    """
+
+    def __init__(self, check_interval: float = CONFIG_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._failed_stamp: Optional[Tuple[int, int, int]] = None
+        self.last_error: Optional[str] = None
+        self._last_check = 0.0
+        self._settings: dict = {}
+        self._default_limits = self._build_default_limits({})
+        self._device_limits: Dict[int, DeviceLimits] = {}
+        self._electricity_price = BUILTIN_DEFAULTS["electricity_price"]
+        self.version = 0
+
+    # ---------------- 加载 ----------------
+    @staticmethod
+    def _build_default_limits(defaults: dict) -> DeviceLimits:
+        return DeviceLimits(
+            device_id=None,
+            current_max=float(defaults.get("current_max", BUILTIN_DEFAULTS["current_max"])),
+            voltage_min=float(defaults.get("voltage_min", BUILTIN_DEFAULTS["voltage_min"])),
+            voltage_max=float(defaults.get("voltage_max", BUILTIN_DEFAULTS["voltage_max"])),
+            power_max=float(defaults.get("power_max", BUILTIN_DEFAULTS["power_max"])),
+            current_rate_max=float(defaults.get("current_rate_max", BUILTIN_DEFAULTS["current_rate_max"])),
+            stuck_samples=int(defaults.get("stuck_samples", BUILTIN_DEFAULTS["stuck_samples"])),
+        )
+
+    def _apply(self, settings: dict):
+        defaults = settings.get("default", {})
+        default_limits = self._build_default_limits(defaults)
+
+        device_limits = {}
+        electricity_price = float(defaults.get("electricity_price", BUILTIN_DEFAULTS["electricity_price"]))
+        for key, dev_cfg in settings.get("device_thresholds", {}).items():
+            try:
+                device_id = int(key)
+            except (TypeError, ValueError):
+                print(f"⚠️ 忽略非法的设备阈值配置键: {key}")
+                continue
+            device_limits[device_id] = DeviceLimits(
+                device_id=device_id,
+                current_max=float(dev_cfg.get("current_max", default_limits.current_max)),
+                voltage_min=float(dev_cfg.get("voltage_min", default_limits.voltage_min)),
+                voltage_max=float(dev_cfg.get("voltage_max", default_limits.voltage_max)),
+                power_max=float(dev_cfg.get("power_max", default_limits.power_max)),
+                current_rate_max=float(dev_cfg.get("current_rate_max", default_limits.current_rate_max)),
+                stuck_samples=int(dev_cfg.get("stuck_samples", default_limits.stuck_samples)),
+                name=dev_cfg.get("name"),
+            )
+
+        # 整体替换引用，读者要么看到旧配置要么看到新配置，不会看到一半
+        self._settings = settings
+        self._default_limits = default_limits
+        self._device_limits = device_limits
+        self._electricity_price = electricity_price
+        self.version += 1
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        检查配置文件是否变化，变化 (或 force=True) 时重新加载
+        返回是否真的重新加载了；读取 / 解析失败时返回 False，当前配置不变，原因见 last_error
+        """
+        with self._lock:
+            self._last_check = time.monotonic()
+            stamp = _file_stamp()
+            if not force and self.version > 0 and stamp == self._stamp:
+                return False
+            if not force and self.last_error is not None and stamp == self._failed_stamp:
+                return False
+            try:
+                self._apply(_read_config_file())
+            except Exception as e:
+                self._failed_stamp = stamp
+                self.last_error = f"{e.__class__.__name__}: {e}"
+                logger.error(f"❌ [Config] 配置文件解析失败，继续使用当前配置 (version={self.version}): {self.last_error}")
+                return False
+            self._stamp = stamp
+            self.last_error = None
+            print(f"🔧 [Config] 阈值配置已加载 (version={self.version})")
+            return True
+
+    def _maybe_reload(self):
+        if self._last_check == 0.0 or time.monotonic() - self._last_check >= self.check_interval:
+            self.reload()
+
+    # ---------------- 查询 ----------------
+    def get_settings(self) -> dict:
+        """返回完整的原始配置字典 (只读，请勿修改)"""
+        self._maybe_reload()
+        return self._settings
+
+    def limits_for(self, device_id: int) -> DeviceLimits:
+        """获取设备最终生效的阈值，没有单独配置则返回默认阈值"""
+        self._maybe_reload()
+        return self._device_limits.get(device_id, self._default_limits)
+
+    def all_limits(self) -> Tuple[DeviceLimits, Dict[int, DeviceLimits]]:
+        """返回 (默认阈值, {device_id: 设备阈值})，供批量规则编译使用"""
+        self._maybe_reload()
+        return self._default_limits, self._device_limits
+
+    @property
+    def electricity_price(self) -> float:
+        self._maybe_reload()
+        return self._electricity_price
+
+    def info(self) -> dict:
+        return {
+            "path": CONFIG_PATH,
+            "version": self.version,
+            "device_count": len(self._device_limits),
+            "electricity_price": self._electricity_price,
+            "error": self.last_error,
+        }
+
+
+# 全局配置服务实例
+config_service = ConfigService()
+
+
+def load_thresholds():
+    """返回报警阈值配置 (内存缓存，文件变化时自动重新加载)"""
+    return config_service.get_settings()
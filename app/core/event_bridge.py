@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+# 溢出策略
+DROP_OLDEST = "drop_oldest"   # 队列满时丢弃最旧的一条
+CONFLATE = "conflate"         # 同一个 key (例如同一设备) 只保留最新一条，队列满时丢弃最旧的 key
+BLOCK = "block"               # 队列满时阻塞生产者线程 (最多 block_timeout 秒)，超时仍满则丢弃
+POLICIES = (DROP_OLDEST, CONFLATE, BLOCK)
+
+
+class LoopBridge:
+    """
+    从任意线程 (例如 paho 的网络线程) 向 asyncio 事件循环投递消息的有界桥：
+    - submit() 线程安全，只在生产者侧做有界缓冲，不会在事件循环里堆积无限多的回调
+    - 仅在缓冲区从空变为非空时通过 loop.call_soon_threadsafe 唤醒一次分发任务
+    - 单个分发任务 (dispatcher) 在事件循环里依次 await handler(item)
+    - 统计入队 / 丢弃 / 合并 / 分发条数以及排队延迟
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        maxsize: int = 10000,
+        policy: str = DROP_OLDEST,
+        key_func: Optional[Callable[[Any], Hashable]] = None,
+        block_timeout: float = 1.0,
+        name: str = "bridge",
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"未知的溢出策略: {policy}")
+        if policy == CONFLATE and key_func is None:
+            raise ValueError("conflate 策略需要提供 key_func")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.key_func = key_func
+        self.block_timeout = block_timeout
+        self.name = name
+
+        self._lock = threading.Condition()
+        self._items = OrderedDict() if policy == CONFLATE else deque()
+        self._seq = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._event: Optional[asyncio.Event] = None
+        self._wake_pending = False
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+        # 统计计数
+        self.enqueued = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.dispatched = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        self.latency_max = 0.0
+
+    # ---------------- 生命周期 (事件循环内调用) ----------------
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._event = asyncio.Event()
+        self._running = True
+        self._task = self._loop.create_task(self._dispatch_loop(), name=f"{self.name}-dispatcher")
+
+    async def stop(self, drain: bool = True):
+        """停止分发任务；drain=True 时先把已缓冲的消息分发完"""
+        self._running = False
+        if self._event:
+            self._event.set()
+        if self._task:
+            if drain:
+                await self._task
+            else:
+                self._task.cancel()
+            self._task = None
+        with self._lock:
+            self._lock.notify_all()
+
+    # ---------------- 生产者 (任意线程) ----------------
+    def submit(self, item: Any) -> bool:
+        """投递一条消息，返回是否被接受 (被丢弃时返回 False)"""
+        if not self._running or self._loop is None:
+            self.dropped += 1
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            if self.policy == CONFLATE:
+                key = self.key_func(item)
+                if key in self._items:
+                    # 同一 key 还没来得及分发，直接替换为最新值 (保留原来的排队时间，延迟统计更真实)
+                    self._items[key] = (item, self._items[key][1])
+                    self.conflated += 1
+                    self.enqueued += 1
+                    return True
+                if len(self._items) >= self.maxsize:
+                    self._items.popitem(last=False)
+                    self.dropped += 1
+                self._items[key] = (item, now)
+            else:
+                if len(self._items) >= self.maxsize:
+                    # 事件循环线程自己投递时不能阻塞，否则会死锁，退化为丢弃最旧
+                    if self.policy == BLOCK and threading.get_ident() != self._loop_thread:
+                        deadline = now + self.block_timeout
+                        while len(self._items) >= self.maxsize and self._running:
+                            remaining = deadline - time.monotonic()
+                            if remaining <= 0:
+                                break
+                            self._lock.wait(remaining)
+                        if len(self._items) >= self.maxsize:
+                            self.dropped += 1
+                            return False
+                    else:
+                        self._items.popleft()
+                        self.dropped += 1
+                self._items.append((item, now))
+
+            self.enqueued += 1
+            need_wake = not self._wake_pending
+            self._wake_pending = True
+
+        if need_wake:
+            try:
+                self._loop.call_soon_threadsafe(self._event.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+        return True
+
+    # ---------------- 分发任务 (事件循环内) ----------------
+    def _take_all(self):
+        with self._lock:
+            self._wake_pending = False
+            if not self._items:
+                return []
+            if self.policy == CONFLATE:
+                batch = list(self._items.values())
+                self._items = OrderedDict()
+            else:
+                batch = list(self._items)
+                self._items.clear()
+            # 腾出空间，唤醒被阻塞的生产者
+            self._lock.notify_all()
+        return batch
+
+    async def _dispatch_loop(self):
+        while True:
+            await self._event.wait()
+            self._event.clear()
+            batch = self._take_all()
+            for item, enqueued_at in batch:
+                latency = time.monotonic() - enqueued_at
+                self.latency_sum += latency
+                self.latency_max = max(self.latency_max, latency)
+                try:
+                    await self.handler(item)
+                    self.dispatched += 1
+                except Exception:
+                    self.errors += 1
+            if not self._running:
+                # 停止前再检查一次是否有残留
+                if not self._take_pending_left():
+                    break
+
+    def _take_pending_left(self) -> bool:
+        with self._lock:
+            left = bool(self._items)
+        if left:
+            self._event.set()
+        return left
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth = len(self._items)
+        handled = self.dispatched + self.errors
+        return {
+            "policy": self.policy,
+            "maxsize": self.maxsize,
+            "depth": depth,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+            "dispatched": self.dispatched,
+            "errors": self.errors,
+            "latency_avg_ms": round(self.latency_sum / handled * 1000, 3) if handled else 0.0,
+            "latency_max_ms": round(self.latency_max * 1000, 3),
+        }
@@ -1,5 +1,6 @@
 import os
 import redis.asyncio as redis
+import redis as sync_redis
 from typing import Optional
 
 # 从环境变量获取 Redis URL，默认为本地开发地址
@@ -7,6 +8,7 @@ REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
 
 class RedisClient:
     _client: Optional[redis.Redis] = None
+    _sync_client: Optional[sync_redis.Redis] = None
 
     @classmethod
     def get_client(cls) -> redis.Redis:
@@ -20,12 +22,28 @@ class RedisClient:
             )
         return cls._client
 
+    @classmethod
+    def get_sync_client(cls) -> sync_redis.Redis:
+        """获取同步 Redis 客户端（单例，供 MQTT / 入库等后台线程使用）"""
+        if cls._sync_client is None:
+            cls._sync_client = sync_redis.from_url(
+                REDIS_URL,
+                encoding="utf-8",
+                decode_responses=True,
+                socket_timeout=2,
+                socket_connect_timeout=2,
+            )
+        return cls._sync_client
+
     @classmethod
     async def close(cls):
         """关闭连接"""
         if cls._client:
             await cls._client.close()
             cls._client = None
+        if cls._sync_client:
+            cls._sync_client.close()
+            cls._sync_client = None
 
 # 导出获取客户端的函数，方便调用
 async def get_redis() -> redis.Redis:
@@ -1,28 +1,291 @@
-from typing import List
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional, Set
 from fastapi import WebSocket
+from app.core.event_bridge import CONFLATE, LoopBridge
+from app.core.logger import logger
+
+# MQTT 线程 -> 事件循环 桥接配置
+WS_BRIDGE_MAXSIZE = int(os.getenv("WS_BRIDGE_MAXSIZE", "10000"))
+WS_BRIDGE_POLICY = os.getenv("WS_BRIDGE_POLICY", CONFLATE)  # drop_oldest | conflate | block
+
+# 单个连接的发送队列长度 / 单次发送的最长等待秒数，超过即视为慢客户端并断开
+WS_CLIENT_QUEUE_SIZE = int(os.getenv("WS_CLIENT_QUEUE_SIZE", "256"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "5"))
+# 用于计算 p50 / p99 扇出延迟的最近样本数
+WS_LATENCY_SAMPLES = int(os.getenv("WS_LATENCY_SAMPLES", "20000"))
+# 客户端可申请的最高推送频率 (次/秒)，0 表示不限速
+WS_MAX_RATE_CAP = float(os.getenv("WS_MAX_RATE_CAP", "50"))
+
+
+def serialize(message: dict) -> str:
+    """与 WebSocket.send_json 相同的编码方式，但每条消息只序列化一次"""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+class ClientConnection:
+    """
+    单个 WebSocket 连接：有界发送队列 + 独立的写任务
+    - device_ids: 订阅的设备集合，None 表示全部设备 (未发送过订阅消息的老客户端)
+    - interval: 限速后的最小推送间隔 (秒)，0 表示实时推送
+    - pending: 限速模式下每个设备只保留最新一条遥测，由 flusher 按间隔放入发送队列
+    """
+
+    __slots__ = (
+        "websocket", "queue", "writer", "sent", "closed",
+        "device_ids", "interval", "pending", "wake", "flusher", "conflated",
+    )
+
+    def __init__(self, websocket: WebSocket, queue_size: int):
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.closed = False
+        self.device_ids: Optional[Set[int]] = None
+        self.interval = 0.0
+        self.pending: Dict[int, tuple] = {}
+        self.wake = asyncio.Event()
+        self.flusher: Optional[asyncio.Task] = None
+        self.conflated = 0
+
+    def subscription(self) -> dict:
+        return {
+            "device_ids": sorted(self.device_ids) if self.device_ids is not None else None,
+            "max_rate": round(1 / self.interval, 3) if self.interval else 0,
+        }
+
 
 class ConnectionManager:
-    def __init__(self):
+    """
+    WebSocket 广播引擎：
+    - broadcast() 把消息序列化一次，然后放进每个连接自己的有界队列 (不 await 任何一个客户端)
+    - 每个连接有独立的写任务，慢客户端只会拖慢自己
+    - 队列溢出或单次发送超过 WS_SEND_TIMEOUT 的客户端会被断开 (慢消费者驱逐)
+    - 记录 "广播调用 -> 实际发出" 的延迟，用于统计 p50 / p99
+    - 支持按设备订阅 + 限速：带 device_id 的消息只发给订阅了该设备的客户端，
+      限速客户端的 telemetry_update 按设备合并，只推送每个间隔内的最新值
+    """
+
+    def __init__(self, queue_size: int = WS_CLIENT_QUEUE_SIZE, send_timeout: float = WS_SEND_TIMEOUT):
         # 存放所有活跃的 WebSocket 连接
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, ClientConnection] = {}
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+
+        # 统计计数
+        self.broadcasts = 0
+        self.evicted = 0
+        self.latencies = deque(maxlen=WS_LATENCY_SAMPLES)
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        client = ClientConnection(websocket, self.queue_size)
+        client.writer = asyncio.create_task(self._writer(client))
+        self.active_connections[websocket] = client
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        client = self.active_connections.pop(websocket, None)
+        if client and not client.closed:
+            client.closed = True
+            for task in (client.writer, client.flusher):
+                if task and task is not asyncio.current_task():
+                    task.cancel()
+
+    def _evict(self, client: ClientConnection, reason: str):
+        """断开慢客户端 (不 await，避免阻塞广播路径)"""
+        if client.closed:
+            return
+        self.evicted += 1
+        logger.warning(f"🐢 [WebSocket] 断开慢客户端: {reason}")
+        self.disconnect(client.websocket)
+        asyncio.create_task(self._close_quietly(client.websocket))
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket):
+        try:
+            await websocket.close(code=1013)  # 1013: Try Again Later
+        except Exception:
+            pass
+
+    # ---------------- 订阅管理 ----------------
+    def subscribe(self, websocket: WebSocket, device_ids: Optional[Iterable[int]]) -> Optional[dict]:
+        """追加订阅设备；device_ids=None 表示恢复为订阅全部设备"""
+        client = self.active_connections.get(websocket)
+        if client is None:
+            return None
+        if device_ids is None:
+            client.device_ids = None
+        else:
+            client.device_ids = (client.device_ids or set()) | set(device_ids)
+        return client.subscription()
 
+    def unsubscribe(self, websocket: WebSocket, device_ids: Optional[Iterable[int]]) -> Optional[dict]:
+        """取消订阅设备；device_ids=None 表示全部取消 (之后只收到不带设备号的消息)"""
+        client = self.active_connections.get(websocket)
+        if client is None:
+            return None
+        if device_ids is None:
+            client.device_ids = set()
+        elif client.device_ids is not None:
+            # "全部设备" 状态下调用方需要先用 subscribe() 展开为具体设备集合
+            client.device_ids -= set(device_ids)
+        for device_id in list(client.pending):
+            if device_id not in client.device_ids:
+                client.pending.pop(device_id, None)
+        return client.subscription()
+
+    def set_rate(self, websocket: WebSocket, max_rate: float) -> Optional[dict]:
+        """设置推送频率上限 (次/秒/设备)，0 表示不限速"""
+        client = self.active_connections.get(websocket)
+        if client is None:
+            return None
+        if max_rate and max_rate > 0:
+            if WS_MAX_RATE_CAP > 0:
+                max_rate = min(max_rate, WS_MAX_RATE_CAP)
+            client.interval = 1.0 / max_rate
+            if client.flusher is None:
+                client.flusher = asyncio.create_task(self._flusher(client))
+        else:
+            client.interval = 0.0
+            if client.flusher is not None:
+                client.flusher.cancel()
+                client.flusher = None
+            # 不限速后把积压的最新值立即发出
+            self._drain_pending(client)
+        return client.subscription()
+
+    def send_personal(self, websocket: WebSocket, message: dict):
+        """只发给某一个客户端 (订阅确认 / 错误提示 / pong)，同样走发送队列"""
+        client = self.active_connections.get(websocket)
+        if client is not None:
+            self._enqueue(client, serialize(message), time.monotonic())
+
+    # ---------------- 广播 ----------------
     async def broadcast(self, message: dict):
         """向所有连接的客户端发送消息"""
-        # 遍历所有连接，发送 JSON 数据
-        for connection in self.active_connections:
-            try:
-                await connection.send_json(message)
-            except Exception:
-                # 如果发送失败（比如连接断开），移除该连接
-                self.disconnect(connection)
+        data = message.get("data")
+        device_id = data.get("device_id") if isinstance(data, dict) else None
+        self.broadcast_text(
+            serialize(message),
+            device_id=device_id,
+            conflate=message.get("type") == "telemetry_update",
+        )
+
+    def broadcast_text(self, text: str, device_id: Optional[int] = None, conflate: bool = False):
+        """
+        把已序列化好的消息放进每个连接的发送队列
+        - device_id 不为空时只发给订阅了该设备的客户端
+        - conflate=True (最新值语义的遥测) 且客户端限速时，放入该客户端的最新值槽位，由 flusher 定时发送
+        """
+        self.broadcasts += 1
+        now = time.monotonic()
+        # 先拷贝一份列表，驱逐时会修改 active_connections
+        for client in list(self.active_connections.values()):
+            if device_id is not None and client.device_ids is not None and device_id not in client.device_ids:
+                continue
+            if conflate and client.interval and device_id is not None:
+                if device_id in client.pending:
+                    client.conflated += 1
+                    # 保留原来的排队时间，延迟统计更真实
+                    client.pending[device_id] = (text, client.pending[device_id][1])
+                else:
+                    client.pending[device_id] = (text, now)
+                client.wake.set()
+                continue
+            self._enqueue(client, text, now)
+
+    def _enqueue(self, client: ClientConnection, text: str, enqueued_at: float) -> bool:
+        try:
+            client.queue.put_nowait((text, enqueued_at))
+            return True
+        except asyncio.QueueFull:
+            self._evict(client, "发送队列已满")
+            return False
+
+    def _drain_pending(self, client: ClientConnection):
+        pending, client.pending = client.pending, {}
+        for text, enqueued_at in pending.values():
+            if not self._enqueue(client, text, enqueued_at):
+                return
+
+    async def _flusher(self, client: ClientConnection):
+        """限速客户端：每个间隔最多把各设备的最新值推送一次"""
+        try:
+            while not client.closed:
+                await client.wake.wait()
+                client.wake.clear()
+                self._drain_pending(client)
+                await asyncio.sleep(client.interval)
+        except asyncio.CancelledError:
+            pass
+
+    async def _writer(self, client: ClientConnection):
+        websocket = client.websocket
+        try:
+            while True:
+                text, enqueued_at = await client.queue.get()
+                try:
+                    await asyncio.wait_for(websocket.send_text(text), timeout=self.send_timeout)
+                except asyncio.TimeoutError:
+                    self._evict(client, f"发送超时 (> {self.send_timeout}s)")
+                    return
+                except Exception:
+                    # 如果发送失败（比如连接断开），移除该连接
+                    self.disconnect(websocket)
+                    return
+                client.sent += 1
+                self.latencies.append(time.monotonic() - enqueued_at)
+        except asyncio.CancelledError:
+            pass
+
+    async def close_all(self):
+        """应用关闭时停止所有写任务"""
+        clients = list(self.active_connections.values())
+        for client in clients:
+            self.disconnect(client.websocket)
+        writers = [c.writer for c in clients if c.writer]
+        if writers:
+            await asyncio.gather(*writers, return_exceptions=True)
+
+    def stats(self) -> dict:
+        samples = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if not samples:
+                return 0.0
+            return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 3)
+
+        return {
+            "connections": len(self.active_connections),
+            "broadcasts": self.broadcasts,
+            "evicted": self.evicted,
+            "queued": sum(c.queue.qsize() for c in self.active_connections.values()),
+            "rate_limited": sum(1 for c in self.active_connections.values() if c.interval),
+            "conflated": sum(c.conflated for c in self.active_connections.values()),
+            "latency_p50_ms": percentile(0.50),
+            "latency_p99_ms": percentile(0.99),
+            "latency_max_ms": round(samples[-1] * 1000, 3) if samples else 0.0,
+            "latency_samples": len(samples),
+        }
+
+
+def message_key(message: dict):
+    """conflate 策略的合并键：同一类型、同一设备的消息只保留最新一条"""
+    data = message.get("data") or {}
+    return (message.get("type"), data.get("device_id"))
 
 # 实例化一个全局对象供其他模块使用
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
+
+# MQTT 网络线程通过 ws_bridge.submit() 把消息安全地交给事件循环，再由单个分发任务广播
+ws_bridge = LoopBridge(
+    handler=manager.broadcast,
+    maxsize=WS_BRIDGE_MAXSIZE,
+    policy=WS_BRIDGE_POLICY,
+    key_func=message_key,
+    name="ws-bridge",
+)
@@ -0,0 +1,464 @@
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+from sqlalchemy.engine import Engine
+from sqlmodel import text
+from app.core.logger import logger
+
+# 首次创建连续聚合时，是否立即把历史数据全部物化 (大表可能耗时较长，可关闭后交给刷新策略慢慢补)
+CAGG_BACKFILL = os.getenv("CAGG_BACKFILL", "1") == "1"
+# 迟到数据 (spool 回放、补传的历史批次) 落在刷新策略窗口之外时，按该间隔 (秒) 合并后手动刷新受影响的时间段；0 表示关闭
+CAGG_LATE_REFRESH_INTERVAL = float(os.getenv("CAGG_LATE_REFRESH_INTERVAL", "60"))
+
+# 原始 1Hz 数据 (devicedata) 的生命周期策略，每次启动时幂等地应用；留空表示关闭对应策略
+TS_CHUNK_INTERVAL = os.getenv("TS_CHUNK_INTERVAL", "1 day")       # 新 chunk 的时间跨度 (只影响之后创建的 chunk)
+TS_COMPRESS_AFTER = os.getenv("TS_COMPRESS_AFTER", "7 days")      # 超过该时长的 chunk 压缩为列存
+TS_RAW_RETENTION = os.getenv("TS_RAW_RETENTION", "180 days")      # 超过该时长的原始 chunk 直接删除 (连续聚合保留)
+RAW_TABLE = "devicedata"
+COMPRESS_SEGMENTBY = "device_id"
+COMPRESS_ORDERBY = '"timestamp" DESC'
+
+
+@dataclass(frozen=True)
+class ContinuousAggregate:
+    """一个连续聚合视图的定义及其刷新策略"""
+    name: str
+    bucket_seconds: int
+    bucket_interval: str
+    source: str                 # 数据来源：原始超表或下一级聚合 (分层聚合)
+    start_offset: str           # 刷新策略：每次重新物化 [now - start_offset, now - end_offset)
+    end_offset: str
+    schedule_interval: str
+
+
+# 每个视图的列都一致，查询层可以统一处理：
+# device_id, bucket, samples, {voltage,current,power}_{min,max,avg}, energy_first, energy_last
+AGGREGATES: List[ContinuousAggregate] = [
+    ContinuousAggregate("devicedata_1m", 60, "1 minute", "devicedata", "3 hours", "1 minute", "1 minute"),
+    ContinuousAggregate("devicedata_1h", 3600, "1 hour", "devicedata_1m", "3 days", "1 hour", "30 minutes"),
+    ContinuousAggregate("devicedata_1d", 86400, "1 day", "devicedata_1h", "40 days", "1 day", "1 hour"),
+]
+
+FIELDS = ("voltage", "current", "power")
+
+
+def _raw_select(agg: ContinuousAggregate) -> str:
+    """从原始 1Hz 数据聚合"""
+    stats = ",\n    ".join(
+        f'min("{f}") AS {f}_min, max("{f}") AS {f}_max, avg("{f}") AS {f}_avg' for f in FIELDS
+    )
+    return f"""
+SELECT
+    device_id,
+    time_bucket(INTERVAL '{agg.bucket_interval}', "timestamp") AS bucket,
+    count(*) AS samples,
+    {stats},
+    first(energy, "timestamp") AS energy_first,
+    last(energy, "timestamp") AS energy_last
+FROM devicedata
+GROUP BY device_id, bucket"""
+
+
+def _rollup_select(agg: ContinuousAggregate) -> str:
+    """从下一级聚合再聚合：平均值按样本数加权，电能取首尾"""
+    stats = ",\n    ".join(
+        f"min({f}_min) AS {f}_min, max({f}_max) AS {f}_max, "
+        f"sum({f}_avg * samples) / sum(samples) AS {f}_avg"
+        for f in FIELDS
+    )
+    return f"""
+SELECT
+    device_id,
+    time_bucket(INTERVAL '{agg.bucket_interval}', bucket) AS bucket,
+    sum(samples)::bigint AS samples,
+    {stats},
+    first(energy_first, bucket) AS energy_first,
+    last(energy_last, bucket) AS energy_last
+FROM {agg.source}
+GROUP BY device_id, time_bucket(INTERVAL '{agg.bucket_interval}', bucket)"""
+
+
+def create_statement(agg: ContinuousAggregate) -> str:
+    body = _raw_select(agg) if agg.source == "devicedata" else _rollup_select(agg)
+    # materialized_only = false: 查询时自动拼上尚未物化的最新数据 (实时聚合)
+    return (
+        f"CREATE MATERIALIZED VIEW IF NOT EXISTS {agg.name}\n"
+        f"WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS{body}\n"
+        f"WITH NO DATA"
+    )
+
+
+def existing_aggregates(conn) -> set:
+    rows = conn.execute(text(
+        "SELECT view_name FROM timescaledb_information.continuous_aggregates"
+    )).all()
+    return {r[0] for r in rows}
+
+
+def setup_continuous_aggregates(engine: Engine) -> bool:
+    """
+    创建 1 分钟 / 1 小时 / 1 天 三级连续聚合以及刷新策略 (幂等，可在每次启动时调用)
+    - 连续聚合的创建 / 手动刷新不能在事务块内执行，这里使用 AUTOCOMMIT 连接
+    - 新建的视图按 CAGG_BACKFILL 决定是否立即物化历史数据
+    返回是否全部就绪
+    """
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # 首次物化历史数据可能远超接口的语句超时
+            conn.execute(text("SET statement_timeout = 0"))
+            existing = existing_aggregates(conn)
+            for agg in AGGREGATES:
+                created = agg.name not in existing
+                if created:
+                    conn.execute(text(create_statement(agg)))
+                    conn.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{agg.name}_device_bucket ON {agg.name} (device_id, bucket DESC)"
+                    ))
+                conn.execute(text(
+                    "SELECT add_continuous_aggregate_policy(:view, "
+                    "start_offset => CAST(:start AS INTERVAL), end_offset => CAST(:end AS INTERVAL), "
+                    "schedule_interval => CAST(:schedule AS INTERVAL), if_not_exists => TRUE)"
+                ), {"view": agg.name, "start": agg.start_offset, "end": agg.end_offset, "schedule": agg.schedule_interval})
+                if created and CAGG_BACKFILL:
+                    logger.info(f"⏳ [TimescaleDB] 正在物化 {agg.name} 的历史数据...")
+                    conn.execute(text(
+                        "CALL refresh_continuous_aggregate(:view, NULL, now()::timestamp - CAST(:end AS INTERVAL))"
+                    ), {"view": agg.name, "end": agg.end_offset})
+                if created:
+                    logger.info(f"✅ [TimescaleDB] 连续聚合 {agg.name} 已创建")
+        return True
+    except Exception as e:
+        # 普通 PostgreSQL / 版本过低 (分层聚合需要 TimescaleDB 2.9+) 时跳过，查询层会回退到原始表
+        logger.warning(f"⚠️ [TimescaleDB] 连续聚合创建失败 (如果是普通 PostgreSQL 请忽略): {e}")
+        return False
+
+
+
+# =================================================================
+# 迟到数据：刷新策略窗口之外的手动刷新
+# =================================================================
+_UNIT_SECONDS = {"minute": 60, "hour": 3600, "day": 86400, "week": 604800}
+_BUCKET_ORIGIN = datetime(2000, 1, 3)  # 与 time_bucket 的默认起点一致
+
+
+def _interval_seconds(interval: str) -> int:
+    """把 "3 hours" / "40 days" 这类策略配置换算成秒"""
+    amount, unit = interval.split()
+    return int(amount) * _UNIT_SECONDS[unit.lower().rstrip("s")]
+
+
+def refresh_window(agg: ContinuousAggregate, start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    """把 [start, end] 向外对齐到整桶 (refresh_continuous_aggregate 只物化完全落在窗口内的桶)"""
+    bucket = timedelta(seconds=agg.bucket_seconds)
+    lo = _BUCKET_ORIGIN + (start - _BUCKET_ORIGIN) // bucket * bucket
+    hi = _BUCKET_ORIGIN + ((end - _BUCKET_ORIGIN) // bucket + 1) * bucket
+    return lo, hi
+
+
+class LateDataRefresher:
+    """
+    刷新策略只重新物化最近一段时间 (devicedata_1m 为 [now - 3h, now - 1m))，
+    更早的读数 (spool 回放、设备补传) 写入后不会自动进入 1m / 1h / 1d 聚合：
+    - mark() 由写库路径在提交后调用，只记录早于最短刷新窗口的时间段 (实时数据直接跳过，开销只是一次比较)
+    - 后台线程按间隔把记录的时间段合并成一个 [min, max] 窗口，从 1m 到 1d 逐级手动刷新；
+      每一级只在窗口早于该级刷新策略的覆盖范围时才刷新，其余交给策略
+    """
+
+    def __init__(self, engine: Engine, interval: float = CAGG_LATE_REFRESH_INTERVAL):
+        self.engine = engine
+        self.interval = interval
+        self.horizon = min(_interval_seconds(a.start_offset) for a in AGGREGATES if a.source == RAW_TABLE)
+        self._window: Optional[Tuple[float, float]] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.refreshes = 0
+        self.failures = 0
+
+    def mark(self, first_ts: float, last_ts: float):
+        """记录一批刚写入的读数的时间范围 (epoch 秒)"""
+        if self.interval <= 0 or first_ts >= time.time() - self.horizon:
+            return
+        with self._lock:
+            if self._window is None:
+                self._window = (first_ts, last_ts)
+            else:
+                self._window = (min(self._window[0], first_ts), max(self._window[1], last_ts))
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="cagg-late-refresh", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """停止后台线程，并把尚未刷新的时间段立即刷新掉"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self) -> bool:
+        with self._lock:
+            window, self._window = self._window, None
+        if window is None:
+            return True
+        start, end = datetime.fromtimestamp(window[0]), datetime.fromtimestamp(window[1])
+        try:
+            self.refresh(start, end)
+            self.refreshes += 1
+            return True
+        except Exception as e:
+            # 放回去下次再刷 (与期间新记录的时间段合并)
+            self.failures += 1
+            with self._lock:
+                if self._window is not None:
+                    window = (min(self._window[0], window[0]), max(self._window[1], window[1]))
+                self._window = window
+            logger.warning(f"⚠️ [TimescaleDB] 迟到数据的连续聚合刷新失败，稍后重试: {e}")
+            return False
+
+    def refresh(self, start: datetime, end: datetime):
+        """逐级刷新 [start, end] 覆盖的桶：下一级 (1h / 1d) 从上一级聚合，必须按顺序刷新"""
+        now = datetime.now()
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SET statement_timeout = 0"))
+            for agg in AGGREGATES:
+                if start >= now - timedelta(seconds=_interval_seconds(agg.start_offset)):
+                    continue  # 整段都在刷新策略的覆盖范围内
+                lo, hi = refresh_window(agg, start, end)
+                conn.execute(text(
+                    "CALL refresh_continuous_aggregate(:view, CAST(:start AS TIMESTAMP), CAST(:end AS TIMESTAMP))"
+                ), {"view": agg.name, "start": lo, "end": hi})
+                logger.info(f"🔁 [TimescaleDB] 已刷新 {agg.name} 的迟到数据 [{lo}, {hi})")
+
+
+# =================================================================
+# 原始数据生命周期：chunk 大小 / 压缩 / 保留
+# =================================================================
+def _interval_equal(conn, a: Optional[str], b: Optional[str]) -> bool:
+    if not a or not b:
+        return not a and not b
+    return bool(conn.execute(
+        text("SELECT CAST(:a AS INTERVAL) = CAST(:b AS INTERVAL)"), {"a": a, "b": b}
+    ).scalar())
+
+
+def _policy_setting(conn, proc_name: str, key: str) -> Optional[str]:
+    """读取 devicedata 上某类后台策略的当前配置 (没有该策略时返回 None)"""
+    return conn.execute(text(
+        "SELECT config ->> :key FROM timescaledb_information.jobs "
+        "WHERE proc_name = :proc AND hypertable_name = :table LIMIT 1"
+    ), {"key": key, "proc": proc_name, "table": RAW_TABLE}).scalar()
+
+
+def _normalize(expr: Optional[str]) -> str:
+    return " ".join((expr or "").replace('"', "").lower().replace("nulls first", "").split())
+
+
+def _compression_matches(conn) -> Optional[bool]:
+    """
+    当前压缩设置是否已经是 segmentby=device_id, orderby=timestamp DESC
+    TimescaleDB 2.14 起改用 hypertable_compression_settings 视图，两种都读不到时返回 None
+    """
+    try:
+        row = conn.execute(text(
+            "SELECT segmentby, orderby FROM timescaledb_information.hypertable_compression_settings "
+            "WHERE hypertable = CAST(:table AS regclass)"
+        ), {"table": RAW_TABLE}).first()
+        if row is None:
+            return False
+        return _normalize(row[0]) == _normalize(COMPRESS_SEGMENTBY) and _normalize(row[1]) == _normalize(COMPRESS_ORDERBY)
+    except Exception:
+        pass
+    try:
+        rows = conn.execute(text(
+            "SELECT attname, segmentby_column_index, orderby_column_index, orderby_asc "
+            "FROM timescaledb_information.compression_settings WHERE hypertable_name = :table"
+        ), {"table": RAW_TABLE}).all()
+    except Exception:
+        return None
+    segmentby = [r[0] for r in rows if r[1] is not None]
+    orderby = [(r[0], r[3]) for r in sorted((r for r in rows if r[2] is not None), key=lambda r: r[2])]
+    return segmentby == [COMPRESS_SEGMENTBY] and orderby == [("timestamp", False)]
+
+
+def _retention_too_short(conn, retention: str) -> Optional[str]:
+    """
+    保留期必须比直接读原始表的连续聚合的刷新窗口长，否则刷新会把已删除区间的聚合结果也清空
+    过短时返回冲突的刷新窗口
+    """
+    for agg in AGGREGATES:
+        if agg.source == RAW_TABLE and conn.execute(text(
+            "SELECT CAST(:retention AS INTERVAL) <= CAST(:offset AS INTERVAL)"
+        ), {"retention": retention, "offset": agg.start_offset}).scalar():
+            return agg.start_offset
+    return None
+
+
+def apply_lifecycle_policies(
+    engine: Engine,
+    chunk_interval: Optional[str] = TS_CHUNK_INTERVAL,
+    compress_after: Optional[str] = TS_COMPRESS_AFTER,
+    retention: Optional[str] = TS_RAW_RETENTION,
+) -> dict:
+    """
+    把 devicedata 的 chunk 大小 / 压缩 / 保留策略调整为给定配置 (幂等，可在每次启动时调用)：
+    - 与数据库中已有设置一致的项直接跳过，不一致的先移除旧策略再添加
+    - 保留策略只删除原始超表的 chunk，连续聚合 (1m / 1h / 1d) 的数据不受影响
+    返回 {"changed": [...], "skipped": [...], "errors": [...]}
+    """
+    result = {"changed": [], "skipped": [], "errors": []}
+    try:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # 1. chunk 时间跨度
+            if chunk_interval:
+                current = conn.execute(text(
+                    "SELECT time_interval::text FROM timescaledb_information.dimensions "
+                    "WHERE hypertable_name = :table AND dimension_type = 'Time' LIMIT 1"
+                ), {"table": RAW_TABLE}).scalar()
+                if _interval_equal(conn, current, chunk_interval):
+                    result["skipped"].append(f"chunk_interval={chunk_interval}")
+                else:
+                    conn.execute(text(
+                        "SELECT set_chunk_time_interval(:table, CAST(:interval AS INTERVAL))"
+                    ), {"table": RAW_TABLE, "interval": chunk_interval})
+                    result["changed"].append(f"chunk_interval: {current} -> {chunk_interval}")
+
+            # 2. 压缩：先开启列存压缩 (按设备分段、按时间倒序)，再设置后台压缩策略
+            if compress_after:
+                enabled = conn.execute(text(
+                    "SELECT compression_enabled FROM timescaledb_information.hypertables WHERE hypertable_name = :table"
+                ), {"table": RAW_TABLE}).scalar()
+                if enabled and _compression_matches(conn) is not False:
+                    result["skipped"].append("compression settings")
+                else:
+                    try:
+                        conn.execute(text(
+                            f"ALTER TABLE {RAW_TABLE} SET (timescaledb.compress, "
+                            f"timescaledb.compress_segmentby = '{COMPRESS_SEGMENTBY}', "
+                            f"timescaledb.compress_orderby = '{COMPRESS_ORDERBY}')"
+                        ))
+                        result["changed"].append(f"compression: segmentby={COMPRESS_SEGMENTBY}, orderby={COMPRESS_ORDERBY}")
+                    except Exception as e:
+                        # 已有压缩 chunk 时不允许修改压缩设置，需要先解压
+                        result["errors"].append(f"compression settings: {e.__class__.__name__}: {e}")
+                current = _policy_setting(conn, "policy_compression", "compress_after")
+                if _interval_equal(conn, current, compress_after):
+                    result["skipped"].append(f"compress_after={compress_after}")
+                else:
+                    conn.execute(text("SELECT remove_compression_policy(:table, if_exists => TRUE)"), {"table": RAW_TABLE})
+                    conn.execute(text(
+                        "SELECT add_compression_policy(:table, compress_after => CAST(:after AS INTERVAL))"
+                    ), {"table": RAW_TABLE, "after": compress_after})
+                    result["changed"].append(f"compress_after: {current} -> {compress_after}")
+            elif _policy_setting(conn, "policy_compression", "compress_after") is not None:
+                conn.execute(text("SELECT remove_compression_policy(:table, if_exists => TRUE)"), {"table": RAW_TABLE})
+                result["changed"].append("compression policy removed")
+
+            # 3. 原始数据保留期
+            if retention:
+                floor = _retention_too_short(conn, retention)
+                current = _policy_setting(conn, "policy_retention", "drop_after")
+                if floor:
+                    result["errors"].append(f"retention {retention} 不能短于连续聚合刷新窗口 {floor}，已忽略")
+                elif _interval_equal(conn, current, retention):
+                    result["skipped"].append(f"retention={retention}")
+                else:
+                    conn.execute(text("SELECT remove_retention_policy(:table, if_exists => TRUE)"), {"table": RAW_TABLE})
+                    conn.execute(text(
+                        "SELECT add_retention_policy(:table, drop_after => CAST(:after AS INTERVAL))"
+                    ), {"table": RAW_TABLE, "after": retention})
+                    result["changed"].append(f"retention: {current} -> {retention}")
+            elif _policy_setting(conn, "policy_retention", "drop_after") is not None:
+                conn.execute(text("SELECT remove_retention_policy(:table, if_exists => TRUE)"), {"table": RAW_TABLE})
+                result["changed"].append("retention policy removed")
+    except Exception as e:
+        logger.warning(f"⚠️ [TimescaleDB] 生命周期策略应用失败 (如果是普通 PostgreSQL 请忽略): {e}")
+        result["errors"].append(f"{e.__class__.__name__}: {e}")
+        return result
+
+    for change in result["changed"]:
+        logger.info(f"✅ [TimescaleDB] {change}")
+    for error in result["errors"]:
+        logger.warning(f"⚠️ [TimescaleDB] {error}")
+    return result
+
+
+def compress_chunks(engine: Engine, older_than: str) -> dict:
+    """立即压缩所有早于 older_than 的未压缩 chunk (不必等后台策略)，返回压缩的 chunk 数与耗时"""
+    started = time.time()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET statement_timeout = 0"))
+        chunks = conn.execute(text(
+            "SELECT compress_chunk(c, if_not_compressed => TRUE) "
+            "FROM show_chunks(:table, older_than => CAST(:older AS INTERVAL)) c"
+        ), {"table": RAW_TABLE, "older": older_than}).all()
+    return {"chunks": len(chunks), "elapsed": round(time.time() - started, 3)}
+
+
+def storage_stats(engine: Engine, limit: int = 100) -> dict:
+    """
+    存储概况：原始超表与连续聚合的体积、压缩率、每个 chunk 的时间范围 / 大小 / 压缩前后字节数，以及后台策略的运行状态
+    chunks 按时间倒序，最多 limit 个
+    """
+    with engine.connect() as conn:
+        total = conn.execute(text(
+            "SELECT table_bytes, index_bytes, toast_bytes, total_bytes FROM hypertable_detailed_size(:table)"
+        ), {"table": RAW_TABLE}).mappings().first()
+        compression = conn.execute(text(
+            "SELECT total_chunks, number_compressed_chunks, "
+            "before_compression_total_bytes, after_compression_total_bytes "
+            "FROM hypertable_compression_stats(:table)"
+        ), {"table": RAW_TABLE}).mappings().first()
+        chunks = conn.execute(text(
+            "SELECT c.chunk_name, c.range_start, c.range_end, c.is_compressed, s.total_bytes, "
+            "cs.before_compression_total_bytes, cs.after_compression_total_bytes "
+            "FROM timescaledb_information.chunks c "
+            "LEFT JOIN chunks_detailed_size(:table) s ON s.chunk_name = c.chunk_name "
+            "LEFT JOIN chunk_compression_stats(:table) cs ON cs.chunk_name = c.chunk_name "
+            "WHERE c.hypertable_name = :table ORDER BY c.range_start DESC LIMIT :limit"
+        ), {"table": RAW_TABLE, "limit": limit}).mappings().all()
+        aggregates = conn.execute(text(
+            "SELECT view_name, hypertable_size(format('%I.%I', materialization_hypertable_schema, "
+            "materialization_hypertable_name)::regclass) AS total_bytes "
+            "FROM timescaledb_information.continuous_aggregates ORDER BY view_name"
+        )).mappings().all()
+        jobs = conn.execute(text(
+            "SELECT j.job_id, j.proc_name, j.hypertable_name, j.schedule_interval::text AS schedule_interval, "
+            "j.config::text AS config, s.last_run_status, s.last_successful_finish, s.next_start, s.total_failures "
+            "FROM timescaledb_information.jobs j "
+            "LEFT JOIN timescaledb_information.job_stats s ON s.job_id = j.job_id "
+            "WHERE j.hypertable_name = :table OR j.proc_name = 'policy_refresh_continuous_aggregate' "
+            "ORDER BY j.job_id"
+        ), {"table": RAW_TABLE}).mappings().all()
+
+    def ratio(before, after):
+        return round(before / after, 2) if before and after else None
+
+    compression = dict(compression or {})
+    compression["ratio"] = ratio(
+        compression.get("before_compression_total_bytes"), compression.get("after_compression_total_bytes")
+    )
+    return {
+        "table": RAW_TABLE,
+        "size": dict(total or {}),
+        "compression": compression,
+        "policy": {
+            "chunk_interval": TS_CHUNK_INTERVAL or None,
+            "compress_after": TS_COMPRESS_AFTER or None,
+            "retention": TS_RAW_RETENTION or None,
+        },
+        "chunks": [
+            {**dict(c), "ratio": ratio(c["before_compression_total_bytes"], c["after_compression_total_bytes"])}
+            for c in chunks
+        ],
+        "aggregates": [dict(a) for a in aggregates],
+        "jobs": [dict(j) for j in jobs],
+    }
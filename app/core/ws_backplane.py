@@ -0,0 +1,211 @@
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+from app.core.logger import logger
+from app.core.redis import RedisClient
+from app.core.socket_manager import manager, serialize
+
+# Redis pub/sub 广播总线：多个 uvicorn worker / 多个容器共享同一份实时推送
+# - 入库侧 (MQTT 回调所在进程) 把每条消息序列化一次，批量 PUBLISH 到 Redis
+# - 每个 API 进程 PSUBSCRIBE 后直接把收到的文本交给本进程的 manager.broadcast_text，不再反序列化
+WS_BACKPLANE = os.getenv("WS_BACKPLANE", "").lower() in ("1", "true", "redis")
+WS_BACKPLANE_PREFIX = os.getenv("WS_BACKPLANE_PREFIX", "ems:ws")
+WS_BACKPLANE_MAX_BUFFER = int(os.getenv("WS_BACKPLANE_MAX_BUFFER", "50000"))     # 发布侧缓冲上限，满了丢最旧
+WS_BACKPLANE_FLUSH_INTERVAL = float(os.getenv("WS_BACKPLANE_FLUSH_INTERVAL", "0.02"))
+WS_BACKPLANE_PIPELINE_SIZE = int(os.getenv("WS_BACKPLANE_PIPELINE_SIZE", "1000"))  # 单次 pipeline 最多 PUBLISH 条数
+
+TELEMETRY_CHANNEL = f"{WS_BACKPLANE_PREFIX}:telemetry"  # + ":<device_id>"
+EVENT_CHANNEL = f"{WS_BACKPLANE_PREFIX}:event"          # 不属于某台设备的消息
+
+
+def channel_for(message: dict) -> str:
+    data = message.get("data")
+    device_id = data.get("device_id") if isinstance(data, dict) else None
+    if message.get("type") == "telemetry_update" and device_id is not None:
+        return f"{TELEMETRY_CHANNEL}:{device_id}"
+    if device_id is not None:
+        return f"{EVENT_CHANNEL}:{device_id}"
+    return EVENT_CHANNEL
+
+
+class RedisBackplane:
+    """
+    发布侧 (任意线程): publish() 只做序列化 + 入队，后台线程按批次用 pipeline PUBLISH
+    订阅侧 (事件循环): start() 启动订阅任务，断线后指数退避重连
+
+    慢订阅者：Redis 服务端的 client-output-buffer-limit pubsub 会断开跟不上的订阅连接，
+    这里统计重连次数；本进程内的慢客户端由 manager 的每连接队列负责驱逐，不会拖慢订阅任务
+    """
+
+    def __init__(self):
+        # 发布侧
+        self._buffer = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.published = 0
+        self.publish_dropped = 0
+        self.publish_errors = 0
+
+        # 订阅侧
+        self._task: Optional[asyncio.Task] = None
+        self.received = 0
+        self.reconnects = 0
+        self.lag_avg = 0.0
+        self.lag_max = 0.0
+        self.rate = 0.0           # 最近一个统计窗口的接收速率 (条/秒)
+        self._window_start = time.monotonic()
+        self._window_count = 0
+
+    # ---------------- 发布侧 ----------------
+    def start_publisher(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._publish_loop, name="ws-backplane-publisher", daemon=True)
+        self._thread.start()
+
+    def stop_publisher(self, timeout: float = 5.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def publish(self, message: dict) -> bool:
+        """线程安全：序列化一次后放入发布缓冲区 (可直接作为 MQTT 的 broadcast_callback)"""
+        payload = f"{time.time():.6f}|{serialize(message)}"
+        with self._lock:
+            if len(self._buffer) >= WS_BACKPLANE_MAX_BUFFER:
+                self._buffer.popleft()
+                self.publish_dropped += 1
+            self._buffer.append((channel_for(message), payload))
+        self._wake.set()
+        return True
+
+    def _take(self):
+        with self._lock:
+            n = min(len(self._buffer), WS_BACKPLANE_PIPELINE_SIZE)
+            return [self._buffer.popleft() for _ in range(n)]
+
+    def _publish_loop(self):
+        while True:
+            self._wake.wait(WS_BACKPLANE_FLUSH_INTERVAL)
+            self._wake.clear()
+            while True:
+                items = self._take()
+                if not items:
+                    break
+                try:
+                    pipe = RedisClient.get_sync_client().pipeline(transaction=False)
+                    for channel, payload in items:
+                        pipe.publish(channel, payload)
+                    pipe.execute()
+                    self.published += len(items)
+                except Exception as e:
+                    self.publish_errors += len(items)
+                    logger.debug(f"[Backplane] PUBLISH 失败: {e}")
+                    break
+            if self._stop.is_set():
+                with self._lock:
+                    if not self._buffer:
+                        return
+
+    # ---------------- 订阅侧 ----------------
+    def start(self):
+        """在事件循环内调用：启动订阅任务"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._subscribe_loop(), name="ws-backplane-subscriber")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _subscribe_loop(self):
+        backoff = 0.5
+        while True:
+            pubsub = None
+            try:
+                pubsub = RedisClient.get_client().pubsub(ignore_subscribe_messages=True)
+                await pubsub.psubscribe(f"{WS_BACKPLANE_PREFIX}:*")
+                logger.info(f"📡 [Backplane] 已订阅 {WS_BACKPLANE_PREFIX}:*")
+                backoff = 0.5
+                async for msg in pubsub.listen():
+                    if msg.get("type") == "pmessage":
+                        self._relay(msg["channel"], msg["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                logger.warning(f"⚠️ [Backplane] 订阅断开，{backoff:.1f}s 后重连: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.reset()
+                    except Exception:
+                        pass
+
+    def _relay(self, channel: str, data: str):
+        sent_at, _, text = data.partition("|")
+        now = time.time()
+        try:
+            lag = max(0.0, now - float(sent_at))
+            self.lag_avg = lag if self.received == 0 else self.lag_avg * 0.99 + lag * 0.01
+            self.lag_max = max(self.lag_max, lag)
+        except ValueError:
+            text = data
+
+        device_id = None
+        head, _, tail = channel.rpartition(":")
+        if head in (TELEMETRY_CHANNEL, EVENT_CHANNEL):
+            try:
+                device_id = int(tail)
+            except ValueError:
+                pass
+        manager.broadcast_text(text, device_id=device_id, conflate=head == TELEMETRY_CHANNEL)
+
+        self.received += 1
+        self._window_count += 1
+        elapsed = time.monotonic() - self._window_start
+        if elapsed >= 1.0:
+            self.rate = self._window_count / elapsed
+            self._window_start += elapsed
+            self._window_count = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth = len(self._buffer)
+        return {
+            "enabled": WS_BACKPLANE,
+            "publisher": {
+                "running": bool(self._thread and self._thread.is_alive()),
+                "depth": depth,
+                "published": self.published,
+                "dropped": self.publish_dropped,
+                "errors": self.publish_errors,
+            },
+            "subscriber": {
+                "running": self._task is not None and not self._task.done(),
+                "received": self.received,
+                # 超过 2 秒没有新消息时速率归零，而不是停留在最后一个窗口的值
+                "rate_per_second": round(self.rate, 1) if time.monotonic() - self._window_start < 2.0 else 0.0,
+                "reconnects": self.reconnects,
+                "lag_avg_ms": round(self.lag_avg * 1000, 3),
+                "lag_max_ms": round(self.lag_max * 1000, 3),
+            },
+        }
+
+
+# 全局单例
+ws_backplane = RedisBackplane()
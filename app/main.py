@@ -1,4 +1,5 @@
 import asyncio
+import os
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends
 from fastapi.middleware.cors import CORSMiddleware
@@ -6,9 +7,16 @@ from contextlib import asynccontextmanager
 
 
 # 1. 导入核心模块
-from app.core.database import init_db
-from app.core.socket_manager import manager  # 👈 新增：WebSocket 连接管理器
-from app.services.mqtt_worker import start_mqtt_background  # 👈 新增：MQTT 启动函数
+from app.core.database import init_db, close_db
+from app.core.socket_manager import manager, ws_bridge  # 👈 新增：WebSocket 连接管理器 + 线程安全桥
+from app.core.ws_backplane import WS_BACKPLANE, ws_backplane  # 多进程广播总线 (Redis pub/sub)
+from app.services.mqtt_worker import start_mqtt_background, stop_mqtt_background  # 👈 新增：MQTT 启动/停止函数
+from app.services.ws_subscriptions import handle_client_message  # WebSocket 订阅 / 限速协议
+from app.services.export_jobs import export_jobs  # 后台导出任务
+from app.services.device_health import seed_health_if_empty  # FDD 设备健康度
+from app.services.device_registry import device_registry  # 进程内设备注册表
+from app.core.auth_cache import auth_invalidation  # 跨进程账号失效通知
+from app.services.mqtt_publisher import command_publisher  # 常驻的控制指令发布连接
 from app.core.redis import RedisClient
 from app.core.logger import logger
 # 2. 导入各个业务模块的路由
@@ -19,10 +27,14 @@ from app.api.endpoints import (
     alarms,     # 报警管理
     analysis,   # 数据分析
     reports,    # 报表导出
-    fdd         # 故障诊断
+    fdd,        # 故障诊断
+    system      # 系统运维 (配置热加载等)
 )
 from app.api.deps import get_current_user  # 权限验证依赖
 
+# 是否在 API 进程内订阅 MQTT 并入库 (多 worker 部署时建议关闭，改用独立的消费者进程)
+MQTT_INGEST_IN_API = os.getenv("MQTT_INGEST_IN_API", "1").lower() not in ("0", "false", "no")
+
 # =================================================================
 # 🔄 生命周期管理器 (Lifespan)
 # 作用：在服务器启动时初始化数据库和 MQTT，在关闭时清理资源
@@ -31,6 +43,9 @@ from app.api.deps import get_current_user  # 权限验证依赖
 async def lifespan(app: FastAPI):
     # --- 🟢 启动阶段 ---
     init_db()  # 1. 创建表结构
+    await seed_health_if_empty()  # 老库升级后从报警表补齐设备健康度
+    await asyncio.to_thread(device_registry.start)  # 加载设备注册表，并订阅其他进程的设备变更通知
+    auth_invalidation.start()  # 订阅其他进程的账号停用 / 改密通知，立即清除本进程的认证缓存
     
         # 初始化 Redis 连接测试
     try:
@@ -42,22 +57,46 @@ async def lifespan(app: FastAPI):
 
     print("📡 [MQTT] 正在启动后台监听线程...")
     
-    # 定义一个“桥梁”函数：当 MQTT 收到数据时，执行这个函数
-    # 它的作用是把 MQTT 消息“转发”给 WebSocket
-    def mqtt_to_ws_callback(msg_dict):
-        # manager.broadcast 是一个异步函数 (async def)
-        # 但这里的回调是同步的，所以需要用 create_task 把它扔进事件循环里执行
-        asyncio.create_task(manager.broadcast(msg_dict))
-
-    # 2. 启动 MQTT Worker (传入回调函数)
-    start_mqtt_background(on_message_callback=mqtt_to_ws_callback)
+    # 启动“桥梁”：MQTT 网络线程里没有运行中的事件循环，不能直接 create_task
+    # ws_bridge.submit() 是线程安全的：消息先进入有界缓冲区，再由事件循环里的单个分发任务调用 manager.broadcast
+    ws_bridge.start()
+
+    # 多 worker / 多容器部署：开启 WS_BACKPLANE 后，实时消息统一经 Redis pub/sub 转发，
+    # 每个 API 进程都订阅并推给自己的 WebSocket 客户端 (包括本进程自己发布的消息)
+    if WS_BACKPLANE:
+        ws_backplane.start()
+        ws_backplane.start_publisher()
+        broadcast = ws_backplane.publish
+    else:
+        broadcast = ws_bridge.submit
+
+    # 2. 启动 MQTT Worker (传入线程安全的回调函数)
+    # MQTT_INGEST_IN_API=0: 入库交给 scripts/run_consumers.py，API 进程只负责查询和 WebSocket 推送
+    if MQTT_INGEST_IN_API:
+        start_mqtt_background(on_message_callback=broadcast)
     
+    # 3. 控制指令发布器：常驻 MQTT 连接，broker 不可用时后台重连，不阻塞启动
+    command_publisher.start()
+
     print("✅ 系统就绪，等待连接...\n")
     
     yield  # ⏸️ 这里是分界线，应用开始运行
     
     # --- 🔴 关闭阶段 ---
     print("\n🛑 [系统关闭]正在清理资源...")
+    # 停止 MQTT 并排空批量入库管道 (阻塞操作，放到线程里执行，避免卡住事件循环)
+    if MQTT_INGEST_IN_API:
+        await asyncio.to_thread(stop_mqtt_background)
+    if WS_BACKPLANE:
+        await asyncio.to_thread(ws_backplane.stop_publisher)
+        await ws_backplane.stop()
+    await ws_bridge.stop()
+    await manager.close_all()
+    await asyncio.to_thread(export_jobs.shutdown)
+    await asyncio.to_thread(command_publisher.stop)
+    await asyncio.to_thread(device_registry.stop)
+    await asyncio.to_thread(auth_invalidation.stop)
+    await close_db()
 
 # =================================================================
 # 🏗️ 初始化 FastAPI 应用
@@ -95,12 +134,15 @@ async def websocket_endpoint(websocket: WebSocket):
     await manager.connect(websocket)
     try:
         while True:
-            # 2. 保持连接活跃
-            # 虽然我们目前不需要前端发消息过来，但必须有一个 await 挂起
-            # 否则连接会立即断开。这里等待接收文本（心跳检测可以在这里做）
-            await websocket.receive_text()
-    except WebSocketDisconnect:
-        # 3. 断开连接时清理
+            # 2. 处理客户端发来的订阅 / 限速 / 心跳消息 (协议见 app/services/ws_subscriptions.py)
+            # 不发送任何消息的客户端保持原来的行为：收到全部设备的实时推送
+            text = await websocket.receive_text()
+            await handle_client_message(websocket, text)
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: 慢客户端被 manager 主动关闭后再读取
+        pass
+    finally:
+        # 3. 断开连接时清理 (重复调用是安全的)
         manager.disconnect(websocket)
         # print("🔌 客户端已断开 WebSocket 连接")
 
@@ -159,6 +201,14 @@ app.include_router(
     dependencies=[Depends(get_current_user)]
 )
 
+# 8. 系统运维 (配置热加载 / 运行状态) - 🔐 需要登录
+app.include_router(
+    system.router, 
+    prefix="/system", 
+    tags=["7. 系统运维"], 
+    dependencies=[Depends(get_current_user)]
+)
+
 
 # =================================================================
 # ▶️ 程序入口
@@ -32,17 +32,75 @@ class DeviceData(SQLModel, table=True):
     power: float 
     energy: float
 
-# --- 报警表 (保持不变) ---
+# --- 报警表 ---
+# 一条记录代表一次报警 "事件" (episode)：持续违规期间不再重复插入，只原地更新次数和最后出现时间
 class Alarm(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     device_id: int = Field(index=True, foreign_key="device.id")
     message: str
     timestamp: datetime = Field(default_factory=datetime.now, index=True)
     is_resolved: bool = Field(default=False)
+    rule_code: Optional[str] = Field(default=None, index=True)  # 触发的规则 (over_current / voltage_window ...)
+    occurrence_count: int = Field(default=1)                     # 本次事件内累计违规的样本数
+    first_seen: Optional[datetime] = Field(default=None)         # 事件首次出现时间
+    last_seen: Optional[datetime] = Field(default=None)          # 事件最近一次出现时间
 
 # --- 用户表 (保持不变) ---
 class User(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     username: str = Field(index=True, unique=True)
     hashed_password: str
-    is_active: bool = Field(default=True)
\ No newline at end of file
+    is_active: bool = Field(default=True)
+# --- 设备健康度表 (FDD) ---
+# 由入库报警路径增量维护：每开启一次报警事件累加扣分，扣分随时间指数衰减 (见 app/services/device_health.py)
+class DeviceHealth(SQLModel, table=True):
+    __tablename__ = "devicehealth"
+
+    device_id: int = Field(primary_key=True, foreign_key="device.id")
+    penalty: float = Field(default=0.0)                      # 在 penalty_at 时刻的累计扣分 (读取时再按当前时间衰减)
+    penalty_at: datetime = Field(default_factory=datetime.now)
+    alarm_count: int = Field(default=0)                       # 累计报警事件数
+    last_alarm_at: Optional[datetime] = Field(default=None)
+
+# --- FDD 历史回溯 (app/services/fdd_backfill.py) ---
+class FddRun(SQLModel, table=True):
+    """一次离线回溯任务"""
+    __tablename__ = "fddrun"
+
+    id: str = Field(primary_key=True)
+    status: str = Field(default="pending", index=True)   # pending / running / done / failed / cancelled
+    start: datetime
+    end: datetime
+    device_ids: Optional[str] = Field(default=None)      # 逗号分隔，为空表示全部设备
+    params: str = Field(default="{}")                    # 检测参数快照 (JSON)
+    devices_total: int = Field(default=0)
+    error: Optional[str] = Field(default=None)
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+
+class FddRunDevice(SQLModel, table=True):
+    """回溯任务中每台设备的进度：每处理完一个时间分片，与该分片的检测结果在同一事务内提交，中断后从 done_until 继续"""
+    __tablename__ = "fddrundevice"
+
+    run_id: str = Field(primary_key=True, foreign_key="fddrun.id")
+    device_id: int = Field(primary_key=True)
+    done_until: Optional[datetime] = Field(default=None)
+    completed: bool = Field(default=False)
+    rows: int = Field(default=0)
+    findings: int = Field(default=0)
+    state: Optional[str] = Field(default=None)           # 检测器状态 + 未结束的异常区间 (JSON)
+
+
+class FddFinding(SQLModel, table=True):
+    """回溯检测结果：同一设备同一规则、间隔不超过合并阈值的违规样本合并为一个区间"""
+    __tablename__ = "fddfinding"
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    run_id: str = Field(index=True, foreign_key="fddrun.id")
+    device_id: int = Field(index=True)
+    rule_code: str = Field(index=True)
+    start_ts: datetime = Field(index=True)
+    end_ts: datetime
+    samples: int = Field(default=1)
+    message: str
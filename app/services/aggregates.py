@@ -0,0 +1,115 @@
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlmodel import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.logger import logger
+from app.core.timescale import AGGREGATES, FIELDS
+
+RAW_SOURCE = "devicedata"
+
+# 进程内缓存：数据库里实际存在的连续聚合 (普通 PostgreSQL 或创建失败时为空集合，全部回退到原始表)
+_available: Optional[set] = None
+
+
+@dataclass(frozen=True)
+class SeriesPlan:
+    source: str          # 读取的表 / 视图
+    bucket_seconds: int  # 最终输出的桶宽 (秒)
+
+
+async def available_aggregates(session: AsyncSession) -> set:
+    global _available
+    if _available is None:
+        try:
+            rows = (await session.execute(text(
+                "SELECT view_name FROM timescaledb_information.continuous_aggregates"
+            ))).all()
+            _available = {r[0] for r in rows}
+        except Exception as e:
+            logger.warning(f"⚠️ [聚合查询] 无法读取连续聚合列表，回退到原始表: {e}")
+            await session.rollback()
+            _available = set()
+    return _available
+
+
+def plan_series(start: datetime, end: datetime, available: set,
+                max_points: Optional[int] = None, resolution: Optional[int] = None) -> SeriesPlan:
+    """
+    选择满足 "区间 / 分辨率" 要求的最粗粒度数据源：
+    - 期望桶宽 = max(resolution, 区间长度 / max_points)
+    - 从 1 天 -> 1 小时 -> 1 分钟 依次尝试，第一个桶宽不超过期望值的聚合即为数据源
+    - 输出桶宽向上取整为数据源桶宽的整数倍 (在聚合之上再做一次 time_bucket)
+    - 都不满足时读原始表
+    """
+    span = max((end - start).total_seconds(), 1.0)
+    wanted = float(resolution or 0)
+    if max_points:
+        wanted = max(wanted, span / max_points)
+
+    for agg in sorted(AGGREGATES, key=lambda a: a.bucket_seconds, reverse=True):
+        if agg.name in available and agg.bucket_seconds <= wanted:
+            multiple = max(1, int(-(-wanted // agg.bucket_seconds)))
+            return SeriesPlan(agg.name, agg.bucket_seconds * multiple)
+    return SeriesPlan(RAW_SOURCE, max(1, int(-(-wanted // 1))))
+
+
+def _series_sql(plan: SeriesPlan) -> str:
+    if plan.source == RAW_SOURCE:
+        stats = ", ".join(
+            f'min("{f}") AS {f}_min, max("{f}") AS {f}_max, avg("{f}") AS {f}_avg' for f in FIELDS
+        )
+        return f"""
+            SELECT time_bucket(CAST(:width AS INTERVAL), "timestamp") AS b,
+                   count(*) AS samples, {stats},
+                   first(energy, "timestamp") AS energy_first, last(energy, "timestamp") AS energy_last
+            FROM devicedata
+            WHERE device_id = :device_id AND "timestamp" >= :start AND "timestamp" < :end
+            GROUP BY b ORDER BY b"""
+
+    stats = ", ".join(
+        f"min({f}_min) AS {f}_min, max({f}_max) AS {f}_max, "
+        f"sum({f}_avg * samples) / NULLIF(sum(samples), 0) AS {f}_avg"
+        for f in FIELDS
+    )
+    return f"""
+        SELECT time_bucket(CAST(:width AS INTERVAL), bucket) AS b,
+               sum(samples) AS samples, {stats},
+               first(energy_first, bucket) AS energy_first, last(energy_last, bucket) AS energy_last
+        FROM {plan.source}
+        WHERE device_id = :device_id AND bucket >= :start AND bucket < :end
+        GROUP BY b ORDER BY b"""
+
+
+async def query_series(session: AsyncSession, device_id: int, start: datetime, end: datetime,
+                       max_points: Optional[int] = None, resolution: Optional[int] = None) -> dict:
+    """
+    按时间桶返回列式统计：timestamps 为桶起点 (epoch 毫秒)，其余字段与桶一一对应
+    energy_used = 桶内最后一条电能 - 第一条电能
+    """
+    plan = plan_series(start, end, await available_aggregates(session), max_points, resolution)
+    rows = (await session.execute(text(_series_sql(plan)), {
+        # asyncpg 只接受 timedelta 作为 interval 参数 (传字符串会报 DataError)
+        "width": timedelta(seconds=plan.bucket_seconds),
+        "device_id": device_id,
+        "start": start,
+        "end": end,
+    })).all()
+
+    columns = ["samples"] + [f"{f}_{s}" for f in FIELDS for s in ("min", "max", "avg")] + ["energy_first", "energy_last"]
+    result = {
+        "device_id": device_id,
+        "source": plan.source,
+        "bucket_seconds": plan.bucket_seconds,
+        "timestamps": [int(r[0].timestamp() * 1000) for r in rows],
+    }
+    for i, name in enumerate(columns, start=1):
+        if name == "samples":
+            result[name] = [int(r[i]) for r in rows]
+        else:
+            result[name] = [round(float(r[i]), 3) if r[i] is not None else None for r in rows]
+    result["energy_used"] = [
+        round(last - first, 3) if first is not None and last is not None else None
+        for first, last in zip(result["energy_first"], result["energy_last"])
+    ]
+    return result
@@ -0,0 +1,292 @@
+import os
+import threading
+from typing import Callable, Dict, List, Optional
+import numpy as np
+from app.core.config import DeviceLimits, config_service
+from app.services.reading_batch import ReadingBatch
+
+# 报警解除的回差比例：例如上限 100A、回差 0.05，则电流回落到 95A 以下才算恢复正常
+ALARM_HYSTERESIS = float(os.getenv("ALARM_HYSTERESIS", "0.05"))
+
+
+class CompiledLimits:
+    """
+    把阈值配置编译成按 device_id 下标访问的 NumPy 数组
+    - 数组长度为 max_device_id + 2，最后一个位置存放默认阈值
+    - 未单独配置 (或超出范围) 的设备统一映射到默认阈值那一格
+    """
+
+    FIELDS = ("current_max", "voltage_min", "voltage_max", "power_max", "current_rate_max", "stuck_samples")
+
+    def __init__(self, default: DeviceLimits, per_device: Dict[int, DeviceLimits], version: int):
+        self.version = version
+        self.size = (max(per_device) + 1) if per_device else 0
+        self.default_slot = self.size
+        for field in self.FIELDS:
+            arr = np.full(self.size + 1, getattr(default, field), dtype=np.float64)
+            for device_id, limits in per_device.items():
+                if device_id >= 0:
+                    arr[device_id] = getattr(limits, field)
+            setattr(self, field, arr)
+
+    @classmethod
+    def from_config(cls) -> "CompiledLimits":
+        default, per_device = config_service.all_limits()
+        return cls(default, per_device, config_service.version)
+
+    def index(self, device_ids: np.ndarray) -> np.ndarray:
+        """device_id 数组 -> 阈值数组下标"""
+        valid = (device_ids >= 0) & (device_ids < self.size)
+        return np.where(valid, device_ids, self.default_slot)
+
+
+class RuleContext:
+    """
+    一次批量评估的上下文：
+    - idx: 每行对应的阈值数组下标
+    - prev_*: 每行 "同一设备的上一条读数" (跨批次由引擎状态补齐)，prev_valid 表示是否存在上一条
+    - state: 引擎持有的、按 device_id 下标的跨批次状态数组
+    """
+
+    def __init__(self, batch: ReadingBatch, limits: CompiledLimits, state: "RuleState"):
+        self.batch = batch
+        self.limits = limits
+        self.state = state
+        self.idx = limits.index(batch.device_id)
+        self.starts = batch.segment_starts()
+        self.ends = batch.segment_ends()
+        self.masks: Dict[str, np.ndarray] = {}
+        self.clear_masks: Dict[str, np.ndarray] = {}
+        self.stuck_run: Optional[np.ndarray] = None
+        self.anomaly = None  # 在线异常检测结果 (app/services/anomaly.py)，同一批次只计算一次
+        self.on_commit: List[Callable[[], None]] = []  # 批次写库成功后才执行的状态推进 (RuleEngine.commit)
+
+        dev = batch.device_id
+        self.prev_valid = np.ones(len(batch), dtype=bool)
+        self.prev_ts = np.empty(len(batch))
+        self.prev_current = np.empty(len(batch))
+        self.prev_ts[1:] = batch.ts[:-1]
+        self.prev_current[1:] = batch.current[:-1]
+        # 每个设备段的第一行：上一条来自引擎状态
+        first = np.flatnonzero(self.starts)
+        self.prev_valid[first] = state.has_last[dev[first]]
+        self.prev_ts[first] = state.last_ts[dev[first]]
+        self.prev_current[first] = state.last_current[dev[first]]
+
+
+class RuleState:
+    """跨批次的每设备状态 (按 device_id 下标，按需扩容)"""
+
+    def __init__(self, capacity: int = 64):
+        self.has_last = np.zeros(capacity, dtype=bool)
+        self.last_ts = np.zeros(capacity)
+        self.last_current = np.zeros(capacity)
+        self.stuck_run = np.zeros(capacity, dtype=np.int64)
+
+    def ensure(self, max_device_id: int):
+        capacity = len(self.has_last)
+        if max_device_id < capacity:
+            return
+        new_capacity = max(capacity * 2, max_device_id + 1)
+        for name in ("has_last", "last_ts", "last_current", "stuck_run"):
+            old = getattr(self, name)
+            grown = np.zeros(new_capacity, dtype=old.dtype)
+            grown[:capacity] = old
+            setattr(self, name, grown)
+
+
+class AlarmRule:
+    """
+    报警规则基类：
+    - evaluate() 对整批读数返回布尔掩码 (True 表示该行违反规则)，只允许使用数组运算
+    - clear() 返回 "已明确恢复正常" 的掩码 (带回差)，默认即 "未违规"
+    - message() 仅对违规行调用，生成报警文本
+    - 新规则继承本类并通过 register_rule() 注册即可，无需改动引擎
+    """
+
+    code = "base"
+
+    def evaluate(self, ctx: RuleContext) -> np.ndarray:
+        raise NotImplementedError
+
+    def clear(self, ctx: RuleContext) -> np.ndarray:
+        return ~ctx.masks[self.code]
+
+    def message(self, ctx: RuleContext, i: int) -> str:
+        raise NotImplementedError
+
+
+class OverCurrentRule(AlarmRule):
+    code = "over_current"
+
+    def evaluate(self, ctx):
+        return ctx.batch.current > ctx.limits.current_max[ctx.idx]
+
+    def clear(self, ctx):
+        return ctx.batch.current <= ctx.limits.current_max[ctx.idx] * (1 - ALARM_HYSTERESIS)
+
+    def message(self, ctx, i):
+        return f"⚠️ 过载报警! 当前: {ctx.batch.current[i]}A (上限: {ctx.limits.current_max[ctx.idx[i]]}A)"
+
+
+class VoltageWindowRule(AlarmRule):
+    code = "voltage_window"
+
+    def evaluate(self, ctx):
+        v = ctx.batch.voltage
+        return (v > ctx.limits.voltage_max[ctx.idx]) | (v < ctx.limits.voltage_min[ctx.idx])
+
+    def clear(self, ctx):
+        v = ctx.batch.voltage
+        return ((v <= ctx.limits.voltage_max[ctx.idx] * (1 - ALARM_HYSTERESIS))
+                & (v >= ctx.limits.voltage_min[ctx.idx] * (1 + ALARM_HYSTERESIS)))
+
+    def message(self, ctx, i):
+        return f"⚡ 电压异常! 读数: {ctx.batch.voltage[i]}V"
+
+
+class PowerCeilingRule(AlarmRule):
+    code = "power_ceiling"
+
+    def evaluate(self, ctx):
+        return ctx.batch.power > ctx.limits.power_max[ctx.idx]
+
+    def clear(self, ctx):
+        return ctx.batch.power <= ctx.limits.power_max[ctx.idx] * (1 - ALARM_HYSTERESIS)
+
+    def message(self, ctx, i):
+        return f"🔥 功率超限! 当前: {ctx.batch.power[i]}kW (上限: {ctx.limits.power_max[ctx.idx[i]]}kW)"
+
+
+class CurrentRateRule(AlarmRule):
+    """电流变化率 |ΔI/Δt| 超过 current_rate_max (A/s)"""
+    code = "current_rate"
+
+    def evaluate(self, ctx):
+        dt = ctx.batch.ts - ctx.prev_ts
+        ok = ctx.prev_valid & (dt > 0)
+        rate = np.zeros(len(ctx.batch))
+        np.divide(np.abs(ctx.batch.current - ctx.prev_current), dt, out=rate, where=ok)
+        return ok & (rate > ctx.limits.current_rate_max[ctx.idx])
+
+    def message(self, ctx, i):
+        return (f"📈 电流突变! {ctx.prev_current[i]}A -> {ctx.batch.current[i]}A "
+                f"(上限: {ctx.limits.current_rate_max[ctx.idx[i]]}A/s)")
+
+
+class StuckValueRule(AlarmRule):
+    """连续 stuck_samples 个样本电流读数完全相同 (停机的 0 读数除外)，判定为传感器卡死"""
+    code = "stuck_value"
+
+    def evaluate(self, ctx):
+        batch, state = ctx.batch, ctx.state
+        n = len(batch)
+        idx = np.arange(n)
+        eq = ctx.prev_valid & (batch.current == ctx.prev_current) & (batch.current != 0)
+
+        # run[i] = 截止到第 i 行，连续 "与上一条相同" 的次数
+        # 在 "不相同" 或 "设备段起点" 处打标记，标记处的初值分别为 0 / 状态中延续下来的次数 + 1
+        marker = ~eq | ctx.starts
+        carried = state.stuck_run[batch.device_id] + 1
+        base = np.where(eq, carried, 0)
+        last_marker = np.maximum.accumulate(np.where(marker, idx, 0))
+        run = base[last_marker] + (idx - last_marker)
+        ctx.stuck_run = run
+
+        required = ctx.limits.stuck_samples[ctx.idx]
+        return (required > 0) & (run >= required - 1)
+
+    def message(self, ctx, i):
+        return f"🧊 传感器疑似卡死! 电流连续 {int(ctx.stuck_run[i]) + 1} 次读数均为 {ctx.batch.current[i]}A"
+
+
+# 已注册的规则 (按顺序评估)
+RULES: List[AlarmRule] = []
+
+
+def register_rule(rule: AlarmRule) -> AlarmRule:
+    """注册一条新的报警规则"""
+    RULES.append(rule)
+    return rule
+
+
+for _rule in (OverCurrentRule(), VoltageWindowRule(), PowerCeilingRule(), CurrentRateRule(), StuckValueRule()):
+    register_rule(_rule)
+
+
+class RuleEngine:
+    """
+    向量化报警规则引擎：
+    - 阈值配置编译为 CompiledLimits，配置 version 变化时自动重新编译
+    - evaluate() 对整批读数逐条规则做一次数组运算，掩码 {规则代码: 违规掩码} 存放在 ctx.masks
+    - alarm_rows() 把违规行转换成可直接批量 INSERT 的报警字典列表
+    - commit() 在批次写库成功后推进跨批次状态 (上一条读数、卡死计数、异常检测状态)；
+      事务失败的批次不提交，重试时从原状态重新评估，不会把同一批读数算两遍
+    """
+
+    def __init__(self, rules: Optional[List[AlarmRule]] = None):
+        self.rules = rules if rules is not None else RULES
+        self.state = RuleState()
+        self._limits: Optional[CompiledLimits] = None
+        self._lock = threading.Lock()
+
+    def limits(self) -> CompiledLimits:
+        # all_limits() 会按间隔检查配置文件是否变化，version 变了就重新编译
+        config_service.all_limits()
+        if self._limits is None or self._limits.version != config_service.version:
+            self._limits = CompiledLimits.from_config()
+        return self._limits
+
+    def evaluate(self, batch: ReadingBatch) -> RuleContext:
+        """评估整批读数，结果 (每条规则的掩码) 保存在返回的上下文 ctx.masks 中"""
+        with self._lock:
+            limits = self.limits()
+            if len(batch):
+                self.state.ensure(int(batch.device_id.max()))
+            ctx = RuleContext(batch, limits, self.state)
+            ctx.masks = {rule.code: rule.evaluate(ctx) for rule in self.rules}
+            ctx.clear_masks = {rule.code: rule.clear(ctx) for rule in self.rules}
+            return ctx
+
+    def commit(self, ctx: RuleContext):
+        """ctx 对应的批次已写库：推进跨批次状态"""
+        with self._lock:
+            self._update_state(ctx)
+        for hook in ctx.on_commit:
+            hook()
+
+    def _update_state(self, ctx: RuleContext):
+        if not len(ctx.batch):
+            return
+        last = np.flatnonzero(ctx.ends)
+        dev = ctx.batch.device_id[last]
+        self.state.has_last[dev] = True
+        self.state.last_ts[dev] = ctx.batch.ts[last]
+        self.state.last_current[dev] = ctx.batch.current[last]
+        if ctx.stuck_run is not None:
+            self.state.stuck_run[dev] = ctx.stuck_run[last]
+
+    def rule(self, code: str) -> AlarmRule:
+        for rule in self.rules:
+            if rule.code == code:
+                return rule
+        raise KeyError(code)
+
+    def alarm_rows(self, ctx: RuleContext) -> List[dict]:
+        """把违规行转成报警字典 (只对违规行做 Python 层面的字符串格式化)"""
+        alarms = []
+        for code, mask in ctx.masks.items():
+            rule = self.rule(code)
+            for i in np.flatnonzero(mask):
+                alarms.append({
+                    "device_id": int(ctx.batch.device_id[i]),
+                    "message": rule.message(ctx, i),
+                    "timestamp": ctx.batch.rows[i][1],
+                    "is_resolved": False,
+                    "rule_code": code,
+                })
+        return alarms
+
+
+# 全局规则引擎实例 (HTTP 上传与 MQTT 批量入库共用，保证跨批次状态一致)
+rule_engine = RuleEngine()
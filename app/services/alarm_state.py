@@ -0,0 +1,236 @@
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
+from sqlalchemy import DateTime, Integer, column, insert, update, values
+from sqlmodel import Session
+from app.core.logger import logger
+from app.models.tables import Alarm
+from app.services.alarm_rules import RuleContext, RuleEngine, rule_engine
+from app.services.device_health import record_alarms
+
+# 报警事件的最短持续时间 (秒)：事件开始后至少保持这么久才允许因恢复正常而结束
+ALARM_MIN_HOLD_SECONDS = float(os.getenv("ALARM_MIN_HOLD_SECONDS", "30"))
+# 持续报警期间，最多每隔多少秒把累计次数 / 最后出现时间写回数据库一次
+ALARM_RENOTIFY_SECONDS = float(os.getenv("ALARM_RENOTIFY_SECONDS", "60"))
+
+
+class AlarmEpisode:
+    """一次报警事件在内存中的状态"""
+
+    __slots__ = ("alarm_id", "first_seen", "last_seen", "count", "last_written", "message")
+
+    def __init__(self, first_seen: float, last_seen: float, count: int, message: str):
+        self.alarm_id: Optional[int] = None
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        self.count = count
+        self.last_written = last_seen
+        self.message = message
+
+    def copy(self) -> "AlarmEpisode":
+        clone = AlarmEpisode(self.first_seen, self.last_seen, self.count, self.message)
+        clone.alarm_id = self.alarm_id
+        clone.last_written = self.last_written
+        return clone
+
+
+class AlarmTracker:
+    """
+    报警防抖 / 去重状态机 (每个 设备 × 规则 一个状态)：
+    - 正常 -> 报警: 出现违规样本即开启一个事件，插入一条 Alarm
+    - 报警持续: 不再插入新行，只累计次数；每隔 renotify_seconds 原地 UPDATE 一次 occurrence_count / last_seen
+    - 报警 -> 正常: 读数回到带回差的 "正常区间" 且事件已持续 min_hold_seconds 以上，才结束事件 (最后写一次)
+    - 若事件对应的报警已被人工处理 (is_resolved=True)，则丢弃该事件，下次违规重新开启
+    时间一律使用读数自身的时间戳，保证重放 / 补录数据时行为一致
+    process() 只在事件的副本上推进，批次提交成功后 (RuleEngine.commit -> ctx.on_commit) 才写回 _episodes：
+    事务失败、批次重试或拆半重写时，从未变化的状态重新计算，不会丢报警或重复累计次数
+    """
+
+    def __init__(
+        self,
+        engine: RuleEngine = rule_engine,
+        min_hold_seconds: float = ALARM_MIN_HOLD_SECONDS,
+        renotify_seconds: float = ALARM_RENOTIFY_SECONDS,
+    ):
+        self.engine = engine
+        self.min_hold_seconds = min_hold_seconds
+        self.renotify_seconds = renotify_seconds
+        self._episodes: Dict[Tuple[int, str], AlarmEpisode] = {}
+        self._lock = threading.Lock()
+
+        # 统计计数
+        self.violations = 0
+        self.inserted = 0
+        self.updated = 0
+
+    def active_count(self) -> int:
+        return len(self._episodes)
+
+    def stats(self) -> dict:
+        return {
+            "active_episodes": len(self._episodes),
+            "violations": self.violations,
+            "inserted": self.inserted,
+            "updated": self.updated,
+        }
+
+    def process(self, session: Session, ctx: RuleContext) -> List[dict]:
+        """
+        根据规则评估结果推进状态机，并在 session 中完成报警的批量插入 / 更新 (不提交事务)
+        新的事件状态登记到 ctx.on_commit，事务提交后才生效
+        返回本批次新开启的报警事件 (字典形式，含 id)
+        """
+        batch = ctx.batch
+        if not len(batch):
+            return []
+
+        n = len(batch)
+        idx = np.arange(n)
+        starts = np.flatnonzero(ctx.starts)
+        ends = np.flatnonzero(ctx.ends)
+        devices = batch.device_id[starts]
+        ts = batch.ts
+
+        with self._lock:
+            committed = dict(self._episodes)
+
+        # 本批次之后每个事件的状态: None 表示事件结束 / 被丢弃
+        staged: Dict[Tuple[int, str], Optional[AlarmEpisode]] = {}
+        new_episodes: List[Tuple[Tuple[int, str], AlarmEpisode, int]] = []
+        touched: Dict[Tuple[int, str], AlarmEpisode] = {}
+        closed: Dict[Tuple[int, str], AlarmEpisode] = {}
+        violations = 0
+
+        for code, viol in ctx.masks.items():
+            clear = ctx.clear_masks[code]
+            # 每个设备段: 违规样本数 / 首个与最后一个违规样本位置 / 末尾连续 "正常" 段的起点
+            counts = np.add.reduceat(viol.astype(np.int64), starts)
+            first_v = np.minimum.reduceat(np.where(viol, idx, n), starts)
+            last_v = np.maximum.reduceat(np.where(viol, idx, -1), starts)
+            last_not_clear = np.maximum.reduceat(np.where(clear, -1, idx), starts)
+
+            # 只遍历本批次里 "有违规" 或 "已有事件" 的设备，而不是逐行遍历
+            candidates = set(np.flatnonzero(counts > 0).tolist())
+            candidates.update(k for k, d in enumerate(devices.tolist()) if (d, code) in committed)
+            for k in sorted(candidates):
+                key = (int(devices[k]), code)
+                episode = committed.get(key)
+                count = int(counts[k])
+
+                if count:
+                    violations += count
+                    if episode is None:
+                        episode = AlarmEpisode(
+                            first_seen=float(ts[first_v[k]]),
+                            last_seen=float(ts[last_v[k]]),
+                            count=count,
+                            message=self.engine.rule(code).message(ctx, int(first_v[k])),
+                        )
+                        staged[key] = episode
+                        new_episodes.append((key, episode, int(first_v[k])))
+                        continue
+                    episode = episode.copy()
+                    episode.count += count
+                    episode.last_seen = float(ts[last_v[k]])
+                    staged[key] = episode
+
+                # 末尾一段都处于 "正常" 区间 (且在最后一次违规之后)，并且事件已满足最短持续时间 -> 结束事件
+                end = int(ends[k])
+                trailing_clear = last_not_clear[k] < end and last_not_clear[k] >= last_v[k]
+                if trailing_clear and ts[end] - episode.first_seen >= self.min_hold_seconds:
+                    staged[key] = None
+                    closed[key] = episode
+                elif count and episode.last_seen - episode.last_written >= self.renotify_seconds:
+                    touched[key] = episode
+
+        created = self._insert_new(session, ctx, new_episodes)
+        alive = self._update_existing(session, {**touched, **closed})
+        for key, episode in touched.items():
+            if episode.alarm_id is not None and episode.alarm_id not in alive:
+                staged[key] = None  # 报警已被人工处理：丢弃事件，下次违规重新开启新事件
+
+        if staged or violations:
+            ctx.on_commit.append(lambda: self._apply(staged, created, closed, violations, len(alive)))
+        return created
+
+    def _apply(self, staged, created: List[dict], closed, violations: int, updated: int):
+        """批次已提交：写回事件状态与统计"""
+        with self._lock:
+            for key, episode in staged.items():
+                if episode is None:
+                    self._episodes.pop(key, None)
+                else:
+                    self._episodes[key] = episode
+            self.violations += violations
+            self.inserted += len(created)
+            self.updated += updated
+        for row in created:
+            logger.warning(f"🚨 [报警 ID:{row['device_id']}] {row['message']}")
+        for key, episode in closed.items():
+            logger.info(f"✅ [报警恢复 ID:{key[0]}] {key[1]} 事件结束, 共 {episode.count} 次")
+
+    def _insert_new(self, session: Session, ctx: RuleContext, new_episodes) -> List[dict]:
+        if not new_episodes:
+            return []
+        rows = []
+        for (device_id, code), episode, i in new_episodes:
+            first_seen = datetime.fromtimestamp(episode.first_seen)
+            rows.append({
+                "device_id": device_id,
+                "message": episode.message,
+                "timestamp": ctx.batch.rows[i][1],
+                "is_resolved": False,
+                "rule_code": code,
+                "occurrence_count": episode.count,
+                "first_seen": first_seen,
+                "last_seen": datetime.fromtimestamp(episode.last_seen),
+            })
+        result = session.exec(insert(Alarm).values(rows).returning(Alarm.id))
+        ids = [row[0] for row in result]
+        for (_key, episode, _i), alarm_id, row in zip(new_episodes, ids, rows):
+            episode.alarm_id = alarm_id
+            episode.last_written = episode.last_seen
+            row["id"] = alarm_id
+        # 同一事务内增量更新设备健康度 (FDD 页面直接读健康度表，不再扫描报警表)
+        record_alarms(session, [(device_id, episode.first_seen) for (device_id, _code), episode, _i in new_episodes])
+        return rows
+
+    def _update_existing(self, session: Session, episodes: Dict[Tuple[int, str], AlarmEpisode]) -> Set[int]:
+        """
+        一条 UPDATE ... FROM (VALUES ...) 批量回写累计次数，已被人工处理的报警不会被更新
+        返回仍然有效 (未被处理) 的报警 id；episodes 均为副本，可以直接更新 last_written
+        """
+        pending = {key: ep for key, ep in episodes.items() if ep.alarm_id is not None}
+        if not pending:
+            return set()
+        data = [
+            (ep.alarm_id, ep.count, datetime.fromtimestamp(ep.last_seen))
+            for ep in pending.values()
+        ]
+        v = values(
+            column("id", Integer), column("cnt", Integer), column("seen", DateTime),
+            name="v",
+        ).data(data)
+        statement = (
+            update(Alarm)
+            .where(Alarm.id == v.c.id)
+            .where(Alarm.is_resolved == False)
+            .values(occurrence_count=v.c.cnt, last_seen=v.c.seen)
+            .returning(Alarm.id)
+        )
+        alive = {row[0] for row in session.exec(statement)}
+        for episode in pending.values():
+            if episode.alarm_id in alive:
+                episode.last_written = episode.last_seen
+        return alive
+
+    def reset(self):
+        """清空所有事件状态 (例如管理员一键清除报警之后)"""
+        with self._lock:
+            self._episodes.clear()
+
+
+# 全局报警状态机实例
+alarm_tracker = AlarmTracker()
@@ -0,0 +1,474 @@
+import base64
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from app.core.logger import logger
+from app.core.redis import RedisClient
+from app.services.alarm_rules import AlarmRule, RuleContext, register_rule
+
+# 在线异常检测配置 (可通过环境变量调整)
+ANOMALY_DETECTION = os.getenv("ANOMALY_DETECTION", "1") == "1"
+ANOMALY_SIGNALS = tuple(s.strip() for s in os.getenv("ANOMALY_SIGNALS", "current,power").split(",") if s.strip())
+ANOMALY_BASELINE_SAMPLES = float(os.getenv("ANOMALY_BASELINE_SAMPLES", str(7 * 86400)))  # 基线 EWMA 的等效窗口 (样本数，1Hz 约一周)
+ANOMALY_FAST_SAMPLES = float(os.getenv("ANOMALY_FAST_SAMPLES", "60"))                 # 短期 EWMA 的等效窗口
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "600"))              # 累计多少个有效样本后才开始报警
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "6"))                        # 尖峰: |z| 超过该值
+ANOMALY_CUSUM_K = float(os.getenv("ANOMALY_CUSUM_K", "0.5"))          # CUSUM 允许的偏移 (单位: 标准差)
+ANOMALY_CUSUM_H = float(os.getenv("ANOMALY_CUSUM_H", "30"))           # CUSUM 报警阈值
+ANOMALY_CUSUM_CLIP = float(os.getenv("ANOMALY_CUSUM_CLIP", "4"))      # 单个样本对 CUSUM 的贡献上限，避免一次尖峰直接触发漂移报警
+ANOMALY_FLAT_RATIO = float(os.getenv("ANOMALY_FLAT_RATIO", "0.02"))   # 平直: 短期标准差 / 基线标准差 低于该比例
+ANOMALY_CHECKPOINT_INTERVAL = float(os.getenv("ANOMALY_CHECKPOINT_INTERVAL", "60"))
+ANOMALY_STATE_KEY = os.getenv("ANOMALY_STATE_KEY", "ems:anomaly:state")
+ANOMALY_RESET_KEY = os.getenv("ANOMALY_RESET_KEY", "ems:anomaly:reset")  # 重置请求: device_id (或 *) -> 时间戳
+
+SIGNAL_UNITS = {"current": "A", "power": "kW", "voltage": "V"}
+
+# 状态数组最后一维的字段 (每台设备 × 每个信号一组，全部 float64)
+N, MEAN, VAR, FAST_MEAN, FAST_VAR, CUSUM_POS, CUSUM_NEG, LAST_TS = range(8)
+STATE_FIELDS = 8
+
+
+def state_key() -> str:
+    """
+    本进程的检查点 hash：消费组模式下按分区号区分 (每台设备只归一个消费者，互不覆盖)；
+    调整消费者数量后归属变化的设备找不到旧检查点，会重新预热
+    """
+    group = os.getenv("MQTT_CONSUMER_GROUP")
+    if not group:
+        return ANOMALY_STATE_KEY
+    return f"{ANOMALY_STATE_KEY}:{group}:{os.getenv('MQTT_CONSUMER_INDEX', '0')}"
+
+
+class AnomalyResult:
+    """一个批次的检测结果 (每行 × 每个信号)，供三条检测规则共用"""
+
+    __slots__ = ("z", "cusum", "flat_ratio", "mean", "fast_mean", "warm")
+
+    def __init__(self, n: int, signals: int):
+        self.z = np.zeros((n, signals))
+        self.cusum = np.zeros((n, signals))          # max(CUSUM+, CUSUM-)
+        self.flat_ratio = np.full((n, signals), np.inf)
+        self.mean = np.zeros((n, signals))
+        self.fast_mean = np.zeros((n, signals))
+        self.warm = np.zeros((n, signals), dtype=bool)
+
+
+class AnomalyDetector:
+    """
+    流式异常检测 (每台设备 × 每个信号 O(1) 状态)：
+    - 基线: 慢 EWMA 均值 / 方差 (约一周)，短期: 快 EWMA 均值 / 方差 (约一分钟)
+    - 尖峰: 样本相对基线的 z-score 超过 ANOMALY_Z
+    - 漂移: 双边 CUSUM 累计 z-score 的持续偏移 (例如排水泵电流比上周高 15%)
+    - 平直: 短期方差相对基线方差塌缩 (传感器冻结 / 通讯网关重复上报同一值附近的读数)
+    状态保存在按 device_id 下标的连续数组 state[device, signal, field] 中；
+    每个批次按 "段内第 k 条" 分步，每一步对所有设备做一次向量化更新，循环次数只取决于单台设备在批次内的最多读数。
+    读数为 0 (停机) 的样本不参与更新。状态按设备定期写入 Redis (state_key())，重启后无需重新预热。
+    run() 只在副本上计算，批次写库成功后 (RuleEngine.commit) 才写回 state；事务失败重试的批次从原状态重新评估。
+    同一设备的两个批次并发评估时 (HTTP 上传与 MQTT 入库同时到达) 后提交的覆盖先提交的。
+    """
+
+    def __init__(self, signals=ANOMALY_SIGNALS, capacity: int = 64):
+        self.signals = tuple(signals)
+        self.alpha = 2.0 / (ANOMALY_BASELINE_SAMPLES + 1)
+        self.fast_alpha = 2.0 / (ANOMALY_FAST_SAMPLES + 1)
+        self.state = np.zeros((capacity, len(self.signals), STATE_FIELDS))
+        self._dirty = set()
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+        self._reset_seen = time.time()  # 已处理到的重置请求时间戳 (启动前的重置已直接清掉了 Redis 检查点)
+
+        # 统计计数
+        self.samples = 0
+        self.checkpoints = 0
+        self.restored = 0
+        self.errors = 0
+
+    def ensure(self, max_device_id: int):
+        capacity = len(self.state)
+        if max_device_id < capacity:
+            return
+        grown = np.zeros((max(capacity * 2, max_device_id + 1),) + self.state.shape[1:])
+        grown[:capacity] = self.state
+        self.state = grown
+
+    # ---------------- 检测 (入库线程，规则引擎锁内调用) ----------------
+    def run(self, ctx: RuleContext) -> AnomalyResult:
+        """对一个批次给出逐行检测结果；同一个 ctx 只计算一次 (三条规则共用)，新状态在 ctx 提交时写回"""
+        if ctx.anomaly is not None:
+            return ctx.anomaly
+        with self._lock:
+            if not self._loaded:
+                self.restore()
+            ctx.anomaly, devices, rows = self._update(ctx.batch)
+        if len(devices):
+            ctx.on_commit.append(lambda: self.commit(devices, rows, len(ctx.batch)))
+        return ctx.anomaly
+
+    def commit(self, devices: np.ndarray, rows: np.ndarray, samples: int):
+        """批次已写库：把 _update 算出的新状态写回"""
+        with self._lock:
+            self.ensure(int(devices.max()))
+            self.state[devices] = rows
+            self._dirty.update(devices.tolist())
+            self.samples += samples
+
+    def _update(self, batch) -> Tuple[AnomalyResult, np.ndarray, np.ndarray]:
+        """在批次涉及设备的状态副本上递推，返回 (检测结果, 设备号, 新状态行)，不修改 self.state"""
+        n = len(batch)
+        result = AnomalyResult(n, len(self.signals))
+        if not n:
+            return result, np.empty(0, dtype=np.int64), self.state[:0].copy()
+        self.ensure(int(batch.device_id.max()))
+        devices = np.unique(batch.device_id)
+        work = self.state[devices]                    # 花式索引，得到副本
+        slot = np.searchsorted(devices, batch.device_id)
+
+        values = np.stack([getattr(batch, s) for s in self.signals], axis=1)
+        starts = np.flatnonzero(batch.segment_starts())
+        lengths = np.diff(np.append(starts, n))
+        a, fa = self.alpha, self.fast_alpha
+
+        for k in range(int(lengths.max())):
+            rows = starts[lengths > k] + k
+            dev = slot[rows]
+            st = work[dev]                            # (m, signals, fields) 副本
+            x = values[rows]
+            active = np.isfinite(x) & (x != 0)
+
+            count, mean, var = st[..., N], st[..., MEAN], st[..., VAR]
+            warm = active & (count >= ANOMALY_WARMUP)
+            # 方差下限：避免基线几乎恒定时 z-score 被无限放大
+            std = np.sqrt(np.maximum(var, (1e-3 * np.abs(mean)) ** 2 + 1e-12))
+            z = np.where(warm, (x - mean) / std, 0.0)
+            zc = np.clip(z, -ANOMALY_CUSUM_CLIP, ANOMALY_CUSUM_CLIP)
+            st[..., CUSUM_POS] = np.where(warm, np.maximum(0.0, st[..., CUSUM_POS] + zc - ANOMALY_CUSUM_K), st[..., CUSUM_POS])
+            st[..., CUSUM_NEG] = np.where(warm, np.maximum(0.0, st[..., CUSUM_NEG] - zc - ANOMALY_CUSUM_K), st[..., CUSUM_NEG])
+
+            # EWMA 均值 / 方差 (增量形式)；样本数不足 1/alpha 时步长取 1/(n+1)，即先按累计平均起步，
+            # 否则慢基线在预热阶段会严重低估方差。第一个有效样本的步长为 1，直接作为初值
+            for m_f, v_f, alpha in ((MEAN, VAR, a), (FAST_MEAN, FAST_VAR, fa)):
+                step = np.where(active, np.maximum(alpha, 1.0 / (count + 1)), 0.0)
+                d = x - st[..., m_f]
+                st[..., m_f] = np.where(active, st[..., m_f] + step * d, st[..., m_f])
+                st[..., v_f] = np.where(active, (1 - step) * (st[..., v_f] + step * d * d), st[..., v_f])
+            st[..., N] = count + active
+            st[..., LAST_TS] = np.where(active, batch.ts[rows, None], st[..., LAST_TS])
+            work[dev] = st
+
+            result.z[rows] = z
+            result.cusum[rows] = np.maximum(st[..., CUSUM_POS], st[..., CUSUM_NEG])
+            result.flat_ratio[rows] = np.where(warm, np.sqrt(st[..., FAST_VAR] / std ** 2), np.inf)
+            result.mean[rows] = st[..., MEAN]
+            result.fast_mean[rows] = st[..., FAST_MEAN]
+            result.warm[rows] = warm
+
+        return result, devices, work
+
+    # ---------------- 状态持久化 (Redis hash: 每台设备一个字段) ----------------
+    def _layout(self) -> str:
+        return f"{','.join(self.signals)}:{STATE_FIELDS}"
+
+    def checkpoint(self, force: bool = True) -> int:
+        """把变化过的设备状态写入 Redis，返回写入的设备数；Redis 异常不影响入库"""
+        with self._lock:
+            if not force and time.monotonic() - self._last_checkpoint < ANOMALY_CHECKPOINT_INTERVAL:
+                return 0
+            self._last_checkpoint = time.monotonic()
+        self._apply_resets()
+        with self._lock:
+            if not self._dirty:
+                return 0
+            dirty, self._dirty = self._dirty, set()
+            mapping = {
+                str(d): base64.b64encode(self.state[d].tobytes()).decode("ascii")
+                for d in dirty
+            }
+        try:
+            RedisClient.get_sync_client().hset(state_key(), mapping={"__layout__": self._layout(), **mapping})
+            self.checkpoints += 1
+            return len(mapping)
+        except Exception as e:
+            self.errors += 1
+            with self._lock:
+                self._dirty.update(dirty)
+            logger.debug(f"[异常检测] 状态写入 Redis 失败: {e}")
+            return 0
+
+    def maybe_checkpoint(self) -> int:
+        return self.checkpoint(force=False)
+
+    def restore(self) -> int:
+        """从 Redis 恢复各设备的检测状态 (信号列表变化时放弃旧状态重新预热)"""
+        self._loaded = True
+        try:
+            raw: Dict[str, str] = RedisClient.get_sync_client().hgetall(state_key())
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ [异常检测] 无法从 Redis 恢复检测状态，将重新预热: {e}")
+            return 0
+        if not raw or raw.pop("__layout__", None) != self._layout():
+            return 0
+        row_shape = self.state.shape[1:]
+        for field, encoded in raw.items():
+            try:
+                device_id = int(field)
+                row = np.frombuffer(base64.b64decode(encoded), dtype=np.float64).reshape(row_shape)
+            except (ValueError, TypeError):
+                continue
+            self.ensure(device_id)
+            self.state[device_id] = row
+            self.restored += 1
+        logger.info(f"✅ [异常检测] 已从 Redis 恢复 {self.restored} 台设备的检测状态")
+        return self.restored
+
+    def _clear(self, device_id: Optional[int]):
+        """调用方持有 self._lock"""
+        if device_id is None:
+            self.state[:] = 0
+            self._dirty.clear()
+        else:
+            if device_id < len(self.state):
+                self.state[device_id] = 0
+            self._dirty.discard(device_id)
+
+    def reset(self, device_id: Optional[int] = None):
+        """
+        清空某台设备 (或全部设备) 的检测状态，例如更换传感器之后重新学习基线
+        当前进程立即生效并清除所有进程的 Redis 检查点；其他运行中的进程在下一次检查点时处理重置请求
+        """
+        with self._lock:
+            self._clear(device_id)
+        field = "*" if device_id is None else str(device_id)
+        try:
+            client = RedisClient.get_sync_client()
+            client.hset(ANOMALY_RESET_KEY, field, time.time())
+            for key in client.scan_iter(match=f"{ANOMALY_STATE_KEY}*"):
+                if device_id is None:
+                    client.delete(key)
+                else:
+                    client.hdel(key, field)
+        except Exception as e:
+            logger.debug(f"[异常检测] 清除 Redis 状态失败: {e}")
+
+    def _apply_resets(self):
+        """处理其他进程 (例如 API 进程) 发出的重置请求"""
+        try:
+            requests = RedisClient.get_sync_client().hgetall(ANOMALY_RESET_KEY)
+        except Exception as e:
+            logger.debug(f"[异常检测] 读取重置请求失败: {e}")
+            return
+        latest = self._reset_seen
+        for field, stamp in requests.items():
+            try:
+                stamp = float(stamp)
+                device_id = None if field == "*" else int(field)
+            except ValueError:
+                continue
+            if stamp <= self._reset_seen:
+                continue
+            with self._lock:
+                self._clear(device_id)
+            latest = max(latest, stamp)
+            logger.info(f"🔄 [异常检测] 已按请求重置{'全部设备' if device_id is None else f'设备 {device_id} '}的检测状态")
+        self._reset_seen = latest
+
+    def stats(self) -> dict:
+        counts = self.state[..., N]
+        return {
+            "enabled": ANOMALY_DETECTION,
+            "signals": list(self.signals),
+            "devices": int(np.count_nonzero(counts.max(axis=1))) if len(counts) else 0,
+            "warm_devices": int(np.count_nonzero((counts >= ANOMALY_WARMUP).any(axis=1))) if len(counts) else 0,
+            "samples": self.samples,
+            "dirty": len(self._dirty),
+            "checkpoints": self.checkpoints,
+            "restored": self.restored,
+            "errors": self.errors,
+        }
+
+
+# 全局检测器实例 (与 rule_engine 一样由 HTTP 上传与 MQTT 批量入库共用)
+anomaly_detector = AnomalyDetector()
+
+
+# =================================================================
+# 离线整段计算 (FDD 历史回溯使用)：与 AnomalyDetector._update 逐样本递推的结果一致，
+# 但把 EWMA 写成分块的线性递推、CUSUM 写成 "累加和减去累加和的历史最小值"，整段数据一次向量化算完
+# =================================================================
+def _linear_recurrence(c: np.ndarray, b: float, y0: float) -> np.ndarray:
+    """
+    计算 y[t] = b * y[t-1] + c[t] (y[-1] = y0)
+    块内用 y[k] = b^k * cumsum(b^-j * c[j]) 一次算完，块与块之间只递推块尾，块长保证 b^-L 不溢出
+    """
+    n = len(c)
+    if n == 0:
+        return np.empty(0)
+    if b <= 0:
+        return c.astype(np.float64, copy=True)
+    block = int(min(256, max(1, 600 // max(-np.log(b), 1e-12))))
+    padded = np.zeros(-(-n // block) * block)
+    padded[:n] = c
+    blocks = padded.reshape(-1, block)
+    k = np.arange(block)
+    local = np.cumsum(blocks * b ** -k, axis=1) * b ** k        # 每块从 0 起步的结果
+    decay = b ** (k + 1)                                       # 块首之前的值在块内第 k 个位置的衰减
+    carry = y0
+    out = np.empty_like(blocks)
+    for i in range(len(blocks)):
+        out[i] = local[i] + decay * carry
+        carry = out[i, -1]
+    return out.reshape(-1)[:n]
+
+
+def _ewma_moments(x: np.ndarray, count: float, mean: float, var: float, alpha: float):
+    """
+    整段样本的 EWMA 均值 / 方差 (每个样本更新之后的值)，步长与在线版本一致: max(alpha, 1/(n+1))
+    - 样本数不足 1/alpha 的前段: 步长 1/(n+1) 等价于累计平均 / 总体方差，直接用 (平移后的) 累加和计算
+    - 之后: 固定 alpha 的线性递推
+    """
+    n = len(x)
+    means = np.empty(n)
+    variances = np.empty(n)
+    switch = int(np.clip(np.ceil(1.0 / alpha - 1 - count), 0, n)) if alpha > 0 else n
+
+    if switch:
+        head = x[:switch]
+        shift = mean if count else head[0]
+        total = count + np.arange(1, switch + 1)
+        s1 = count * (mean - shift) + np.cumsum(head - shift)
+        s2 = count * (var + (mean - shift) ** 2) + np.cumsum((head - shift) ** 2)
+        means[:switch] = shift + s1 / total
+        variances[:switch] = np.maximum(s2 / total - (s1 / total) ** 2, 0.0)
+        mean, var = means[switch - 1], variances[switch - 1]
+
+    if switch < n:
+        tail = x[switch:]
+        tail_means = _linear_recurrence(alpha * tail, 1 - alpha, mean)
+        prev_means = np.concatenate(([mean], tail_means[:-1]))
+        d = tail - prev_means
+        means[switch:] = tail_means
+        variances[switch:] = _linear_recurrence((1 - alpha) * alpha * d * d, 1 - alpha, var)
+    return means, variances
+
+
+def _lindley(y: np.ndarray, s0: float) -> np.ndarray:
+    """S[t] = max(0, S[t-1] + y[t]) 的闭式解: S[t] = C[t] - min(-s0, min_{j<=t} C[j])，C 为 y 的累加和"""
+    c = np.cumsum(y)
+    return c - np.minimum(np.minimum.accumulate(c), -s0)
+
+
+def detect_series(x: np.ndarray, state: np.ndarray, ts: Optional[np.ndarray] = None,
+                  detector: Optional[AnomalyDetector] = None) -> Tuple[dict, np.ndarray]:
+    """
+    对一台设备某个信号的一整段有效读数 (已去掉 0 读数，按时间排序，ts 为对应的 epoch 秒) 做检测
+    state 为该信号的状态行 (长度 STATE_FIELDS，布局与在线检测器相同，可互相恢复)
+    返回 (逐样本结果 z / cusum / flat_ratio / mean / fast_mean / warm, 新的状态行)
+    """
+    detector = detector or anomaly_detector
+    n = len(x)
+    state = state.copy()
+    count0 = state[N]
+
+    means, variances = _ewma_moments(x, count0, state[MEAN], state[VAR], detector.alpha)
+    fast_means, fast_vars = _ewma_moments(x, count0, state[FAST_MEAN], state[FAST_VAR], detector.fast_alpha)
+
+    # 每个样本更新之前的基线
+    prev_mean = np.concatenate(([state[MEAN]], means[:-1]))
+    prev_var = np.concatenate(([state[VAR]], variances[:-1]))
+    warm = (count0 + np.arange(n)) >= ANOMALY_WARMUP
+    std = np.sqrt(np.maximum(prev_var, (1e-3 * np.abs(prev_mean)) ** 2 + 1e-12))
+    z = np.where(warm, (x - prev_mean) / std, 0.0)
+    zc = np.clip(z, -ANOMALY_CUSUM_CLIP, ANOMALY_CUSUM_CLIP)
+
+    # 预热期是开头的一段，CUSUM 从第一个预热完成的样本开始累计
+    first_warm = int(np.argmax(warm)) if warm.any() else n
+    cusum_pos = np.full(n, state[CUSUM_POS])
+    cusum_neg = np.full(n, state[CUSUM_NEG])
+    cusum_pos[first_warm:] = _lindley(zc[first_warm:] - ANOMALY_CUSUM_K, state[CUSUM_POS])
+    cusum_neg[first_warm:] = _lindley(-zc[first_warm:] - ANOMALY_CUSUM_K, state[CUSUM_NEG])
+
+    result = {
+        "z": z,
+        "cusum": np.maximum(cusum_pos, cusum_neg),
+        "flat_ratio": np.where(warm, np.sqrt(fast_vars / std ** 2), np.inf),
+        "mean": means,
+        "fast_mean": fast_means,
+        "warm": warm,
+    }
+    if n:
+        state[N] = count0 + n
+        state[MEAN], state[VAR] = means[-1], variances[-1]
+        state[FAST_MEAN], state[FAST_VAR] = fast_means[-1], fast_vars[-1]
+        state[CUSUM_POS], state[CUSUM_NEG] = cusum_pos[-1], cusum_neg[-1]
+        if ts is not None:
+            state[LAST_TS] = ts[-1]
+    return result, state
+
+
+def _worst(scores: np.ndarray, i: int) -> int:
+    """第 i 行中最异常的信号下标"""
+    return int(np.argmax(scores[i]))
+
+
+class ZScoreSpikeRule(AlarmRule):
+    """读数相对基线的 z-score 超过 ANOMALY_Z (突发尖峰 / 跌落)"""
+    code = "anomaly_spike"
+
+    def evaluate(self, ctx):
+        return (np.abs(anomaly_detector.run(ctx).z) > ANOMALY_Z).any(axis=1)
+
+    def message(self, ctx, i):
+        res = ctx.anomaly
+        s = _worst(np.abs(res.z), i)
+        signal = anomaly_detector.signals[s]
+        value = getattr(ctx.batch, signal)[i]
+        return (f"📊 {signal} 读数异常! {value}{SIGNAL_UNITS.get(signal, '')} "
+                f"偏离基线 {res.mean[i, s]:.2f} 达 {res.z[i, s]:+.1f}σ")
+
+
+class CusumDriftRule(AlarmRule):
+    """双边 CUSUM 超过 ANOMALY_CUSUM_H：读数持续偏离基线 (缓慢劣化)，回落到一半阈值以下视为恢复"""
+    code = "anomaly_drift"
+
+    def evaluate(self, ctx):
+        return (anomaly_detector.run(ctx).cusum > ANOMALY_CUSUM_H).any(axis=1)
+
+    def clear(self, ctx):
+        return (ctx.anomaly.cusum <= ANOMALY_CUSUM_H / 2).all(axis=1)
+
+    def message(self, ctx, i):
+        res = ctx.anomaly
+        s = _worst(res.cusum, i)
+        signal = anomaly_detector.signals[s]
+        base = res.mean[i, s]
+        pct = (res.fast_mean[i, s] - base) / abs(base) * 100 if base else 0.0
+        return (f"📉 {signal} 持续偏离基线! 近期均值 {res.fast_mean[i, s]:.2f}{SIGNAL_UNITS.get(signal, '')} "
+                f"较基线 {base:.2f} 变化 {pct:+.1f}%")
+
+
+class FlatlineRule(AlarmRule):
+    """短期波动相对基线波动塌缩到 ANOMALY_FLAT_RATIO 以下 (读数 "一条直线")，恢复到 2 倍比例以上视为恢复"""
+    code = "anomaly_flatline"
+
+    def evaluate(self, ctx):
+        return (anomaly_detector.run(ctx).flat_ratio < ANOMALY_FLAT_RATIO).any(axis=1)
+
+    def clear(self, ctx):
+        return (ctx.anomaly.flat_ratio >= ANOMALY_FLAT_RATIO * 2).all(axis=1)
+
+    def message(self, ctx, i):
+        res = ctx.anomaly
+        s = _worst(-res.flat_ratio, i)
+        signal = anomaly_detector.signals[s]
+        return (f"➖ {signal} 读数疑似冻结! 近期波动仅为基线的 {res.flat_ratio[i, s] * 100:.1f}% "
+                f"(均值 {res.fast_mean[i, s]:.2f}{SIGNAL_UNITS.get(signal, '')})")
+
+
+ANOMALY_RULES: List[AlarmRule] = [ZScoreSpikeRule(), CusumDriftRule(), FlatlineRule()]
+
+if ANOMALY_DETECTION:
+    for _rule in ANOMALY_RULES:
+        register_rule(_rule)
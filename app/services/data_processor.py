@@ -1,16 +1,31 @@
+import io
 from datetime import datetime
+from typing import List, Sequence
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlmodel import Session
-from app.models.tables import DeviceData, Alarm
-from app.core.config import load_thresholds
+from app.core.database import late_data_refresher
+from app.models.tables import DeviceData
+from app.core.logger import logger
+from app.services.reading_batch import Reading, ReadingBatch
+from app.services.alarm_rules import rule_engine
+from app.services.alarm_state import alarm_tracker
+from app.services.device_snapshot import device_snapshots
+from app.services.anomaly import anomaly_detector  # 导入即向规则引擎注册在线异常检测规则
+
+# 多行 INSERT 时每条语句的最大行数 (PostgreSQL 单条语句最多 65535 个参数，6 列 × 10000 行 以内)
+INSERT_CHUNK_ROWS = 10000
+
+COPY_SQL = 'COPY devicedata (device_id, "timestamp", voltage, "current", power, energy) FROM STDIN'
+
 
 def process_device_data(session: Session, device_id: int, voltage: float, current: float, power: float, energy: float, timestamp: datetime) -> DeviceData:
     """
     统一处理设备数据：
     1. 保存遥测数据到数据库
     2. 加载阈值配置
-    3. 判断是否报警并生成报警记录
+    3. 判断是否报警，经防抖状态机后生成 / 更新报警记录
     """
-    
+
     # 1. 准备数据记录
     new_record = DeviceData(
         device_id=device_id,
@@ -22,33 +37,109 @@ def process_device_data(session: Session, device_id: int, voltage: float, curren
     )
     session.add(new_record)
 
-    # 2. 加载配置 (统一逻辑)
-    settings = load_thresholds()
-    defaults = settings.get("default", {})
-    # 获取特定设备的阈值，如果没有则回退到默认值
-    dev_cfg = settings.get("device_thresholds", {}).get(str(device_id), {})
-
-    limit_current = dev_cfg.get("current_max", defaults.get("current_max", 45.0))
-    limit_v_max = defaults.get("voltage_max", 250.0)
-    limit_v_min = defaults.get("voltage_min", 190.0)
-
-    # 3. 报警判断逻辑
-    
-    # [电流过载报警]
-    if current > limit_current:
-        msg = f"⚠️ 过载报警! 当前: {current}A (上限: {limit_current}A)"
-        # 打印日志方便调试
-        print(f"🚨 [报警 ID:{device_id}] {msg}")
-        session.add(Alarm(device_id=device_id, message=msg, timestamp=timestamp, is_resolved=False))
-
-    # [电压异常报警] - 之前 MQTT Worker 里漏掉了这个，现在统一补上
-    if voltage > limit_v_max or voltage < limit_v_min:
-        msg = f"⚡ 电压异常! 读数: {voltage}V"
-        print(f"🚨 [报警 ID:{device_id}] {msg}")
-        session.add(Alarm(device_id=device_id, message=msg, timestamp=timestamp, is_resolved=False))
-
-    # 4. 提交事务
+    # 2. 加载阈值 + 3. 报警判断 (与批量入库共用同一个规则引擎和状态机，单条读数即一个批次)
+    batch = ReadingBatch.from_rows([(device_id, timestamp, voltage, current, power, energy)])
+    ctx = rule_engine.evaluate(batch)
+    alarm_tracker.process(session, ctx)
+
+    # 4. 提交事务，再推进规则引擎 / 异常检测的跨批次状态、更新 Redis 实时快照
     session.commit()
+    rule_engine.commit(ctx)
     session.refresh(new_record)
-    
-    return new_record
\ No newline at end of file
+    device_snapshots.update_from_batch(batch)
+    anomaly_detector.maybe_checkpoint()
+
+    return new_record
+
+
+def _copy_readings(session: Session, rows: Sequence[Reading]) -> None:
+    """使用 PostgreSQL COPY 一次性写入整批读数 (仅 psycopg2 驱动可用)"""
+    buf = io.StringIO()
+    buf.write("".join(
+        f"{r[0]}\t{r[1].isoformat()}\t{r[2]!r}\t{r[3]!r}\t{r[4]!r}\t{r[5]!r}\n" for r in rows
+    ))
+    buf.seek(0)
+    # session.connection() 保证 COPY 与后续报警写入处于同一个事务中
+    dbapi_conn = session.connection().connection
+    with dbapi_conn.cursor() as cursor:
+        cursor.copy_expert(COPY_SQL, buf)
+
+
+def insert_new_readings(session: Session, rows: Sequence[Reading]) -> List[Reading]:
+    """
+    INSERT ... ON CONFLICT DO NOTHING RETURNING 写入读数，返回真正新写入的行 (已存在的主键跳过)
+    用于 spool 回放与 COPY 失败后的回退：重复的读数不会重复写入，也不会重复触发报警
+    """
+    inserted = set()
+    for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+        chunk = rows[start:start + INSERT_CHUNK_ROWS]
+        values = [
+            {"device_id": r[0], "timestamp": r[1], "voltage": r[2], "current": r[3], "power": r[4], "energy": r[5]}
+            for r in chunk
+        ]
+        statement = (
+            pg_insert(DeviceData).values(values).on_conflict_do_nothing()
+            .returning(DeviceData.device_id, DeviceData.timestamp)
+        )
+        inserted.update((device_id, ts) for device_id, ts in session.exec(statement).all())
+    fresh = []
+    for r in rows:
+        key = (r[0], r[1])
+        if key in inserted:
+            inserted.discard(key)  # 批内重复的主键只算第一条
+            fresh.append(r)
+    return fresh
+
+
+def bulk_insert_readings(session: Session, rows: Sequence[Reading], use_copy: bool = True) -> List[Reading]:
+    """
+    批量写入遥测读数，返回真正写入的行：
+    - 优先走 COPY (最快)，成功即整批写入
+    - COPY 失败 (例如批内 / 库中已有重复主键、驱动不支持) 时回滚，改用 insert_new_readings，
+      只返回原本不存在的行，重复上报的读数不再参与报警判断
+    """
+    if use_copy:
+        try:
+            _copy_readings(session, rows)
+            return list(rows)
+        except Exception as e:
+            logger.warning(f"⚠️ [Ingest] COPY 写入失败，回退为多行 INSERT: {e}")
+            session.rollback()
+    return insert_new_readings(session, rows)
+
+
+def process_device_batch(session: Session, rows: Sequence[Reading], use_copy: bool = True, replay: bool = False) -> int:
+    """
+    批量版的 process_device_data：
+    1. 整批读数一次写入 (COPY / 多行 INSERT)
+    2. 规则引擎对整批读数做一次向量化评估
+    3. 防抖状态机合并为报警事件：新事件一条 INSERT，持续中的事件一条 UPDATE
+    4. 提交后推进规则引擎 / 异常检测的跨批次状态 (事务失败的批次不推进)，
+       用一次 Redis pipeline 更新每台设备的实时快照，并按间隔保存异常检测状态；
+       读数早于连续聚合刷新窗口时 (spool 回放、补传)，登记给 late_data_refresher 补刷聚合
+    replay=True (spool 回放) 或 COPY 失败回退为 INSERT 时：只对数据库里原本不存在的读数做 2~4，重复写入是幂等的
+    返回本批次新开启的报警事件数量
+    """
+    if not rows:
+        return 0
+
+    batch = ReadingBatch.from_rows(rows)
+    if replay:
+        fresh = insert_new_readings(session, batch.rows)
+    else:
+        fresh = bulk_insert_readings(session, batch.rows, use_copy=use_copy)
+    if not fresh:
+        session.commit()
+        return 0
+    if len(fresh) < len(batch):
+        batch = ReadingBatch.from_rows(fresh)
+
+    ctx = rule_engine.evaluate(batch)
+    created = alarm_tracker.process(session, ctx)
+
+    session.commit()
+    rule_engine.commit(ctx)
+    device_snapshots.update_from_batch(batch)
+    anomaly_detector.maybe_checkpoint()
+    late_data_refresher.mark(float(batch.ts.min()), float(batch.ts.max()))
+    return len(created)
@@ -0,0 +1,199 @@
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy import DateTime, delete, extract, func, literal, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.database import AsyncSessionLocal
+from app.core.logger import logger
+from app.models.tables import Alarm, Device, DeviceHealth
+
+# 每开启一次报警事件扣多少分
+FDD_ALARM_PENALTY = float(os.getenv("FDD_ALARM_PENALTY", "5"))
+# 扣分的半衰期 (小时)：一周前的报警只剩 1/4 的影响，长期稳定运行的设备会自然 "回血"
+FDD_HEALTH_HALF_LIFE_HOURS = float(os.getenv("FDD_HEALTH_HALF_LIFE_HOURS", "84"))
+# 按时间窗口统计报警次数时的默认窗口 (小时)
+FDD_WINDOW_HOURS = int(os.getenv("FDD_WINDOW_HOURS", "168"))
+
+HALF_LIFE_SECONDS = FDD_HEALTH_HALF_LIFE_HOURS * 3600
+
+
+def decay(seconds: float) -> float:
+    """经过 seconds 秒后扣分剩余的比例"""
+    return 0.5 ** (max(seconds, 0.0) / HALF_LIFE_SECONDS)
+
+
+def health_score(penalty: float, penalty_at: datetime, now: Optional[datetime] = None) -> float:
+    now = now or datetime.now()
+    return round(max(0.0, 100.0 - penalty * decay((now - penalty_at).total_seconds())), 1)
+
+
+def _decay_sql(later, earlier):
+    return func.power(0.5, func.greatest(extract("epoch", later - earlier), 0) / HALF_LIFE_SECONDS)
+
+
+def _now_sql(now: datetime):
+    """
+    SQL 中的 "当前时间"：传入应用服务器的 datetime.now()，不用数据库的 now()，
+    与 read_health / 报警时间戳 (datetime.fromtimestamp) 使用同一个时钟
+    """
+    return literal(now, DateTime)
+
+
+def record_alarms(session: Session, events: Iterable[Tuple[int, float]]) -> int:
+    """
+    入库报警路径调用 (与报警 INSERT 处于同一事务，不提交)：events 为本批次新开启事件的 (device_id, 首次出现的 epoch 秒)
+    - 先在内存中按设备合并：扣分统一折算到该设备本批次最晚的事件时间
+    - 再用一条 INSERT ... ON CONFLICT DO UPDATE 与表内已有扣分合并：两边都衰减到较晚的时间点再相加，
+      乱序 / 补录的事件也能得到正确结果
+    返回更新的设备数
+    """
+    grouped: Dict[int, List[float]] = defaultdict(list)
+    for device_id, ts in events:
+        grouped[device_id].append(ts)
+    if not grouped:
+        return 0
+
+    rows = []
+    for device_id, stamps in grouped.items():
+        latest = max(stamps)
+        rows.append({
+            "device_id": device_id,
+            "penalty": sum(FDD_ALARM_PENALTY * decay(latest - ts) for ts in stamps),
+            "penalty_at": datetime.fromtimestamp(latest),
+            "alarm_count": len(stamps),
+            "last_alarm_at": datetime.fromtimestamp(latest),
+        })
+
+    table = DeviceHealth.__table__
+    statement = pg_insert(table).values(rows)
+    new = statement.excluded
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.device_id],
+        set_={
+            "penalty": table.c.penalty * _decay_sql(new.penalty_at, table.c.penalty_at)
+                       + new.penalty * _decay_sql(table.c.penalty_at, new.penalty_at),
+            "penalty_at": func.greatest(table.c.penalty_at, new.penalty_at),
+            "alarm_count": table.c.alarm_count + new.alarm_count,
+            "last_alarm_at": func.greatest(table.c.last_alarm_at, new.last_alarm_at),
+        },
+    )
+    session.exec(statement)
+    return len(rows)
+
+
+async def read_health(session: AsyncSession) -> List[dict]:
+    """FDD 排行：一条 JOIN 读取健康度表 (行数 = 出过报警的设备数，与报警表大小无关)，按当前时间衰减后排序"""
+    rows = (await session.exec(
+        select(DeviceHealth, Device.name)
+        .join(Device, Device.id == DeviceHealth.device_id, isouter=True)
+    )).all()
+    now = datetime.now()
+    report = [
+        {
+            "device_id": health.device_id,
+            "device_name": name or f"未知设备({health.device_id})",
+            "alarm_count": health.alarm_count,
+            "health_score": health_score(health.penalty, health.penalty_at, now),
+            "last_alarm_at": health.last_alarm_at,
+        }
+        for health, name in rows
+    ]
+    report.sort(key=lambda r: (r["health_score"], -r["alarm_count"]))
+    return report
+
+
+async def window_stats(session: AsyncSession, hours: int = FDD_WINDOW_HOURS) -> List[dict]:
+    """
+    最近 hours 小时内每台设备的报警统计：一条 GROUP BY + JOIN 完成 (走 alarm.timestamp 索引)
+    health_score 按窗口内的报警事件逐条衰减扣分，与增量维护的健康度口径一致
+    """
+    now = datetime.now()
+    since = now - timedelta(hours=hours)
+    now_sql = _now_sql(now)
+    penalty = func.sum(FDD_ALARM_PENALTY * _decay_sql(now_sql, func.coalesce(Alarm.first_seen, Alarm.timestamp)))
+    statement = (
+        select(
+            Alarm.device_id,
+            Device.name,
+            func.count(Alarm.id).label("alarm_count"),
+            func.sum(Alarm.occurrence_count).label("occurrences"),
+            func.max(Alarm.timestamp).label("last_alarm_at"),
+            penalty.label("penalty"),
+        )
+        .join(Device, Device.id == Alarm.device_id, isouter=True)
+        .where(Alarm.timestamp >= since)
+        .group_by(Alarm.device_id, Device.name)
+        .order_by(func.count(Alarm.id).desc())
+    )
+    rows = (await session.exec(statement)).all()
+    return [
+        {
+            "device_id": device_id,
+            "device_name": name or f"未知设备({device_id})",
+            "alarm_count": count,
+            "occurrences": int(occurrences or 0),
+            "health_score": round(max(0.0, 100.0 - float(penalty or 0)), 1),
+            "last_alarm_at": last_alarm_at,
+        }
+        for device_id, name, count, occurrences, last_alarm_at, penalty in rows
+    ]
+
+
+async def rebuild_health(session: AsyncSession, hours: Optional[int] = None) -> dict:
+    """
+    从报警表重建健康度表 (老库首次升级、手工清理报警之后)：
+    一条 INSERT ... SELECT 把每台设备的报警事件衰减到当前时间求和；hours 为空时使用全部历史
+    重建期间以 SHARE ROW EXCLUSIVE 锁住健康度表：入库路径的 record_alarms 等待重建提交后再合并，
+    不会与 DELETE + INSERT 之间插入的行发生主键冲突，也不会把同一个报警事件算两次
+    """
+    started = time.time()
+    now = datetime.now()
+    event_at = func.coalesce(Alarm.first_seen, Alarm.timestamp)
+    now_sql = _now_sql(now)
+    source = (
+        select(
+            Alarm.device_id,
+            func.sum(FDD_ALARM_PENALTY * _decay_sql(now_sql, event_at)),
+            now_sql,
+            func.count(Alarm.id),
+            func.max(event_at),
+        )
+        .join(Device, Device.id == Alarm.device_id)
+        .group_by(Alarm.device_id)
+    )
+    if hours:
+        source = source.where(Alarm.timestamp >= now - timedelta(hours=hours))
+
+    await session.execute(text(f"LOCK TABLE {DeviceHealth.__tablename__} IN SHARE ROW EXCLUSIVE MODE"))
+    await session.exec(delete(DeviceHealth))
+    await session.exec(
+        pg_insert(DeviceHealth.__table__).from_select(
+            ["device_id", "penalty", "penalty_at", "alarm_count", "last_alarm_at"], source
+        )
+    )
+    await session.commit()
+    count = (await session.exec(select(func.count()).select_from(DeviceHealth))).one()
+    return {"devices": count, "elapsed": round(time.time() - started, 3)}
+
+
+async def delete_health(session: AsyncSession, device_id: int):
+    """删除设备前清理其健康度记录 (不提交)"""
+    await session.exec(delete(DeviceHealth).where(DeviceHealth.device_id == device_id))
+
+
+async def seed_health_if_empty():
+    """启动时调用：健康度表为空但报警表有数据 (老库刚升级) 时，从报警表重建一次"""
+    try:
+        async with AsyncSessionLocal() as session:
+            if (await session.exec(select(DeviceHealth.device_id).limit(1))).first() is not None:
+                return
+            if (await session.exec(select(Alarm.id).limit(1))).first() is None:
+                return
+            result = await rebuild_health(session)
+            logger.info(f"✅ [FDD] 已从报警表重建设备健康度: {result['devices']} 台设备, 耗时 {result['elapsed']}s")
+    except Exception as e:
+        logger.warning(f"⚠️ [FDD] 健康度初始化失败: {e}")
@@ -0,0 +1,190 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from fastapi.encoders import jsonable_encoder
+from sqlmodel import Session, select
+from app.core.database import engine
+from app.core.logger import logger
+from app.core.redis import RedisClient
+from app.models.tables import Device
+
+# 设备变更通知频道：devices.py 增删改 / 启停后发布，各进程收到后重新加载
+DEVICE_REGISTRY_CHANNEL = os.getenv("DEVICE_REGISTRY_CHANNEL", "ems:devices:changed")
+# 兜底的定时刷新间隔 (秒)，防止通知丢失 (Redis 重启 / 断线期间的变更)
+DEVICE_REGISTRY_REFRESH = float(os.getenv("DEVICE_REGISTRY_REFRESH", "300"))
+
+
+class RegistrySnapshot:
+    """某一时刻设备表的只读快照；刷新时整体替换，读取方无需加锁"""
+
+    __slots__ = ("by_id", "by_sn", "known", "body", "etag", "loaded_at")
+
+    def __init__(self, devices: List[Device]):
+        self.by_id: Dict[int, Device] = {d.id: d for d in devices}
+        self.by_sn: Dict[str, Device] = {d.sn: d for d in devices}
+        # 按 device_id 下标的布尔数组，入库批次可以一次判断整列
+        self.known = np.zeros((max(self.by_id) + 1) if self.by_id else 0, dtype=bool)
+        if self.by_id:
+            self.known[list(self.by_id)] = True
+        # GET /devices/ 的响应体预先序列化好 (与 JSONResponse 的编码方式一致)
+        self.body = json.dumps(
+            jsonable_encoder(devices), ensure_ascii=False, allow_nan=False, separators=(",", ":")
+        ).encode("utf-8")
+        self.etag = f'"{hashlib.sha1(self.body).hexdigest()}"'
+        self.loaded_at = time.time()
+
+
+class DeviceRegistry:
+    """
+    进程内设备注册表：
+    - 启动时从数据库加载全部设备，按 id / sn O(1) 查询
+    - 本进程修改设备后调用 notify_changed()：立即重新加载，并通过 Redis 频道通知其他进程 (API worker / 消费者进程)
+    - 后台线程订阅通知频道，收到后重新加载；另有定时刷新兜底
+    - 尚未成功加载 (例如启动时数据库不可用) 时 loaded=False，入库校验会放行所有设备，交给数据库外键兜底
+    """
+
+    def __init__(self):
+        self._snapshot: Optional[RegistrySnapshot] = None
+        self._load_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+        # 统计计数
+        self.reloads = 0
+        self.notifications = 0
+        self.errors = 0
+
+    # ---------------- 查询 ----------------
+    @property
+    def loaded(self) -> bool:
+        return self._snapshot is not None
+
+    @property
+    def snapshot(self) -> Optional[RegistrySnapshot]:
+        return self._snapshot
+
+    def get(self, device_id: int) -> Optional[Device]:
+        snapshot = self._snapshot
+        return snapshot.by_id.get(device_id) if snapshot else None
+
+    def by_sn(self, sn: str) -> Optional[Device]:
+        snapshot = self._snapshot
+        return snapshot.by_sn.get(sn) if snapshot else None
+
+    def exists(self, device_id: int) -> bool:
+        """设备是否已注册 (注册表未加载时一律视为存在)"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return True
+        return device_id in snapshot.by_id
+
+    def known_mask(self, device_ids: np.ndarray) -> np.ndarray:
+        """device_id 数组 -> 是否已注册的布尔数组"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            return np.ones(len(device_ids), dtype=bool)
+        known = snapshot.known
+        in_range = (device_ids >= 0) & (device_ids < len(known))
+        mask = np.zeros(len(device_ids), dtype=bool)
+        mask[in_range] = known[device_ids[in_range]]
+        return mask
+
+    def names(self) -> Dict[int, str]:
+        snapshot = self._snapshot
+        return {d.id: d.name for d in snapshot.by_id.values()} if snapshot else {}
+
+    # ---------------- 加载 / 通知 ----------------
+    def load(self) -> bool:
+        """从数据库重新加载 (同步，供启动阶段 / 后台线程 / asyncio.to_thread 调用)"""
+        try:
+            with self._load_lock:
+                with Session(engine) as session:
+                    devices = list(session.exec(select(Device).order_by(Device.id)).all())
+                self._snapshot = RegistrySnapshot(devices)
+                self.reloads += 1
+            return True
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"⚠️ [设备注册表] 加载失败: {e}")
+            return False
+
+    def notify_changed(self, device_id: Optional[int] = None):
+        """本进程修改了设备表：立即重新加载，并通知其他进程"""
+        self.load()
+        try:
+            RedisClient.get_sync_client().publish(DEVICE_REGISTRY_CHANNEL, "" if device_id is None else str(device_id))
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"[设备注册表] 变更通知发布失败: {e}")
+
+    def start(self):
+        """加载注册表并启动订阅线程 (重复调用是安全的)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self.load()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen, name="device-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=3)
+            self._thread = None
+
+    def _listen(self):
+        backoff = 1.0
+        last_refresh = time.monotonic()
+        while not self._stop.is_set():
+            pubsub = None
+            try:
+                pubsub = RedisClient.get_sync_client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(DEVICE_REGISTRY_CHANNEL)
+                # 重新连上之后先刷新一次，补上断线期间错过的变更
+                if backoff > 1.0:
+                    self.load()
+                backoff = 1.0
+                while not self._stop.is_set():
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message.get("type") == "message":
+                        self.notifications += 1
+                        self.load()
+                        last_refresh = time.monotonic()
+                    elif time.monotonic() - last_refresh > DEVICE_REGISTRY_REFRESH:
+                        self.load()
+                        last_refresh = time.monotonic()
+            except Exception as e:
+                self.errors += 1
+                logger.debug(f"[设备注册表] 订阅断开，{backoff:.0f}s 后重连: {e}")
+                if self._stop.wait(backoff):
+                    break
+                backoff = min(backoff * 2, 30.0)
+                if time.monotonic() - last_refresh > DEVICE_REGISTRY_REFRESH:
+                    self.load()
+                    last_refresh = time.monotonic()
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.reset()
+                    except Exception:
+                        pass
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            "loaded": snapshot is not None,
+            "devices": len(snapshot.by_id) if snapshot else 0,
+            "etag": snapshot.etag if snapshot else None,
+            "loaded_at": snapshot.loaded_at if snapshot else None,
+            "reloads": self.reloads,
+            "notifications": self.notifications,
+            "errors": self.errors,
+        }
+
+
+# 全局单例
+device_registry = DeviceRegistry()
@@ -0,0 +1,167 @@
+import os
+import time
+from datetime import date, datetime
+from typing import Dict, Optional
+import numpy as np
+from app.core.logger import logger
+from app.core.redis import RedisClient
+from app.services.reading_batch import ReadingBatch
+
+# 每台设备一个 Redis hash: ems:device:<id>
+# 字段: ts / voltage / current / power / energy   最后一条读数 (ts 为 epoch 秒)
+#       today / today_first_energy / first_exact  今日第一条读数的电能示数 (first_exact=1 表示确认是当天第一条)
+#       last_seen                                  入库进程最后一次写快照的时间
+#       is_active                                  设备启停状态 (设备接口写入)
+SNAPSHOT_KEY_PREFIX = "ems:device:"
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL", str(2 * 86400)))  # 设备长期离线后快照自动过期
+
+# 原子更新一台设备的快照：
+# - 只接受比现有读数更新的 ts (消费组转发可能导致乱序)
+# - 日期前进时重置今日首条电能；如果快照里原本有前一天的数据，说明是亲眼看到的跨天，today_first_energy 是准确的
+_UPDATE_LUA = """
+local today = redis.call('HGET', KEYS[1], 'today')
+if (not today) or ARGV[6] > today then
+    local exact = '0'
+    if today then exact = '1' end
+    redis.call('HSET', KEYS[1], 'today', ARGV[6], 'today_first_energy', ARGV[7], 'first_exact', exact)
+end
+local cur = tonumber(redis.call('HGET', KEYS[1], 'ts') or '0')
+if tonumber(ARGV[1]) >= cur then
+    redis.call('HSET', KEYS[1], 'ts', ARGV[1], 'voltage', ARGV[2], 'current', ARGV[3],
+               'power', ARGV[4], 'energy', ARGV[5], 'last_seen', ARGV[8])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[9])
+return 1
+"""
+
+# 缓存未命中时，用数据库查询结果补全今日首条电能 (只在同一天且尚未确认时写入)
+_SEED_FIRST_LUA = """
+local today = redis.call('HGET', KEYS[1], 'today')
+if (not today) or today == ARGV[1] then
+    if redis.call('HGET', KEYS[1], 'first_exact') ~= '1' then
+        redis.call('HSET', KEYS[1], 'today', ARGV[1], 'today_first_energy', ARGV[2], 'first_exact', '1')
+        redis.call('EXPIRE', KEYS[1], ARGV[3])
+    end
+end
+return 1
+"""
+
+
+def snapshot_key(device_id: int) -> str:
+    return f"{SNAPSHOT_KEY_PREFIX}{device_id}"
+
+
+class DeviceSnapshotCache:
+    """
+    设备实时快照缓存：
+    - 入库线程在每个批次提交后调用 update_from_batch()，每台设备只写最后一条读数，整批一次 pipeline
+    - /analysis 读取 read() (一次 HGETALL)，未命中或今日首条不确定时再回退数据库
+    """
+
+    def __init__(self):
+        self._update_script = None
+        self.updates = 0
+        self.errors = 0
+
+    def _script(self):
+        if self._update_script is None:
+            self._update_script = RedisClient.get_sync_client().register_script(_UPDATE_LUA)
+        return self._update_script
+
+    # ---------------- 写入 (入库线程) ----------------
+    def update_from_batch(self, batch: ReadingBatch) -> int:
+        """用一个已按 (device_id, ts) 排序的批次更新快照，返回更新的设备数；Redis 异常不影响入库"""
+        if len(batch) == 0:
+            return 0
+        try:
+            update_script = self._script()
+            starts = np.flatnonzero(batch.segment_starts())
+            ends = np.flatnonzero(batch.segment_ends())
+            now = time.time()
+            pipe = RedisClient.get_sync_client().pipeline(transaction=False)
+            day_starts: Dict[date, float] = {}
+            for start, end in zip(starts, ends):
+                last_ts = float(batch.ts[end])
+                day = datetime.fromtimestamp(last_ts).date()
+                if day not in day_starts:
+                    day_starts[day] = datetime.combine(day, datetime.min.time()).timestamp()
+                # 本批次中该设备当天的第一条读数 (批次可能跨过零点)
+                first = start + int(np.searchsorted(batch.ts[start:end + 1], day_starts[day], side="left"))
+                update_script(
+                    keys=[snapshot_key(int(batch.device_id[end]))],
+                    args=[
+                        last_ts,
+                        float(batch.voltage[end]),
+                        float(batch.current[end]),
+                        float(batch.power[end]),
+                        float(batch.energy[end]),
+                        day.isoformat(),
+                        float(batch.energy[first]),
+                        now,
+                        SNAPSHOT_TTL,
+                    ],
+                    client=pipe,
+                )
+            pipe.execute()
+            self.updates += len(starts)
+            return len(starts)
+        except Exception as e:
+            self.errors += 1
+            logger.debug(f"[快照] Redis 写入失败: {e}")
+            return 0
+
+    # ---------------- 读取 (API，异步) ----------------
+    async def read(self, device_id: int) -> Optional[dict]:
+        try:
+            data = await RedisClient.get_client().hgetall(snapshot_key(device_id))
+        except Exception as e:
+            logger.debug(f"[快照] Redis 读取失败: {e}")
+            return None
+        return data or None
+
+    async def seed(self, device_id: int, is_active: Optional[bool] = None, today: Optional[date] = None,
+                   first_energy: Optional[float] = None):
+        """把数据库回退查询得到的设备状态 / 今日首条电能写回快照，下次请求直接命中"""
+        try:
+            client = RedisClient.get_client()
+            key = snapshot_key(device_id)
+            if is_active is not None:
+                await client.hset(key, "is_active", int(is_active))
+                await client.expire(key, SNAPSHOT_TTL)
+            if today is not None and first_energy is not None:
+                await client.eval(_SEED_FIRST_LUA, 1, key, today.isoformat(), first_energy, SNAPSHOT_TTL)
+        except Exception as e:
+            logger.debug(f"[快照] Redis 回填失败: {e}")
+
+    async def seed_latest(self, device_id: int, ts: datetime, voltage: float, current: float, power: float,
+                          energy: float, first_energy: Optional[float] = None):
+        """数据库回退时把最后一条读数写回快照 (与入库线程使用同一段 Lua，不会覆盖更新的读数)"""
+        day = ts.date()
+        try:
+            await RedisClient.get_client().eval(
+                _UPDATE_LUA, 1, snapshot_key(device_id),
+                ts.timestamp(), voltage, current, power, energy,
+                day.isoformat(), energy if first_energy is None else first_energy, time.time(), SNAPSHOT_TTL,
+            )
+        except Exception as e:
+            logger.debug(f"[快照] Redis 回填失败: {e}")
+            return
+        if first_energy is not None:
+            await self.seed(device_id, today=day, first_energy=first_energy)
+
+    async def set_active(self, device_id: int, is_active: bool):
+        """设备启停 / 修改后同步快照里的 is_active"""
+        await self.seed(device_id, is_active=is_active)
+
+    async def delete(self, device_id: int):
+        try:
+            await RedisClient.get_client().delete(snapshot_key(device_id))
+        except Exception as e:
+            logger.debug(f"[快照] Redis 删除失败: {e}")
+
+    def stats(self) -> dict:
+        return {"updates": self.updates, "errors": self.errors}
+
+
+# 全局单例
+device_snapshots = DeviceSnapshotCache()
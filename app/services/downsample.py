@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    """
+    LTTB (Largest-Triangle-Three-Buckets) 降采样，返回保留点的下标 (升序)
+    - 首尾两点固定保留，中间的点均分到 threshold - 2 个桶
+    - 每个桶选出与 "上一个已选点" 和 "下一个桶的平均点" 围成三角形面积最大的点，峰谷不会被平均掉
+    - 桶之间有先后依赖，只能逐桶循环；桶内的面积计算用 NumPy 向量化
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    # edges[k] 为第 k 个桶的起点，最后一个元素 = n - 1 (末点)
+    edges = (np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = n - 1
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_start, next_end = edges[i + 1], edges[i + 2]
+        else:
+            next_start, next_end = n - 1, n
+        cx = x[next_start:next_end].mean()
+        cy = y[next_start:next_end].mean()
+        ax, ay = x[a], y[a]
+        area = np.abs((ax - cx) * (y[start:end] - ay) - (ax - x[start:end]) * (cy - ay))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
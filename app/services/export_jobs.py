@@ -0,0 +1,244 @@
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from app.core.logger import logger
+from app.services.export_service import ExportSpec, estimate_rows, iter_export
+
+# 后台导出配置
+EXPORT_SPOOL_DIR = os.getenv("EXPORT_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "mine_ems_exports"))
+EXPORT_JOB_WORKERS = int(os.getenv("EXPORT_JOB_WORKERS", "2"))        # 同时执行的导出任务数
+EXPORT_JOB_MAX_PENDING = int(os.getenv("EXPORT_JOB_MAX_PENDING", "20"))  # 排队 + 执行中的任务上限
+EXPORT_JOB_TTL = int(os.getenv("EXPORT_JOB_TTL", str(6 * 3600)))        # 结果文件保留秒数
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class ExportQueueFull(RuntimeError):
+    pass
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+class ExportJob:
+    """一个后台导出任务的状态 (由工作线程更新，接口线程只读)"""
+
+    def __init__(self, spec: ExportSpec):
+        self.id = uuid.uuid4().hex
+        self.spec = spec
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.rows = 0
+        self.bytes = 0
+        self.estimated_rows: Optional[int] = None
+        self.error: Optional[str] = None
+        self.requests = 1          # 被多少次相同的提交共享
+        self.cancel_requested = False
+
+    @property
+    def path(self) -> str:
+        return os.path.join(EXPORT_SPOOL_DIR, f"{self.id}{os.path.splitext(self.spec.filename())[1] or '.bin'}")
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def reusable(self) -> bool:
+        """
+        已完成的结果能否直接给相同条件的新提交复用：只有结束时间已过、且任务在结束时间之后才开始执行时，
+        结果才不会再变化；没有 end (导出到 "现在") 或 end 在未来的导出，每次都要重新查询
+        """
+        if self.status != DONE or self.spec.end is None or self.started_at is None:
+            return False
+        end = self.spec.end
+        started = datetime.fromtimestamp(self.started_at, end.tzinfo)
+        return end <= started and end <= datetime.now(end.tzinfo) and os.path.exists(self.path)
+
+    def expired(self, now: float) -> bool:
+        return self.finished_at is not None and now - self.finished_at > EXPORT_JOB_TTL
+
+    def eta_seconds(self) -> Optional[float]:
+        if self.status != RUNNING or not self.estimated_rows or not self.rows or not self.started_at:
+            return None
+        rate = self.rows / max(time.time() - self.started_at, 1e-6)
+        return round(max(self.estimated_rows - self.rows, 0) / rate, 1)
+
+    def to_dict(self) -> dict:
+        progress = None
+        if self.status == DONE:
+            progress = 1.0
+        elif self.estimated_rows:
+            progress = round(min(self.rows / self.estimated_rows, 0.99), 4)
+        return {
+            "id": self.id,
+            "status": self.status,
+            "dataset": self.spec.dataset,
+            "format": self.spec.format,
+            "filename": self.spec.filename(),
+            "device_ids": list(self.spec.device_ids) if self.spec.device_ids else None,
+            "start": self.spec.start,
+            "end": self.spec.end,
+            "columns": list(self.spec.columns),
+            "gzip": self.spec.gzip,
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "estimated_rows": self.estimated_rows,
+            "progress": progress,
+            "eta_seconds": self.eta_seconds(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "expires_at": self.finished_at + EXPORT_JOB_TTL if self.finished_at else None,
+            "requests": self.requests,
+            "error": self.error,
+        }
+
+
+class ExportJobManager:
+    """
+    后台导出任务管理：
+    - 有界线程池执行，排队 + 执行中的任务数超过上限时拒绝新任务
+    - 结果写入本地 spool 目录 (先写 .part，完成后重命名)，超过 TTL 自动清理
+    - 相同的导出条件 (ExportSpec) 在任务进行中时直接复用；已完成的结果只在时间范围已经结束时复用
+      (见 ExportJob.reusable)，十个人导出 "上个月" 只查一次库，导出 "到现在" 则每次拿到最新数据
+    """
+
+    def __init__(self, workers: int = EXPORT_JOB_WORKERS, max_pending: int = EXPORT_JOB_MAX_PENDING):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export-job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, ExportJob] = {}
+        self._by_spec: Dict[ExportSpec, str] = {}
+
+    def submit(self, spec: ExportSpec) -> Tuple[ExportJob, bool]:
+        """提交导出任务，返回 (任务, 是否复用了已有任务)"""
+        self.cleanup()
+        with self._lock:
+            existing = self._jobs.get(self._by_spec.get(spec, ""))
+            if existing and (existing.active or existing.reusable):
+                existing.requests += 1
+                return existing, True
+
+            pending = sum(1 for job in self._jobs.values() if job.active)
+            if pending >= self.max_pending:
+                raise ExportQueueFull(f"导出任务过多 ({pending} 个排队中)，请稍后再试")
+
+            job = ExportJob(spec)
+            self._jobs[job.id] = job
+            self._by_spec[spec] = job.id
+        os.makedirs(EXPORT_SPOOL_DIR, exist_ok=True)
+        self._executor.submit(self._run, job)
+        return job, False
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[ExportJob]:
+        self.cleanup()
+        return sorted(self._jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id: str) -> Optional[ExportJob]:
+        """
+        取消排队 / 执行中的任务 (被多次提交共享时，最后一个提交者取消才真正停止)；
+        已结束的任务直接删除结果文件
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        if job.active:
+            with self._lock:
+                job.requests -= 1
+                if job.requests <= 0:
+                    job.cancel_requested = True
+        else:
+            self._remove(job)
+        return job
+
+    def _run(self, job: ExportJob):
+        if job.cancel_requested:
+            self._finish(job, CANCELLED)
+            return
+        job.status = RUNNING
+        job.started_at = time.time()
+        job.estimated_rows = estimate_rows(job.spec)
+        part_path = job.path + ".part"
+
+        def progress(rows: int):
+            if job.cancel_requested:
+                raise ExportCancelled()
+            job.rows += rows
+
+        try:
+            with open(part_path, "wb") as f:
+                for chunk in iter_export(job.spec, progress=progress):
+                    f.write(chunk)
+                    job.bytes += len(chunk)
+            os.replace(part_path, job.path)
+            self._finish(job, DONE)
+            logger.info(f"📦 [导出] 任务 {job.id} 完成: {job.rows} 行, {job.bytes} 字节")
+        except ExportCancelled:
+            self._discard(part_path)
+            self._finish(job, CANCELLED)
+        except Exception as e:
+            self._discard(part_path)
+            job.error = str(e)
+            self._finish(job, FAILED)
+            logger.error(f"❌ [导出] 任务 {job.id} 失败: {e}")
+
+    def _finish(self, job: ExportJob, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        if status != DONE:
+            # 失败 / 取消的任务不参与去重，相同条件可以重新提交
+            with self._lock:
+                if self._by_spec.get(job.spec) == job.id:
+                    del self._by_spec[job.spec]
+
+    @staticmethod
+    def _discard(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _remove(self, job: ExportJob):
+        self._discard(job.path)
+        with self._lock:
+            self._jobs.pop(job.id, None)
+            if self._by_spec.get(job.spec) == job.id:
+                del self._by_spec[job.spec]
+
+    def cleanup(self):
+        """删除过期任务及其结果文件，以及 spool 目录里不属于任何任务的过期文件 (例如进程重启前留下的)"""
+        now = time.time()
+        for job in [job for job in list(self._jobs.values()) if job.expired(now)]:
+            self._remove(job)
+        try:
+            known = {job.path for job in self._jobs.values()}
+            for name in os.listdir(EXPORT_SPOOL_DIR):
+                path = os.path.join(EXPORT_SPOOL_DIR, name)
+                if path in known or path.removesuffix(".part") in known:
+                    continue
+                if now - os.path.getmtime(path) > EXPORT_JOB_TTL:
+                    self._discard(path)
+        except OSError:
+            pass
+
+    def shutdown(self):
+        for job in self._jobs.values():
+            if job.active:
+                job.cancel_requested = True
+        self._executor.shutdown(wait=True)
+
+
+# 全局单例
+export_jobs = ExportJobManager()
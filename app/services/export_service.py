@@ -0,0 +1,399 @@
+import csv
+import io
+import os
+import zlib
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple
+from sqlalchemy import func
+from sqlmodel import Session, select, text
+from app.core.database import engine
+from app.services.device_registry import device_registry
+from app.models.tables import Alarm, Device, DeviceData
+
+# 服务端游标每次 FETCH 的行数 / 每个 CSV 输出块包含的行数
+EXPORT_FETCH_SIZE = int(os.getenv("EXPORT_FETCH_SIZE", "20000"))
+EXPORT_GZIP_LEVEL = int(os.getenv("EXPORT_GZIP_LEVEL", "6"))
+# Parquet: 每个 row group 的行数 / 压缩算法 (zstd / snappy / gzip / none)
+EXPORT_ROW_GROUP_SIZE = int(os.getenv("EXPORT_ROW_GROUP_SIZE", "500000"))
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+
+FORMATS = {
+    # 格式 -> (文件扩展名, Content-Type)
+    "csv": (".csv", "text/csv; charset=utf-8"),
+    "parquet": (".parquet", "application/vnd.apache.parquet"),
+    "arrow": (".arrows", "application/vnd.apache.arrow.stream"),
+}
+
+
+class ExportSpecError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class ExportColumn:
+    header: str                                  # CSV 表头
+    arrow_type: str                              # Arrow 类型: timestamp / int32 / int64 / float32 / string / bool
+    index: Optional[int] = None                  # 在查询结果行中的位置；None 表示派生列 (设备名称)
+
+
+@dataclass(frozen=True)
+class Dataset:
+    name: str
+    filename: str
+    columns: Dict[str, ExportColumn]
+    statement: Callable[["ExportSpec"], object]
+
+
+def _telemetry_statement(spec: "ExportSpec"):
+    statement = select(
+        DeviceData.timestamp, DeviceData.device_id,
+        DeviceData.voltage, DeviceData.current, DeviceData.power, DeviceData.energy,
+    )
+    if spec.device_ids:
+        statement = statement.where(DeviceData.device_id.in_(spec.device_ids))
+    if spec.start:
+        statement = statement.where(DeviceData.timestamp >= spec.start)
+    if spec.end:
+        statement = statement.where(DeviceData.timestamp < spec.end)
+    return statement.order_by(DeviceData.timestamp, DeviceData.device_id)
+
+
+def _alarm_statement(spec: "ExportSpec"):
+    statement = select(
+        Alarm.timestamp, Alarm.device_id, Alarm.id, Alarm.rule_code, Alarm.message,
+        Alarm.first_seen, Alarm.last_seen, Alarm.occurrence_count, Alarm.is_resolved,
+    )
+    if spec.device_ids:
+        statement = statement.where(Alarm.device_id.in_(spec.device_ids))
+    if spec.start:
+        statement = statement.where(Alarm.timestamp >= spec.start)
+    if spec.end:
+        statement = statement.where(Alarm.timestamp < spec.end)
+    return statement.order_by(Alarm.timestamp, Alarm.id)
+
+
+# 所有数据集的查询结果前两列固定为 (timestamp, device_id)，设备名称由内存映射补充
+DATASETS: Dict[str, Dataset] = {
+    "telemetry": Dataset(
+        name="telemetry",
+        filename="energy_report",
+        columns={
+            "timestamp": ExportColumn("时间", "timestamp", 0),
+            "device_id": ExportColumn("设备ID", "int32", 1),
+            "device_name": ExportColumn("设备名称", "string"),
+            "voltage": ExportColumn("电压(V)", "float32", 2),
+            "current": ExportColumn("电流(A)", "float32", 3),
+            "power": ExportColumn("功率(kW)", "float32", 4),
+            "energy": ExportColumn("能耗(kWh)", "float32", 5),
+        },
+        statement=_telemetry_statement,
+    ),
+    "alarms": Dataset(
+        name="alarms",
+        filename="alarm_report",
+        columns={
+            "timestamp": ExportColumn("时间", "timestamp", 0),
+            "device_id": ExportColumn("设备ID", "int32", 1),
+            "device_name": ExportColumn("设备名称", "string"),
+            "id": ExportColumn("报警ID", "int64", 2),
+            "rule_code": ExportColumn("规则", "string", 3),
+            "message": ExportColumn("报警内容", "string", 4),
+            "first_seen": ExportColumn("首次出现", "timestamp", 5),
+            "last_seen": ExportColumn("最后出现", "timestamp", 6),
+            "occurrence_count": ExportColumn("次数", "int32", 7),
+            "is_resolved": ExportColumn("已处理", "bool", 8),
+        },
+        statement=_alarm_statement,
+    ),
+}
+
+# 遥测数据集的列名 -> CSV 表头
+TELEMETRY_COLUMNS: Dict[str, str] = {name: col.header for name, col in DATASETS["telemetry"].columns.items()}
+
+
+@dataclass(frozen=True)
+class ExportSpec:
+    """一次导出的筛选条件 (不可变，可作为去重键)"""
+    dataset: str = "telemetry"
+    device_ids: Optional[tuple] = None
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    columns: tuple = tuple(TELEMETRY_COLUMNS)
+    gzip: bool = False
+    format: str = "csv"
+
+    @classmethod
+    def build(cls, device_ids: Optional[Sequence[int]] = None, start: Optional[datetime] = None,
+              end: Optional[datetime] = None, columns: Optional[str] = None, gzip: bool = False,
+              dataset: str = "telemetry", format: str = "csv") -> "ExportSpec":
+        """校验并规范化请求参数 (设备号排序去重、列名按逗号分隔)"""
+        if dataset not in DATASETS:
+            raise ExportSpecError(f"未知的数据集: {dataset} (可选: {', '.join(DATASETS)})")
+        if format not in FORMATS:
+            raise ExportSpecError(f"未知的格式: {format} (可选: {', '.join(FORMATS)})")
+        if start and end and start >= end:
+            raise ExportSpecError("start 必须早于 end")
+        available = DATASETS[dataset].columns
+        if columns:
+            names = tuple(c.strip() for c in columns.split(",") if c.strip())
+            unknown = [c for c in names if c not in available]
+            if unknown:
+                raise ExportSpecError(f"未知的列: {', '.join(unknown)}")
+            if not names:
+                raise ExportSpecError("columns 不能为空")
+        else:
+            names = tuple(available)
+        ids = tuple(sorted(set(device_ids))) if device_ids else None
+        # Parquet / Arrow 自带压缩，不再套 gzip
+        return cls(dataset=dataset, device_ids=ids, start=start, end=end, columns=names,
+                   gzip=gzip and format == "csv", format=format)
+
+    def filename(self, extension: Optional[str] = None) -> str:
+        fmt = "%Y%m%d%H%M"
+        parts = [DATASETS[self.dataset].filename]
+        if self.start:
+            parts.append(self.start.strftime(fmt))
+        if self.end:
+            parts.append(self.end.strftime(fmt))
+        if extension is None:
+            extension = FORMATS[self.format][0] + (".gz" if self.gzip else "")
+        return "_".join(parts) + extension
+
+    @property
+    def media_type(self) -> str:
+        return "application/gzip" if self.gzip else FORMATS[self.format][1]
+
+
+def device_name_map(session: Session) -> Dict[int, str]:
+    """设备名称映射 (设备表很小，优先使用进程内设备注册表，避免在大表上做 JOIN)"""
+    if device_registry.loaded:
+        return device_registry.names()
+    return dict(session.exec(select(Device.id, Device.name)).all())
+
+
+def iter_partitions(spec: ExportSpec, fetch_size: int = EXPORT_FETCH_SIZE,
+                    progress: Optional[Callable[[int], None]] = None) -> Iterator[Tuple[Dict[int, str], list]]:
+    """
+    服务端 (命名) 游标分批读取：stream_results + yield_per，每次只在内存里保留 fetch_size 行
+    产出 (device_names, rows)，rows 的列顺序见各数据集的查询语句
+    progress: 每读完一批回调一次 (本批行数)，后台导出任务用来统计进度 / 响应取消 (回调里抛异常即可中止)
+    """
+    with Session(engine) as session:
+        names = device_name_map(session)
+        result = session.connection().execution_options(
+            stream_results=True, yield_per=fetch_size
+        ).execute(DATASETS[spec.dataset].statement(spec))
+        for partition in result.partitions():
+            if progress:
+                progress(len(partition))
+            yield names, partition
+
+
+# ---------------- CSV ----------------
+def _row_getters(spec: ExportSpec):
+    columns = DATASETS[spec.dataset].columns
+    getters = []
+    for name in spec.columns:
+        column = columns[name]
+        if column.index is None:
+            getters.append(lambda r, names: names.get(r[1], ""))
+        elif column.arrow_type == "timestamp":
+            getters.append(lambda r, names, i=column.index: r[i].isoformat(sep=" ", timespec="seconds") if r[i] else "")
+        else:
+            getters.append(lambda r, names, i=column.index: r[i])
+    return getters
+
+
+def iter_csv(spec: ExportSpec, fetch_size: int = EXPORT_FETCH_SIZE,
+             progress: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """
+    逐块生成 CSV 字节流 (内存占用与导出总行数无关)
+    - 带 UTF-8 BOM，Excel 直接打开中文表头不乱码
+    - spec.gzip=True 时边生成边压缩 (gzip 格式)
+    """
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if spec.gzip else None
+    getters = _row_getters(spec)
+    headers = DATASETS[spec.dataset].columns
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def emit() -> bytes:
+        data = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate(0)
+        return compressor.compress(data) if compressor else data
+
+    buffer.write("\ufeff")
+    writer.writerow([headers[c].header for c in spec.columns])
+    chunk = emit()
+    if chunk:
+        yield chunk
+
+    for names, rows in iter_partitions(spec, fetch_size, progress):
+        writer.writerows([[get(r, names) for get in getters] for r in rows])
+        chunk = emit()
+        if chunk:
+            yield chunk
+
+    if compressor:
+        yield compressor.flush()
+
+
+# ---------------- Parquet / Arrow (pyarrow 为可选依赖) ----------------
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("服务器未安装 pyarrow，无法导出 Parquet / Arrow 格式")
+    return pyarrow
+
+
+def arrow_schema(spec: ExportSpec):
+    pa = _require_pyarrow()
+    types = {
+        "timestamp": pa.timestamp("us"),
+        "int32": pa.int32(),
+        "int64": pa.int64(),
+        "float32": pa.float32(),
+        "string": pa.string(),
+        "bool": pa.bool_(),
+    }
+    columns = DATASETS[spec.dataset].columns
+    return pa.schema([pa.field(name, types[columns[name].arrow_type]) for name in spec.columns])
+
+
+def _record_batch(spec: ExportSpec, schema, names: Dict[int, str], rows: list):
+    """把一批数据库行按列转换成带类型的 Arrow RecordBatch"""
+    pa = _require_pyarrow()
+    columns = DATASETS[spec.dataset].columns
+    arrays = []
+    for name, field in zip(spec.columns, schema):
+        column = columns[name]
+        if column.index is None:
+            values = [names.get(r[1]) for r in rows]
+        else:
+            i = column.index
+            values = [r[i] for r in rows]
+        arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """只追加的内存输出：writer 写入后由生成器取走，避免把整个文件留在内存里"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_parquet(spec: ExportSpec, fetch_size: int = EXPORT_FETCH_SIZE,
+                 progress: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """按 row group 流式写出 Parquet：攒够 EXPORT_ROW_GROUP_SIZE 行写一个 row group，然后把字节交出去"""
+    pa = _require_pyarrow()
+    import pyarrow.parquet as pq
+
+    schema = arrow_schema(spec)
+    sink = _ChunkSink()
+    compression = None if EXPORT_PARQUET_COMPRESSION == "none" else EXPORT_PARQUET_COMPRESSION
+    writer = pq.ParquetWriter(sink, schema, compression=compression)
+    pending, pending_rows = [], 0
+
+    def flush_group():
+        nonlocal pending, pending_rows
+        if pending:
+            writer.write_table(pa.Table.from_batches(pending, schema=schema), row_group_size=EXPORT_ROW_GROUP_SIZE)
+            pending, pending_rows = [], 0
+
+    try:
+        for names, rows in iter_partitions(spec, fetch_size, progress):
+            pending.append(_record_batch(spec, schema, names, rows))
+            pending_rows += len(rows)
+            if pending_rows >= EXPORT_ROW_GROUP_SIZE:
+                flush_group()
+                data = sink.drain()
+                if data:
+                    yield data
+        flush_group()
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def iter_arrow_stream(spec: ExportSpec, fetch_size: int = EXPORT_FETCH_SIZE,
+                      progress: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """Arrow IPC stream：每个数据库分批对应一个 RecordBatch，读端可以边下载边处理"""
+    pa = _require_pyarrow()
+    schema = arrow_schema(spec)
+    sink = _ChunkSink()
+    writer = pa.ipc.new_stream(sink, schema)
+    try:
+        for names, rows in iter_partitions(spec, fetch_size, progress):
+            writer.write_batch(_record_batch(spec, schema, names, rows))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+def iter_export(spec: ExportSpec, fetch_size: int = EXPORT_FETCH_SIZE,
+                progress: Optional[Callable[[int], None]] = None) -> Iterator[bytes]:
+    """按 spec.format 选择编码器"""
+    if spec.format == "parquet":
+        return iter_parquet(spec, fetch_size, progress)
+    if spec.format == "arrow":
+        return iter_arrow_stream(spec, fetch_size, progress)
+    return iter_csv(spec, fetch_size, progress)
+
+
+def estimate_rows(spec: ExportSpec) -> Optional[int]:
+    """
+    估算导出行数 (用于进度 / ETA)：
+    - 报警表较小，直接 count(*)
+    - 遥测数据读小时级连续聚合的 samples 之和，避免在上亿行的超表上 count(*)
+    估算失败 (例如没有连续聚合) 时返回 None
+    """
+    try:
+        with Session(engine) as session:
+            if spec.dataset == "alarms":
+                statement = select(func.count()).select_from(_alarm_statement(spec).order_by(None).subquery())
+                return int(session.exec(statement).one())
+            sql = "SELECT COALESCE(sum(samples), 0) FROM devicedata_1h WHERE TRUE"
+            params = {}
+            if spec.device_ids:
+                sql += " AND device_id = ANY(:device_ids)"
+                params["device_ids"] = list(spec.device_ids)
+            if spec.start:
+                sql += " AND bucket >= date_trunc('hour', CAST(:start AS timestamp))"
+                params["start"] = spec.start
+            if spec.end:
+                sql += " AND bucket < :end"
+                params["end"] = spec.end
+            return int(session.execute(text(sql), params).scalar())
+    except Exception:
+        return None
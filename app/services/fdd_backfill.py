@@ -0,0 +1,430 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import delete, func, insert, update
+from sqlmodel import Session, select, text
+from app.core.config import config_service
+from app.core.database import engine
+from app.core.logger import logger
+from app.models.tables import Device, FddFinding, FddRun, FddRunDevice
+from app.services import anomaly
+from app.services.alarm_rules import RULES, RuleEngine
+from app.services.anomaly import ANOMALY_RULES, AnomalyResult, STATE_FIELDS, anomaly_detector, detect_series
+from app.services.reading_batch import ReadingBatch
+
+# 离线回溯配置
+FDD_BACKFILL_WORKERS = int(os.getenv("FDD_BACKFILL_WORKERS", str(max((os.cpu_count() or 2) - 1, 1))))
+FDD_BACKFILL_WINDOW_HOURS = int(os.getenv("FDD_BACKFILL_WINDOW_HOURS", "24"))  # 非 TimescaleDB 时的分片长度
+FDD_FINDING_GAP = float(os.getenv("FDD_FINDING_GAP", "300"))  # 同一规则两次违规间隔不超过该秒数时合并为一个区间
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED = "pending", "running", "done", "failed", "cancelled"
+
+SLICE_SQL = text(
+    'SELECT device_id, "timestamp", voltage, "current", power, energy FROM devicedata '
+    'WHERE device_id = :device_id AND "timestamp" >= :start AND "timestamp" < :end ORDER BY "timestamp"'
+)
+
+# 同一进程内正在执行的回溯任务 (防止重复启动)
+_active_runs: Dict[str, threading.Thread] = {}
+_active_lock = threading.Lock()
+
+
+def time_slices(start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+    """
+    按 hypertable chunk 的时间边界切分 [start, end)，每个分片只命中一个 chunk；
+    不是 TimescaleDB (或查询失败) 时按 FDD_BACKFILL_WINDOW_HOURS 固定切分
+    """
+    slices = []
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT range_start, range_end FROM timescaledb_information.chunks "
+                "WHERE hypertable_name = 'devicedata' AND range_end > :start AND range_start < :end "
+                "ORDER BY range_start"
+            ), {"start": start, "end": end}).all()
+        for range_start, range_end in rows:
+            range_start = range_start.replace(tzinfo=None) if range_start.tzinfo else range_start
+            range_end = range_end.replace(tzinfo=None) if range_end.tzinfo else range_end
+            a, b = max(range_start, start), min(range_end, end)
+            if slices and a < slices[-1][1]:
+                a = slices[-1][1]
+            if a < b:
+                slices.append((a, b))
+    except Exception as e:
+        logger.debug(f"[FDD 回溯] 无法读取 chunk 信息，改用固定分片: {e}")
+        slices = []
+    if slices:
+        return slices
+
+    window = timedelta(hours=FDD_BACKFILL_WINDOW_HOURS)
+    cursor = start
+    while cursor < end:
+        slices.append((cursor, min(cursor + window, end)))
+        cursor += window
+    return slices
+
+
+def detector_params() -> dict:
+    """检测参数快照，随任务一起保存，方便对比调参前后的结果"""
+    params = {name: getattr(anomaly, name) for name in dir(anomaly) if name.startswith("ANOMALY_") and name != "ANOMALY_RULES"}
+    params["ANOMALY_SIGNALS"] = list(params["ANOMALY_SIGNALS"])
+    params["FDD_FINDING_GAP"] = FDD_FINDING_GAP
+    params["config_version"] = config_service.version
+    return params
+
+
+# =================================================================
+# 单台设备的回溯 (在进程池的子进程中执行)
+# =================================================================
+class DeviceBackfill:
+    """
+    一台设备的回溯状态：阈值规则引擎 (私有实例，跨分片保存上一条读数 / 卡死计数)、
+    异常检测状态行 (与在线检测器布局一致)、尚未结束的违规区间
+    """
+
+    def __init__(self, device_id: int, saved: Optional[str] = None):
+        self.device_id = device_id
+        self.engine = RuleEngine(rules=[rule for rule in RULES if rule not in ANOMALY_RULES])
+        self.engine.state.ensure(device_id)
+        self.signals = anomaly_detector.signals
+        self.anomaly_state = np.zeros((len(self.signals), STATE_FIELDS))
+        self.open: Dict[str, list] = {}   # 规则代码 -> [start_ts, end_ts, samples, message]
+        if saved:
+            self._restore(json.loads(saved))
+
+    def _restore(self, data: dict):
+        state = self.engine.state
+        d = self.device_id
+        state.has_last[d], state.last_ts[d], state.last_current[d], state.stuck_run[d] = data["rule"]
+        if data.get("signals") == list(self.signals):
+            self.anomaly_state = np.array(data["anomaly"], dtype=np.float64).reshape(self.anomaly_state.shape)
+        self.open = data.get("open", {})
+
+    def dump(self) -> str:
+        state = self.engine.state
+        d = self.device_id
+        return json.dumps({
+            "rule": [bool(state.has_last[d]), float(state.last_ts[d]), float(state.last_current[d]), int(state.stuck_run[d])],
+            "signals": list(self.signals),
+            "anomaly": self.anomaly_state.ravel().tolist(),
+            "open": self.open,
+        })
+
+    def _detect(self, batch: ReadingBatch):
+        """阈值规则 + 异常检测，返回 (ctx, {规则代码: 违规掩码})"""
+        ctx = self.engine.evaluate(batch)
+        self.engine.commit(ctx)  # 私有引擎，不涉及写库事务，评估完直接推进状态
+        n = len(batch)
+        res = AnomalyResult(n, len(self.signals))
+        for s, signal in enumerate(self.signals):
+            x = getattr(batch, signal)
+            active = np.isfinite(x) & (x != 0)
+            before = self.anomaly_state[s].copy()
+            out, self.anomaly_state[s] = detect_series(x[active], self.anomaly_state[s], batch.ts[active])
+            # 停机 (0 读数) 的行不更新状态：沿用它之前最近一个有效样本的结果
+            pos = np.cumsum(active) - 1
+            seen = pos >= 0
+            take = np.clip(pos, 0, None)
+            res.z[active, s] = out["z"]
+            res.flat_ratio[active, s] = out["flat_ratio"]
+            res.warm[active, s] = out["warm"]
+            if active.any():
+                res.cusum[:, s] = np.where(seen, out["cusum"][take], max(before[anomaly.CUSUM_POS], before[anomaly.CUSUM_NEG]))
+                res.mean[:, s] = np.where(seen, out["mean"][take], before[anomaly.MEAN])
+                res.fast_mean[:, s] = np.where(seen, out["fast_mean"][take], before[anomaly.FAST_MEAN])
+            else:
+                res.cusum[:, s] = max(before[anomaly.CUSUM_POS], before[anomaly.CUSUM_NEG])
+                res.mean[:, s] = before[anomaly.MEAN]
+                res.fast_mean[:, s] = before[anomaly.FAST_MEAN]
+        # 检测规则发现 ctx.anomaly 已存在时直接使用，不会触碰在线检测器的状态
+        ctx.anomaly = res
+        masks = dict(ctx.masks)
+        for rule in ANOMALY_RULES:
+            masks[rule.code] = rule.evaluate(ctx)
+        return ctx, masks
+
+    def process(self, rows: Sequence) -> List[dict]:
+        """处理一个分片的读数，返回本分片中已经结束的违规区间 (待写入 FddFinding)"""
+        if not rows:
+            return []
+        batch = ReadingBatch.from_rows(rows)
+        ctx, masks = self._detect(batch)
+        ts = batch.ts
+        closed = []
+        for code, mask in masks.items():
+            hits = np.flatnonzero(mask)
+            if len(hits):
+                rule = self._rule(code)
+                # 相邻违规间隔超过 FDD_FINDING_GAP 处断开
+                breaks = np.flatnonzero(np.diff(ts[hits]) > FDD_FINDING_GAP) + 1
+                for group in np.split(hits, breaks):
+                    first, last = int(group[0]), int(group[-1])
+                    current = self.open.get(code)
+                    if current and ts[first] - current[1] <= FDD_FINDING_GAP:
+                        current[1] = float(ts[last])
+                        current[2] += len(group)
+                        continue
+                    if current:
+                        closed.append(self._finding(code, current))
+                    self.open[code] = [float(ts[first]), float(ts[last]), len(group), rule.message(ctx, first)]
+            current = self.open.get(code)
+            if current and ts[-1] - current[1] > FDD_FINDING_GAP:
+                closed.append(self._finding(code, self.open.pop(code)))
+        return closed
+
+    def finish(self) -> List[dict]:
+        """回溯结束：剩余的区间全部结束"""
+        closed = [self._finding(code, interval) for code, interval in self.open.items()]
+        self.open = {}
+        return closed
+
+    def _rule(self, code: str):
+        for rule in ANOMALY_RULES:
+            if rule.code == code:
+                return rule
+        return self.engine.rule(code)
+
+    def _finding(self, code: str, interval: list) -> dict:
+        return {
+            "device_id": self.device_id,
+            "rule_code": code,
+            "start_ts": datetime.fromtimestamp(interval[0]),
+            "end_ts": datetime.fromtimestamp(interval[1]),
+            "samples": int(interval[2]),
+            "message": interval[3],
+        }
+
+
+def _run_status(session: Session, run_id: str) -> Optional[str]:
+    return session.exec(select(FddRun.status).where(FddRun.id == run_id)).first()
+
+
+def backfill_device(run_id: str, device_id: int, slices: Sequence[Tuple[datetime, datetime]]) -> dict:
+    """
+    进程池任务：按时间顺序逐个分片读取一台设备的读数，检测后把结果与进度在同一事务内提交
+    任务被取消 (FddRun.status 不再是 running) 时在分片边界停止，之后可从 done_until 继续
+    """
+    started = time.time()
+    with Session(engine) as session:
+        progress = session.get(FddRunDevice, (run_id, device_id))
+        if progress is None or progress.completed:
+            return {"device_id": device_id, "skipped": True}
+        worker = DeviceBackfill(device_id, progress.state)
+
+        for start, end in slices:
+            if progress.done_until and end <= progress.done_until:
+                continue
+            if _run_status(session, run_id) != RUNNING:
+                return {"device_id": device_id, "stopped": True}
+            if progress.done_until and start < progress.done_until:
+                start = progress.done_until
+
+            rows = session.connection().execute(SLICE_SQL, {"device_id": device_id, "start": start, "end": end}).all()
+            findings = worker.process(rows)
+            _save(session, run_id, progress, findings, worker, done_until=end, rows=len(rows))
+
+        _save(session, run_id, progress, worker.finish(), worker, done_until=progress.done_until, rows=0, completed=True)
+    return {"device_id": device_id, "rows": progress.rows, "findings": progress.findings, "elapsed": round(time.time() - started, 2)}
+
+
+def _save(session: Session, run_id: str, progress: FddRunDevice, findings: List[dict], worker: DeviceBackfill,
+          done_until: Optional[datetime], rows: int, completed: bool = False):
+    if findings:
+        session.exec(insert(FddFinding).values([{"run_id": run_id, **f} for f in findings]))
+    progress.done_until = done_until
+    progress.rows += rows
+    progress.findings += len(findings)
+    progress.state = worker.dump()
+    progress.completed = completed
+    session.add(progress)
+    session.commit()
+
+
+# =================================================================
+# 任务管理 (API 进程 / 命令行)
+# =================================================================
+def create_run(start: datetime, end: datetime, device_ids: Optional[List[int]] = None) -> FddRun:
+    """登记一次回溯任务及其设备清单 (不执行)"""
+    with Session(engine) as session:
+        if not device_ids:
+            device_ids = list(session.exec(select(Device.id).order_by(Device.id)).all())
+        run = FddRun(
+            id=uuid.uuid4().hex,
+            start=start,
+            end=end,
+            device_ids=",".join(str(d) for d in device_ids),
+            params=json.dumps(detector_params(), ensure_ascii=False),
+            devices_total=len(device_ids),
+        )
+        session.add(run)
+        session.flush()
+        if device_ids:
+            session.exec(insert(FddRunDevice).values([{"run_id": run.id, "device_id": d} for d in device_ids]))
+        session.commit()
+        session.refresh(run)
+        return run
+
+
+def _claim(run_id: str, force: bool) -> bool:
+    """把任务标记为执行中；已在执行的任务 (可能在另一个进程里) 只有 force=True 时才能接管"""
+    with Session(engine) as session:
+        statement = update(FddRun).where(FddRun.id == run_id).where(FddRun.status != DONE)
+        if not force:
+            statement = statement.where(FddRun.status != RUNNING)
+        result = session.exec(statement.values(status=RUNNING, error=None, updated_at=datetime.now()))
+        session.commit()
+        return result.rowcount > 0
+
+
+def _set_status(run_id: str, status: str, error: Optional[str] = None, only_if_running: bool = False):
+    with Session(engine) as session:
+        statement = update(FddRun).where(FddRun.id == run_id)
+        if only_if_running:
+            statement = statement.where(FddRun.status == RUNNING)
+        session.exec(statement.values(status=status, error=error, updated_at=datetime.now()))
+        session.commit()
+
+
+def execute_run(run_id: str, workers: Optional[int] = None, force: bool = False,
+                on_progress: Optional[Callable[[dict], None]] = None) -> Optional[dict]:
+    """
+    执行 (或继续) 一次回溯：未完成的设备分发到进程池，每台设备一个任务
+    已完成的设备直接跳过，未完成的设备从上次提交的分片之后继续
+    """
+    if not _claim(run_id, force):
+        logger.warning(f"⚠️ [FDD 回溯] 任务 {run_id} 不存在、已完成或正在执行")
+        return None
+    with Session(engine) as session:
+        run = session.get(FddRun, run_id)
+        pending = list(session.exec(
+            select(FddRunDevice.device_id)
+            .where(FddRunDevice.run_id == run_id)
+            .where(FddRunDevice.completed == False)
+            .order_by(FddRunDevice.device_id)
+        ).all())
+        start, end = run.start, run.end
+
+    slices = time_slices(start, end)
+    workers = max(1, min(workers or FDD_BACKFILL_WORKERS, len(pending) or 1))
+    logger.info(f"🔎 [FDD 回溯] 任务 {run_id}: {len(pending)} 台设备, {len(slices)} 个分片, {workers} 个进程")
+
+    errors = []
+    try:
+        # spawn: 子进程重新导入模块，不继承父进程的数据库连接 / 线程
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {pool.submit(backfill_device, run_id, device_id, slices): device_id for device_id in pending}
+            for future in as_completed(futures):
+                device_id = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    errors.append(f"设备 {device_id}: {e}")
+                    logger.error(f"❌ [FDD 回溯] 设备 {device_id} 失败: {e}")
+                if on_progress:
+                    on_progress(run_progress(run_id))
+    except Exception as e:
+        errors.append(str(e))
+
+    if errors:
+        _set_status(run_id, FAILED, error="; ".join(errors)[:2000], only_if_running=True)
+    else:
+        with Session(engine) as session:
+            remaining = session.exec(
+                select(func.count()).select_from(FddRunDevice)
+                .where(FddRunDevice.run_id == run_id).where(FddRunDevice.completed == False)
+            ).one()
+        # 被取消时子进程在分片边界停下，状态保持 cancelled
+        if not remaining:
+            _set_status(run_id, DONE, only_if_running=True)
+    result = run_progress(run_id)
+    logger.info(f"✅ [FDD 回溯] 任务 {run_id} 结束: {result['status']}, {result['rows']} 行, {result['findings']} 条结果")
+    return result
+
+
+def start_in_background(run_id: str, workers: Optional[int] = None, force: bool = False) -> bool:
+    """在后台线程中执行回溯 (API 使用)，同一进程内同一任务只会启动一次"""
+    with _active_lock:
+        thread = _active_runs.get(run_id)
+        if thread and thread.is_alive():
+            return False
+
+        def target():
+            try:
+                execute_run(run_id, workers=workers, force=force)
+            finally:
+                with _active_lock:
+                    _active_runs.pop(run_id, None)
+
+        thread = threading.Thread(target=target, name=f"fdd-backfill-{run_id[:8]}", daemon=True)
+        _active_runs[run_id] = thread
+        thread.start()
+        return True
+
+
+def cancel_run(run_id: str) -> bool:
+    """取消任务：子进程在当前分片提交后停止，之后可通过 resume 继续"""
+    with Session(engine) as session:
+        result = session.exec(
+            update(FddRun).where(FddRun.id == run_id).where(FddRun.status.in_([PENDING, RUNNING]))
+            .values(status=CANCELLED, updated_at=datetime.now())
+        )
+        session.commit()
+        return result.rowcount > 0
+
+
+def run_progress(run_id: str) -> Optional[dict]:
+    """任务进度：已完成设备数、已处理行数、检测结果数，progress 按各设备已覆盖的时间比例平均"""
+    with Session(engine) as session:
+        run = session.get(FddRun, run_id)
+        if run is None:
+            return None
+        devices = session.exec(
+            select(FddRunDevice.done_until, FddRunDevice.completed, FddRunDevice.rows, FddRunDevice.findings)
+            .where(FddRunDevice.run_id == run_id)
+        ).all()
+    span = max((run.end - run.start).total_seconds(), 1.0)
+    covered = [
+        1.0 if completed else (((done_until - run.start).total_seconds() / span) if done_until else 0.0)
+        for done_until, completed, _rows, _findings in devices
+    ]
+    return {
+        "id": run.id,
+        "status": run.status,
+        "start": run.start,
+        "end": run.end,
+        "devices_total": run.devices_total,
+        "devices_done": sum(1 for _d, completed, _r, _f in devices if completed),
+        "rows": sum(r for _d, _c, r, _f in devices),
+        "findings": sum(f for _d, _c, _r, f in devices),
+        "progress": round(sum(covered) / len(covered), 4) if covered else 1.0,
+        "params": json.loads(run.params),
+        "error": run.error,
+        "created_at": run.created_at,
+        "updated_at": run.updated_at,
+    }
+
+
+def list_runs(limit: int = 50) -> List[dict]:
+    with Session(engine) as session:
+        ids = session.exec(select(FddRun.id).order_by(FddRun.created_at.desc()).limit(limit)).all()
+    return [run_progress(run_id) for run_id in ids]
+
+
+def delete_run(run_id: str) -> bool:
+    """删除任务及其全部检测结果 (执行中的任务需先取消)"""
+    with Session(engine) as session:
+        run = session.get(FddRun, run_id)
+        if run is None or run.status == RUNNING:
+            return False
+        session.exec(delete(FddFinding).where(FddFinding.run_id == run_id))
+        session.exec(delete(FddRunDevice).where(FddRunDevice.run_id == run_id))
+        session.exec(delete(FddRun).where(FddRun.id == run_id))
+        session.commit()
+        return True
@@ -0,0 +1,75 @@
+import os
+from datetime import datetime
+import numpy as np
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.models.tables import DeviceData
+from app.services.aggregates import RAW_SOURCE, available_aggregates, plan_series, query_series
+from app.services.downsample import lttb_indices
+
+# 细粒度区间最多读取的原始秒数 (按 1Hz 估算行数)，超过后改用 time_bucket 聚合，避免一次读入上百万行
+HISTORY_RAW_MAX_SECONDS = int(os.getenv("HISTORY_RAW_MAX_SECONDS", "200000"))
+# LTTB 以哪个字段的曲线形状选点 (所有字段共用同一组下标)
+HISTORY_LTTB_FIELD = os.getenv("HISTORY_LTTB_FIELD", "power")
+
+VALUE_FIELDS = ("voltage", "current", "power", "energy")
+
+
+async def query_history(session: AsyncSession, device_id: int, start: datetime, end: datetime, max_points: int) -> dict:
+    """
+    历史曲线，返回列式数组 (timestamps 为 epoch 毫秒)：
+    - 粗区间 (期望桶宽 >= 1 分钟，或原始行数过多): time_bucket 聚合，优先读连续聚合，字段取桶内平均值、电能取桶内最后一条
+    - 细区间: 读取原始读数，超过 max_points 时用 LTTB 选点，保留尖峰形状
+    """
+    span = (end - start).total_seconds()
+    plan = plan_series(start, end, await available_aggregates(session), max_points=max_points)
+
+    if plan.source != RAW_SOURCE or span > HISTORY_RAW_MAX_SECONDS:
+        series = await query_series(session, device_id, start, end, max_points=max_points)
+        return {
+            "device_id": device_id,
+            "mode": "bucket",
+            "source": series["source"],
+            "bucket_seconds": series["bucket_seconds"],
+            "count": len(series["timestamps"]),
+            "timestamps": series["timestamps"],
+            "voltage": series["voltage_avg"],
+            "current": series["current_avg"],
+            "power": series["power_avg"],
+            "energy": series["energy_last"],
+            "samples": series["samples"],
+        }
+
+    rows = (await session.exec(
+        select(DeviceData.timestamp, DeviceData.voltage, DeviceData.current, DeviceData.power, DeviceData.energy)
+        .where(DeviceData.device_id == device_id)
+        .where(DeviceData.timestamp >= start)
+        .where(DeviceData.timestamp < end)
+        .order_by(DeviceData.timestamp)
+    )).all()
+
+    n = len(rows)
+    ts = np.fromiter((r[0].timestamp() for r in rows), dtype=np.float64, count=n)
+    columns = {
+        name: np.fromiter((r[i] for r in rows), dtype=np.float64, count=n)
+        for i, name in enumerate(VALUE_FIELDS, start=1)
+    }
+    mode = "raw"
+    if n > max_points:
+        keep = lttb_indices(ts, columns.get(HISTORY_LTTB_FIELD, columns["power"]), max_points)
+        ts = ts[keep]
+        columns = {name: values[keep] for name, values in columns.items()}
+        mode = "lttb"
+
+    result = {
+        "device_id": device_id,
+        "mode": mode,
+        "source": RAW_SOURCE,
+        "bucket_seconds": None,
+        "count": len(ts),
+        "raw_count": n,
+        "timestamps": (ts * 1000).astype(np.int64).tolist(),
+    }
+    for name, values in columns.items():
+        result[name] = np.round(values, 3).tolist()
+    return result
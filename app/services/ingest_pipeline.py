@@ -0,0 +1,343 @@
+import os
+import time
+import threading
+from collections import deque
+from typing import Callable, List, Optional, Sequence
+import numpy as np
+from sqlalchemy.exc import DBAPIError, DisconnectionError, InterfaceError, OperationalError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlmodel import Session
+from app.core.database import engine
+from app.core.logger import logger
+from app.services.data_processor import process_device_batch
+from app.services.device_registry import device_registry
+from app.services.ingest_spool import SegmentSpool
+from app.services.reading_batch import Reading
+
+# 配置 (可通过环境变量调整)
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "5000"))          # 攒够多少条就立即落库
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "0.5"))  # 最长多少秒落库一次
+INGEST_MAX_BUFFER = int(os.getenv("INGEST_MAX_BUFFER", "200000"))         # 缓冲区上限 (条)
+INGEST_PUT_TIMEOUT = float(os.getenv("INGEST_PUT_TIMEOUT", "1.0"))       # 缓冲区满时生产者最多等待的秒数
+INGEST_USE_COPY = os.getenv("INGEST_USE_COPY", "1") == "1"
+
+# 本地预写 spool：缓冲区写满 / 数据库暂时不可用时，读数先落到本地段文件，数据库恢复后批量补写
+INGEST_SPOOL = os.getenv("INGEST_SPOOL", "1") == "1"
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", os.path.join("data", "ingest_spool"))
+INGEST_SPOOL_REPLAY_BATCH = int(os.getenv("INGEST_SPOOL_REPLAY_BATCH", "50000"))  # 回放时每批写库的条数
+INGEST_SPOOL_SYNC_INTERVAL = float(os.getenv("INGEST_SPOOL_SYNC_INTERVAL", "1.0"))  # 段文件刷盘间隔 (秒)
+INGEST_RETRY_MAX_BACKOFF = float(os.getenv("INGEST_RETRY_MAX_BACKOFF", "10"))     # 数据库不可用时重试的最大间隔 (秒)
+
+
+def write_batch(rows: Sequence[Reading]) -> None:
+    """默认的落库函数：一个批次只开一个 Session、一个事务"""
+    with Session(engine) as session:
+        process_device_batch(session, rows, use_copy=INGEST_USE_COPY)
+
+
+def replay_batch(rows: Sequence[Reading]) -> None:
+    """spool 回放的落库函数：INSERT ... ON CONFLICT DO NOTHING，只对真正新写入的行做报警判断 (可重复回放)"""
+    with Session(engine) as session:
+        process_device_batch(session, rows, use_copy=False, replay=True)
+
+
+def is_transient(error: Exception) -> bool:
+    """数据库暂时不可用 (断线、连接池耗尽、故障切换) 的错误值得重试；数据本身有问题的错误重试也没用"""
+    if isinstance(error, (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)):
+        return True
+    return isinstance(error, DBAPIError) and error.connection_invalidated
+
+
+def default_spool() -> Optional[SegmentSpool]:
+    """每个入库进程一个 spool 目录 (按消费组 + 分区号区分，重启后能找回自己的未回放数据)"""
+    if not INGEST_SPOOL:
+        return None
+    name = f"{os.getenv('MQTT_CONSUMER_GROUP') or 'default'}-{os.getenv('MQTT_CONSUMER_INDEX', '0')}"
+    return SegmentSpool(os.path.join(INGEST_SPOOL_DIR, name))
+
+
+class IngestPipeline:
+    """
+    MQTT 与数据库之间的批量入库管道：
+    - put() 由 MQTT 网络线程调用，只做一次加锁 append，不碰数据库
+    - 后台 flush 线程按 "条数达到 batch_size" 或 "距上次落库超过 flush_interval" 触发落库
+    - 缓冲区有上限，满了之后生产者最多阻塞 put_timeout 秒，仍放不下则丢弃并计数
+    - stop() 保证把缓冲区剩余数据全部落库后再退出
+    - 写库前按设备注册表过滤掉入队之后才被删除的设备的读数 (spool 里的积压可能已停留很久)
+    - 数据本身有问题 (外键冲突、数值越界等) 的批次对半拆开重写，只丢弃出错的读数，其余照常入库
+    配置了 spool 时：
+    - 缓冲区写满后进入 spool 模式，put() 改为追加到本地段文件 (不阻塞、不丢弃)；
+      flush 线程先排空内存缓冲区，再从 spool 按大批次回放，spool 回放完后回到内存模式，
+      因此同一设备的读数始终按到达顺序写库
+    - 写库遇到数据库暂时不可用的错误时，同一批次按退避间隔重试而不是丢弃；停止时仍写不进去的数据落到 spool
+    - 启动时 spool 里有上次遗留的数据，直接以 spool 模式开始
+    """
+
+    def __init__(
+        self,
+        batch_size: int = INGEST_BATCH_SIZE,
+        flush_interval: float = INGEST_FLUSH_INTERVAL,
+        max_buffer: int = INGEST_MAX_BUFFER,
+        put_timeout: float = INGEST_PUT_TIMEOUT,
+        flush_handler: Callable[[Sequence[Reading]], None] = write_batch,
+        spool: Optional[SegmentSpool] = None,
+        replay_handler: Callable[[Sequence[Reading]], None] = replay_batch,
+        replay_batch_size: int = INGEST_SPOOL_REPLAY_BATCH,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.put_timeout = put_timeout
+        self.flush_handler = flush_handler
+        self.spool = spool
+        self.replay_handler = replay_handler
+        self.replay_batch_size = replay_batch_size
+
+        self._buffer: deque = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        self._stopping = threading.Event()
+        self._spooling = False  # True: 新读数写入 spool，由 flush 线程回放
+
+        # 统计计数
+        self.received = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.unknown = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.spooled = 0
+        self.retries = 0
+
+    # ---------------- 生产者 (MQTT 线程) ----------------
+    def put(self, reading: Reading) -> bool:
+        """放入一条读数，成功返回 True；缓冲区持续满载 (且没有可用的 spool) 时丢弃并返回 False"""
+        with self._cond:
+            if self._spooling or len(self._buffer) >= self.max_buffer:
+                if self._spool_put(reading):
+                    return True
+                deadline = time.monotonic() + self.put_timeout
+                while len(self._buffer) >= self.max_buffer:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._running:
+                        self.dropped += 1
+                        return False
+                    self._cond.wait(remaining)
+            self._buffer.append(reading)
+            self.received += 1
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _spool_put(self, reading: Reading) -> bool:
+        """调用方持有 self._cond；写入 spool 失败 (磁盘满等) 时返回 False，退回内存缓冲区的处理方式"""
+        if self.spool is None or not self.spool.enabled:
+            return False
+        try:
+            self.spool.append(reading)
+        except Exception as e:
+            self.spool.errors += 1
+            logger.error(f"❌ [Spool] 写入失败: {e}")
+            return False
+        if not self._spooling:
+            self._spooling = True
+            logger.warning(f"⚠️ [Ingest] 数据库写入跟不上 (缓冲 {len(self._buffer)} 条)，新读数转入本地 spool")
+            self._cond.notify_all()
+        self.received += 1
+        self.spooled += 1
+        return True
+
+    # ---------------- 生命周期 ----------------
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        if self.spool is not None and self.spool.open() and self.spool.depth:
+            self._spooling = True  # 先补写上次遗留的数据，新读数排在它们后面
+        self._running = True
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+        self._thread.start()
+        logger.info(f"✅ [Ingest] 批量入库管道已启动 (batch={self.batch_size}, interval={self.flush_interval}s)")
+
+    def stop(self, timeout: Optional[float] = None):
+        """停止管道：唤醒 flush 线程，把剩余数据全部落库后返回"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._stopping.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        # 线程已退出但仍有残留 (例如 stop 前从未 start)，在当前线程补刷
+        while self._buffer:
+            self._flush(self._take(self.batch_size))
+        if self.spool is not None and self.spool.enabled:
+            # spool 里尚未回放的数据留在磁盘上，下次启动时继续补写
+            if self.spool.depth:
+                logger.info(f"📦 [Spool] 还有 {self.spool.depth} 条读数未回放，下次启动后继续")
+            self.spool.close()
+        self._spooling = False
+        logger.info(f"🛑 [Ingest] 管道已排空: 共写入 {self.written} 条, 丢弃 {self.dropped} 条, 失败 {self.failed} 条")
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._buffer),
+            "received": self.received,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "unknown": self.unknown,
+            "flushes": self.flushes,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+            "retries": self.retries,
+            "spooling": self._spooling,
+            "spooled": self.spooled,
+            "spool": self.spool.stats() if self.spool is not None else None,
+        }
+
+    # ---------------- flush 线程 ----------------
+    def _take(self, n: int) -> List[Reading]:
+        with self._cond:
+            count = min(n, len(self._buffer))
+            batch = [self._buffer.popleft() for _ in range(count)]
+            # 腾出了空间，唤醒可能被阻塞的生产者
+            self._cond.notify_all()
+        return batch
+
+    def _run(self):
+        last_flush = time.monotonic()
+        while True:
+            with self._cond:
+                while self._running and len(self._buffer) < self.batch_size and not self._spooling:
+                    remaining = self.flush_interval - (time.monotonic() - last_flush)
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                running = self._running
+                pending = len(self._buffer)
+
+            if pending:
+                # 内存缓冲区里的数据总是早于 spool 里的，先写
+                self._flush(self._take(self.batch_size))
+            elif self._spooling and running:
+                self._replay()
+            last_flush = time.monotonic()
+            if self.spool is not None:
+                self.spool.sync(INGEST_SPOOL_SYNC_INTERVAL)
+
+            if not running and not self._buffer:
+                break
+
+    def _backoff(self, attempt: int) -> bool:
+        """数据库不可用时等待一段时间再重试；管道正在停止时返回 False"""
+        self.retries += 1
+        return not self._stopping.wait(min(0.5 * 2 ** attempt, INGEST_RETRY_MAX_BACKOFF))
+
+    def _known_rows(self, rows: List[Reading]) -> List[Reading]:
+        """丢弃设备已被删除的读数 (按注册表整列判断)，免得写库时外键冲突再拆批隔离"""
+        if not rows or not device_registry.loaded:
+            return rows
+        mask = device_registry.known_mask(np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows)))
+        if mask.all():
+            return rows
+        self.unknown += len(rows) - int(np.count_nonzero(mask))
+        return [r for r, keep in zip(rows, mask) if keep]
+
+    def _flush(self, batch: List[Reading]):
+        batch = self._known_rows(batch)
+        if not batch:
+            return
+        attempt = 0
+        while True:
+            started = time.perf_counter()
+            try:
+                # 重试时上一次尝试可能已经部分 / 全部提交 (COMMIT 已发出后连接断开、拆半时前一半已写入)，
+                # 改走回放的幂等写法，只对真正新写入的读数做报警判断
+                handler = self.flush_handler if attempt == 0 else self.replay_handler
+                written = self._write_rows(handler, batch)
+                self.written += written
+                if written < len(batch):
+                    logger.error(f"❌ [Ingest] 批次中 {len(batch) - written} 条读数写入失败已丢弃，其余 {written} 条已入库")
+                return
+            except Exception as e:
+                # 走到这里的都是数据库暂时不可用的错误 (数据本身的错误已在 _write_rows 里隔离)
+                if self.spool is None or not self.spool.enabled:
+                    self.failed += len(batch)
+                    logger.error(f"❌ [Ingest] 批量写入失败，丢弃 {len(batch)} 条: {e}")
+                    return
+                if attempt == 0:
+                    logger.warning(f"⚠️ [Ingest] 数据库暂时不可用，批次 ({len(batch)} 条) 稍后重试: {e}")
+                if not self._running or not self._backoff(attempt):
+                    # 停止时数据库仍不可用：本批次和内存缓冲区剩余的读数都早于 spool 里已有的数据，
+                    # 整体放到 spool 最前面，下次启动时先于它们补写，保证同一设备按到达顺序写库
+                    self._spool_batch(batch + self._take(len(self._buffer)))
+                    return
+                attempt += 1
+            finally:
+                self.flushes += 1
+                self.last_flush_seconds = time.perf_counter() - started
+
+    def _spool_batch(self, batch: List[Reading]):
+        try:
+            self.spool.prepend_many(batch)
+            self.spooled += len(batch)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"❌ [Spool] 写入失败，丢弃 {len(batch)} 条: {e}")
+
+    def _replay(self):
+        """从 spool 取一大批回放写库；spool 回放完后 (加锁确认没有新写入) 回到内存模式"""
+        rows, position, consumed = self.spool.read(self.replay_batch_size)
+        valid = len(rows)
+        rows = self._known_rows(rows)
+        if consumed:
+            attempt = 0
+            while True:
+                started = time.perf_counter()
+                try:
+                    written = self._write_rows(self.replay_handler, rows)
+                    break
+                except Exception as e:
+                    if attempt == 0:
+                        logger.warning(f"⚠️ [Spool] 回放写库失败，稍后重试: {e}")
+                    if not self._backoff(attempt):
+                        return  # 停止中：游标不推进，下次启动从同一位置继续
+                    attempt += 1
+                finally:
+                    self.flushes += 1
+                    self.last_flush_seconds = time.perf_counter() - started
+            self.spool.commit(position, consumed, valid)
+            self.written += written
+            if written < len(rows):
+                logger.error(f"❌ [Spool] 回放批次中 {len(rows) - written} 条读数写入失败已丢弃")
+        with self._cond:
+            if self._spooling and self.spool.depth == 0:
+                self._spooling = False
+                logger.info("✅ [Spool] 积压数据已全部补写，恢复内存缓冲模式")
+
+    def _write_rows(self, handler: Callable[[Sequence[Reading]], None], rows: List[Reading]) -> int:
+        """
+        写入一批读数，返回写入的条数：数据库不可用的错误向上抛出 (整批稍后重试)；
+        其他错误 (例如设备已被删除导致外键冲突) 把批次对半拆开分别重试，最终只丢弃出错的那几条
+        handler 每次调用是独立事务，失败的一半整体回滚，不会与成功的一半互相影响
+        """
+        if not rows:
+            return 0
+        try:
+            handler(rows)
+            return len(rows)
+        except Exception as e:
+            if is_transient(e):
+                raise
+            if len(rows) == 1:
+                self.failed += 1
+                logger.debug(f"[Ingest] 丢弃无法写入的读数 device={rows[0][0]} ts={rows[0][1]}: {e}")
+                return 0
+        middle = len(rows) // 2
+        return self._write_rows(handler, rows[:middle]) + self._write_rows(handler, rows[middle:])
+
+
+# 全局管道实例 (与 socket_manager.manager 一样，供其他模块直接导入使用)
+ingest_pipeline = IngestPipeline(spool=default_spool())
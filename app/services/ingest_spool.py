@@ -0,0 +1,415 @@
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.core.logger import logger
+from app.services.reading_batch import Reading
+
+# 每个段文件容纳的记录数 (64 字节/条，默认 16 MB 一个段)
+INGEST_SPOOL_SEGMENT_RECORDS = int(os.getenv("INGEST_SPOOL_SEGMENT_RECORDS", str(256 * 1024)))
+
+# 段文件头: 魔数, 版本, 记录长度, 段容量, 段序号, 创建时间, 头部 CRC (共 64 字节)
+HEADER = struct.Struct("<8sHHIQd")
+HEADER_SIZE = 64
+MAGIC = b"EMSSPOOL"
+VERSION = 1
+# 一条记录: device_id, 时间戳 (微秒), 电压, 电流, 功率, 电量, 入队时间 | CRC32 | 填充 (共 64 字节)
+RECORD = struct.Struct("<qqddddd")
+RECORD_SIZE = 64
+CRC = struct.Struct("<I")
+EMPTY_RECORD = bytes(RECORD_SIZE)
+
+EPOCH = datetime(1970, 1, 1)
+# 新 spool 的第一个段序号；前面留出的序号给 prepend_many() 使用 (把更早的数据插到所有未回放数据之前)
+FIRST_SEQ = 1_000_000
+SEGMENT_NAME = re.compile(r"^seg-(\d{12})\.spool$")
+
+# 读取游标: (段序号, 段内记录下标)
+Position = Tuple[int, int]
+
+
+def encode_timestamp(ts: datetime) -> int:
+    """读数时间 -> 自 1970-01-01 起的微秒数 (按 naive 时间直接换算，与写库时的取值一致，往返无精度损失)"""
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def decode_timestamp(us: int) -> datetime:
+    return EPOCH + timedelta(microseconds=us)
+
+
+def pack_record(reading: Reading, spooled_at: float) -> bytes:
+    body = RECORD.pack(
+        reading[0], encode_timestamp(reading[1]),
+        reading[2], reading[3], reading[4], reading[5], spooled_at,
+    )
+    return body + CRC.pack(zlib.crc32(body)) + bytes(RECORD_SIZE - RECORD.size - CRC.size)
+
+
+def unpack_record(buf, offset: int) -> Optional[tuple]:
+    """校验并解析一条记录；空槽或 CRC 不符 (写到一半的尾部 / 损坏) 返回 None"""
+    end = offset + RECORD.size
+    (crc,) = CRC.unpack_from(buf, end)
+    if zlib.crc32(buf[offset:end]) != crc:
+        return None
+    return RECORD.unpack_from(buf, offset)
+
+
+class Segment:
+    """一个预分配大小的段文件，通过 mmap 读写；只追加，写满后封存"""
+
+    def __init__(self, path: str, seq: int, capacity: int, mm: mmap.mmap, count: int):
+        self.path = path
+        self.seq = seq
+        self.capacity = capacity
+        self.mm = mm
+        self.count = count  # 有效记录数
+
+    @classmethod
+    def create(cls, directory: str, seq: int, capacity: int) -> "Segment":
+        path = os.path.join(directory, f"seg-{seq:012d}.spool")
+        size = HEADER_SIZE + capacity * RECORD_SIZE
+        with open(path, "w+b") as f:
+            f.truncate(size)  # 稀疏文件，实际占用随写入增长
+            mm = mmap.mmap(f.fileno(), size)
+        header = HEADER.pack(MAGIC, VERSION, RECORD_SIZE, capacity, seq, time.time())
+        mm[:HEADER.size] = header
+        mm[HEADER.size:HEADER.size + CRC.size] = CRC.pack(zlib.crc32(header))
+        mm.flush()
+        return cls(path, seq, capacity, mm, 0)
+
+    @classmethod
+    def open(cls, path: str) -> "Segment":
+        """打开已有段文件：校验文件头，顺序扫描到第一个空槽为止 (中间校验失败的记录在回放时跳过)"""
+        with open(path, "r+b") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise ValueError("段文件过短")
+            mm = mmap.mmap(f.fileno(), size)
+        header = mm[:HEADER.size]
+        magic, version, record_size, capacity, seq, _created = HEADER.unpack(header)
+        (crc,) = CRC.unpack_from(mm, HEADER.size)
+        if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE or zlib.crc32(header) != crc:
+            mm.close()
+            raise ValueError("段文件头无效")
+        capacity = min(capacity, (size - HEADER_SIZE) // RECORD_SIZE)
+        count = 0
+        while count < capacity:
+            offset = HEADER_SIZE + count * RECORD_SIZE
+            if mm[offset:offset + RECORD_SIZE] == EMPTY_RECORD:
+                break
+            count += 1
+        return cls(path, seq, capacity, mm, count)
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def append(self, record: bytes):
+        offset = HEADER_SIZE + self.count * RECORD_SIZE
+        self.mm[offset:offset + RECORD_SIZE] = record
+        self.count += 1
+
+    def read(self, start: int, limit: int) -> Tuple[List[tuple], int]:
+        """从 start 开始读取最多 limit 条有效记录，返回 (记录列表, 因校验失败跳过的条数)"""
+        end = min(self.count, start + limit)
+        records, corrupt = [], 0
+        for index in range(start, end):
+            record = unpack_record(self.mm, HEADER_SIZE + index * RECORD_SIZE)
+            if record is None:
+                corrupt += 1
+            else:
+                records.append(record)
+        return records, corrupt
+
+    def spooled_at(self, index: int) -> Optional[float]:
+        record = unpack_record(self.mm, HEADER_SIZE + index * RECORD_SIZE) if index < self.count else None
+        return record[6] if record else None
+
+    def sync(self):
+        self.mm.flush()
+
+    def close(self):
+        try:
+            self.mm.flush()
+            self.mm.close()
+        except (ValueError, OSError):
+            pass
+
+
+class SegmentSpool:
+    """
+    入库管道的本地预写日志 (数据库写入跟不上时暂存读数)：
+    - 读数编码为 64 字节定长记录 (带 CRC32)，顺序追加到 mmap 映射的段文件，写满后封存并新建下一个段
+    - 回放方通过 read() 取一批记录，写库成功后 commit() 推进游标；游标持久化到 cursor.json，
+      整段回放完毕的段文件直接删除
+    - 进程崩溃后重新 open()：按 CRC 找到每个段的有效末尾，从游标处继续回放；
+      游标之后可能有已入库但未来得及 commit 的记录，依赖回放写库的 ON CONFLICT DO NOTHING 保证幂等
+    - 目录用文件锁独占，避免多个消费者进程共用同一个 spool
+    """
+
+    def __init__(self, directory: str, segment_records: int = INGEST_SPOOL_SEGMENT_RECORDS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.enabled = False
+
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._segments: Dict[int, Segment] = {}  # 按序号排列，最后一个为当前写入段
+        self._active: Optional[Segment] = None
+        self._cursor: Position = (0, 0)
+        # prepend_many() 插到游标前面时，原游标所在段已回放过的部分: 段序号 -> 回放从该下标开始
+        self._resume: Dict[int, int] = {}
+        self._depth = 0
+        self._head_spooled_at: Optional[float] = None
+        self._last_sync = time.monotonic()
+
+        # 统计计数
+        self.appended = 0
+        self.replayed = 0
+        self.corrupt = 0
+        self.errors = 0
+
+    # ---------------- 打开 / 恢复 ----------------
+    def open(self) -> bool:
+        """加锁并恢复已有段文件；失败 (目录不可写 / 已被其他进程占用) 时返回 False，管道退回纯内存模式"""
+        if self.enabled:
+            return True
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self._lock_file = open(os.path.join(self.directory, "LOCK"), "a+")
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as e:
+            logger.warning(f"⚠️ [Spool] 无法使用 {self.directory} (已被其他进程占用或不可写)，禁用本地暂存: {e}")
+            if self._lock_file:
+                self._lock_file.close()
+                self._lock_file = None
+            return False
+
+        self._cursor = self._load_cursor()
+        for name in sorted(os.listdir(self.directory)):
+            match = SEGMENT_NAME.match(name)
+            if not match:
+                continue
+            path = os.path.join(self.directory, name)
+            seq = int(match.group(1))
+            if seq < self._cursor[0]:
+                os.remove(path)  # 已回放完、但删除前进程退出的段
+                continue
+            try:
+                segment = Segment.open(path)
+            except (ValueError, OSError) as e:
+                self.errors += 1
+                logger.error(f"❌ [Spool] 段文件 {name} 无法读取，已跳过: {e}")
+                os.rename(path, path + ".bad")
+                continue
+            self._segments[seq] = segment
+
+        # 恢复出来的段全部视为已封存，新数据写入新段
+        if self._segments and self._cursor[0] not in self._segments:
+            self._cursor = (min(self._segments), 0)
+        self._resume = {seq: index for seq, index in self._resume.items() if seq in self._segments}
+        self._depth = sum(s.count for s in self._segments.values()) - (
+            self._cursor[1] if self._cursor[0] in self._segments else 0
+        ) - sum(self._resume.values())
+        next_seq = max(self._segments) + 1 if self._segments else max(self._cursor[0], FIRST_SEQ)
+        self._active = Segment.create(self.directory, next_seq, self.segment_records)
+        self._segments[next_seq] = self._active
+        if self._depth == 0:
+            self._drop_consumed((next_seq, 0))
+            self._cursor = (next_seq, 0)
+            self._resume = {}
+        self._head_spooled_at = self._spooled_at(self._cursor)
+        self.enabled = True
+        if self._depth:
+            logger.info(f"📦 [Spool] 发现 {self._depth} 条未回放的读数 ({len(self._segments) - 1} 个段)，将在数据库可用后补写")
+        return True
+
+    def close(self):
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+            self._active = None
+            self.enabled = False
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # ---------------- 写入 ----------------
+    def append_many(self, readings: Sequence[Reading]):
+        now = time.time()
+        with self._lock:
+            for reading in readings:
+                if self._active.full:
+                    self._rotate()
+                self._active.append(pack_record(reading, now))
+            if self._depth == 0 and readings:
+                self._head_spooled_at = now
+            self._depth += len(readings)
+            self.appended += len(readings)
+
+    def append(self, reading: Reading):
+        self.append_many((reading,))
+
+    def prepend_many(self, readings: Sequence[Reading]):
+        """
+        写入一批比 spool 里所有未回放数据都早的读数 (管道停止时内存里没写进数据库的部分)：
+        单独建一个序号小于游标所在段的段文件，并把游标移到它的开头，回放时最先写库；
+        原游标所在段已回放的部分记在 _resume 里，回放到该段时从原位置继续
+        """
+        if not readings:
+            return
+        with self._lock:
+            seq = self._cursor[0] - 1
+            if self._depth and seq >= 0 and seq not in self._segments:
+                now = time.time()
+                segment = Segment.create(self.directory, seq, len(readings))
+                for reading in readings:
+                    segment.append(pack_record(reading, now))
+                segment.sync()
+                # 先落盘段文件再持久化游标：中途崩溃时最多丢掉这一批，不会影响已有的段
+                self._segments[seq] = segment
+                if self._cursor[1]:
+                    self._resume[self._cursor[0]] = self._cursor[1]
+                self._cursor = (seq, 0)
+                self._depth += len(readings)
+                self.appended += len(readings)
+                self._head_spooled_at = now
+                self._save_cursor()
+                return
+            if self._depth:
+                logger.warning("⚠️ [Spool] 没有可用的前置段序号，较早的读数只能追加到末尾")
+        self.append_many(readings)
+
+    def _rotate(self):
+        """当前段写满：刷盘封存，新建下一个段"""
+        self._active.sync()
+        seq = self._active.seq + 1
+        self._active = Segment.create(self.directory, seq, self.segment_records)
+        self._segments[seq] = self._active
+
+    def sync(self, interval: float = 0.0):
+        """把当前写入段刷到磁盘 (msync)；interval 内已刷过则跳过"""
+        if not self.enabled or time.monotonic() - self._last_sync < interval:
+            return
+        with self._lock:
+            if self._active is not None:
+                self._active.sync()
+            self._last_sync = time.monotonic()
+
+    # ---------------- 回放 ----------------
+    def read(self, limit: int) -> Tuple[List[Reading], Position, int]:
+        """
+        从游标处读取最多 limit 条记录 (不推进游标)
+        返回 (读数, 读完这批之后的位置, 消耗的记录数)；校验失败的记录计入消耗数但不返回
+        """
+        rows: List[Reading] = []
+        consumed = 0
+        with self._lock:
+            seq, index = self._cursor
+            position = self._cursor
+            for segment_seq in sorted(s for s in self._segments if s >= seq):
+                segment = self._segments[segment_seq]
+                start = index if segment_seq == seq else self._resume.get(segment_seq, 0)
+                end = min(segment.count, start + limit - consumed)
+                records, _corrupt = segment.read(start, end - start)
+                rows.extend((r[0], decode_timestamp(r[1]), r[2], r[3], r[4], r[5]) for r in records)
+                consumed += end - start
+                position = (segment_seq, end)
+                if consumed >= limit or end < segment.count or segment is self._active:
+                    break
+        return rows, position, consumed
+
+    def commit(self, position: Position, consumed: int, written: int):
+        """read() 返回的那批已成功写库：推进并持久化游标，删除已回放完的段"""
+        with self._lock:
+            seq, index = position
+            segment = self._segments.get(seq)
+            # 封存段已读到末尾：游标移到下一个段的开头
+            if segment is not None and segment is not self._active and index >= segment.count:
+                later = [s for s in self._segments if s > seq]
+                if later:
+                    seq = min(later)
+                    index = self._resume.pop(seq, 0)
+            self._drop_consumed((seq, index))
+            self._cursor = (seq, index)
+            for done in [s for s in self._resume if s <= seq]:
+                del self._resume[done]
+            self._depth = max(0, self._depth - consumed)
+            self.replayed += written
+            if consumed > written:
+                self.corrupt += consumed - written
+                logger.error(f"❌ [Spool] {consumed - written} 条记录校验失败，已跳过")
+            self._head_spooled_at = self._spooled_at(self._cursor) if self._depth else None
+            self._save_cursor()
+
+    def _drop_consumed(self, position: Position):
+        for seq in [s for s in self._segments if s < position[0]]:
+            segment = self._segments.pop(seq)
+            segment.close()
+            try:
+                os.remove(segment.path)
+            except OSError:
+                pass
+
+    def _spooled_at(self, position: Position) -> Optional[float]:
+        segment = self._segments.get(position[0])
+        return segment.spooled_at(position[1]) if segment else None
+
+    # ---------------- 游标持久化 ----------------
+    def _cursor_path(self) -> str:
+        return os.path.join(self.directory, "cursor.json")
+
+    def _load_cursor(self) -> Position:
+        try:
+            with open(self._cursor_path()) as f:
+                data = json.load(f)
+            self._resume = {int(seq): int(index) for seq, index in data.get("resume", [])}
+            return int(data["seq"]), int(data["index"])
+        except (OSError, ValueError, KeyError, TypeError):
+            self._resume = {}
+            return 0, 0
+
+    def _save_cursor(self):
+        tmp = self._cursor_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "seq": self._cursor[0],
+                "index": self._cursor[1],
+                "resume": sorted(self._resume.items()),
+                "updated_at": time.time(),
+            }, f)
+        os.replace(tmp, self._cursor_path())
+
+    # ---------------- 统计 ----------------
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    def oldest_age(self) -> Optional[float]:
+        """最早一条未回放记录已在 spool 中停留的秒数"""
+        head = self._head_spooled_at
+        return round(time.time() - head, 3) if head and self._depth else None
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "depth": self._depth,
+            "oldest_age_seconds": self.oldest_age(),
+            "segments": len(self._segments),
+            "cursor": list(self._cursor),
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "corrupt": self.corrupt,
+            "errors": self.errors,
+        }
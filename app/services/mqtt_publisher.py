@@ -1,33 +1,299 @@
+import asyncio
 import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
 import paho.mqtt.client as mqtt
+from app.core.logger import logger
 
 # 配置 (与你的 docker-compose 保持一致)
-MQTT_BROKER = "127.0.0.1"
-MQTT_PORT = 1883
+MQTT_BROKER = os.getenv("MQTT_BROKER", "127.0.0.1")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
+MQTT_CONTROL_TOPIC = os.getenv("MQTT_CONTROL_TOPIC", "mine/control")
+MQTT_CONTROL_QOS = int(os.getenv("MQTT_CONTROL_QOS", "1"))
+# 断线期间暂存的指令上限，超过后新指令直接失败 (避免 broker 长时间不可用时无限堆积)
+MQTT_PUBLISH_QUEUE = int(os.getenv("MQTT_PUBLISH_QUEUE", "10000"))
+# 同时在途 (已发出、等待 PUBACK) 的 QoS1 消息上限，超出的由 paho 排队，收到 PUBACK 后依次发出
+MQTT_MAX_INFLIGHT = int(os.getenv("MQTT_MAX_INFLIGHT", "200"))
+# 接口等待 PUBACK 的默认超时 (秒)
+MQTT_ACK_TIMEOUT = float(os.getenv("MQTT_ACK_TIMEOUT", "5"))
+# 超过该时长仍未确认的指令判定失败并清理 (秒)
+MQTT_PENDING_TTL = float(os.getenv("MQTT_PENDING_TTL", "300"))
+CONTROL_ACTIONS = ("start", "stop")
+
+
+class PendingCommand:
+    """一条下发中的控制指令；future 在收到 PUBACK 时完成，结果为确认耗时 (秒)"""
+
+    __slots__ = ("device_id", "action", "topic", "payload", "future", "created", "mid")
+
+    def __init__(self, device_id: int, action: str):
+        self.device_id = device_id
+        self.action = action
+        self.topic = f"{MQTT_CONTROL_TOPIC}/{device_id}"
+        self.payload = json.dumps({"command": action, "device_id": device_id})
+        self.future: Future = Future()
+        self.created = time.monotonic()
+        self.mid: Optional[int] = None
+
+
+def _resolve(future: Future, result=None, error: Optional[BaseException] = None):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(result)
+    else:
+        future.set_exception(error)
+
+
+class CommandPublisher:
+    """
+    常驻的控制指令发布器 (每个进程一个 MQTT 连接)：
+    - start() 用 connect_async + loop_start 建立连接，断线后由 paho 按 1s→30s 退避自动重连
+    - 未连接时指令先进入有界队列，连上后按顺序发出
+    - QoS1 指令按 mid 跟踪，收到 PUBACK 时完成对应的 Future；send() / send_many() 是可 await 的封装
+    锁的约定：paho 在持有内部消息锁时回调 on_publish，所以 client.publish() 调用期间不能持有
+    _ack_lock (否则与网络线程互相等待)；_lock 只保护排队队列与连接状态的切换
+    """
+
+    def __init__(self):
+        self._client: Optional[mqtt.Client] = None
+        self._lock = threading.Lock()
+        self._ack_lock = threading.Lock()
+        self._early_acks: Dict[int, float] = {}  # PUBACK 先于 mid 登记到达 (极少见) 时暂存: mid -> 到达时间
+        self._connected = threading.Event()
+        self._backlog: Deque[PendingCommand] = deque()
+        self._inflight: Dict[int, PendingCommand] = {}
+        self._last_sweep = time.monotonic()
+
+        # 统计计数
+        self.published = 0
+        self.acked = 0
+        self.failed = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.ack_seconds = 0.0
+
+    # ---------------- 生命周期 ----------------
+    @property
+    def connected(self) -> bool:
+        return self._connected.is_set()
+
+    def start(self):
+        """建立常驻连接 (重复调用是安全的；broker 暂不可用时后台持续重试，不阻塞启动)"""
+        with self._lock:
+            if self._client is not None:
+                return
+            client = mqtt.Client(client_id=f"ems-control-{os.getpid()}")
+            client.on_connect = self._on_connect
+            client.on_disconnect = self._on_disconnect
+            client.on_publish = self._on_publish
+            client.reconnect_delay_set(min_delay=1, max_delay=30)
+            client.max_inflight_messages_set(MQTT_MAX_INFLIGHT)
+            client.max_queued_messages_set(0)  # paho 内部队列不设上限，容量由 _backlog 控制
+            self._client = client
+        client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+        client.loop_start()
+        print(f"📡 [指令下发] 控制通道已启动 -> {MQTT_BROKER}:{MQTT_PORT}")
+
+    def stop(self, drain_timeout: float = 2.0):
+        """关闭连接：先等待在途指令确认 (最多 drain_timeout 秒)，剩余的指令判定失败"""
+        client = self._client
+        if client is None:
+            return
+        deadline = time.monotonic() + drain_timeout
+        while self._inflight and self.connected and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._lock, self._ack_lock:
+            self._client = None
+            self._connected.clear()
+            leftover = list(self._inflight.values()) + list(self._backlog)
+            self._inflight.clear()
+            self._early_acks.clear()
+            self._backlog.clear()
+        try:
+            client.disconnect()
+            client.loop_stop()
+        except Exception as e:
+            logger.debug(f"[指令下发] 断开连接异常: {e}")
+        for command in leftover:
+            self.failed += 1
+            _resolve(command.future, error=RuntimeError("publisher stopped"))
+
+    # ---------------- paho 回调 (网络线程) ----------------
+    def _on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            logger.warning(f"⚠️ [指令下发] MQTT 连接被拒绝 rc={rc}")
+            return
+        self.connects += 1
+        with self._lock:
+            self._connected.set()
+            backlog = list(self._backlog)
+            self._backlog.clear()
+        for command in backlog:
+            self._send(client, command)
+        if backlog:
+            logger.info(f"📡 [指令下发] 重连成功，补发 {len(backlog)} 条排队指令")
+
+    def _on_disconnect(self, client, userdata, rc):
+        self._connected.clear()
+        if rc != 0:
+            self.disconnects += 1
+            logger.warning(f"⚠️ [指令下发] MQTT 连接断开 rc={rc}，后台自动重连中")
+
+    def _on_publish(self, client, userdata, mid):
+        if MQTT_CONTROL_QOS == 0:
+            return
+        with self._ack_lock:
+            command = self._inflight.pop(mid, None)
+            if command is None:
+                self._early_acks[mid] = time.monotonic()
+                return
+        latency = time.monotonic() - command.created
+        self.acked += 1
+        self.ack_seconds += latency
+        _resolve(command.future, latency)
+
+    # ---------------- 发布 ----------------
+    def _send(self, client: mqtt.Client, command: PendingCommand):
+        """
+        交给 paho 发送 (调用方不能持有 _ack_lock)
+        QoS1 消息在刚断线时返回 MQTT_ERR_NO_CONN 但已进入 paho 的重发队列，重连后按原 mid 重发
+        """
+        try:
+            info = client.publish(command.topic, command.payload, qos=MQTT_CONTROL_QOS)
+            rc, mid = info.rc, info.mid
+        except Exception as e:
+            self.failed += 1
+            _resolve(command.future, error=e)
+            return
+        if not (rc == mqtt.MQTT_ERR_SUCCESS or (rc == mqtt.MQTT_ERR_NO_CONN and MQTT_CONTROL_QOS > 0)):
+            self.failed += 1
+            _resolve(command.future, error=RuntimeError(mqtt.error_string(rc)))
+            return
+        self.published += 1
+        if MQTT_CONTROL_QOS == 0:
+            # QoS0 没有 PUBACK，写入 socket 即视为完成
+            _resolve(command.future, time.monotonic() - command.created)
+            return
+        command.mid = mid
+        with self._ack_lock:
+            if self._early_acks.pop(mid, None) is not None:
+                acked = True
+            else:
+                self._inflight[mid] = command
+                acked = False
+        if acked:
+            latency = time.monotonic() - command.created
+            self.acked += 1
+            self.ack_seconds += latency
+            _resolve(command.future, latency)
+
+    def _sweep(self):
+        """清理长时间未确认的指令 (clean session 下 broker 重启可能丢掉在途消息)"""
+        now = time.monotonic()
+        if now - self._last_sweep < 10:
+            return
+        self._last_sweep = now
+        expired = []
+        with self._ack_lock:
+            # 已过期 / 已停止的指令迟到的 PUBACK 也会进 _early_acks，留着会误确认复用同一 mid 的新指令
+            for mid in [mid for mid, at in self._early_acks.items() if now - at > 10]:
+                del self._early_acks[mid]
+            for mid in [mid for mid, c in self._inflight.items() if now - c.created > MQTT_PENDING_TTL]:
+                expired.append((self._inflight.pop(mid), "PUBACK not received"))
+        with self._lock:
+            while self._backlog and now - self._backlog[0].created > MQTT_PENDING_TTL:
+                expired.append((self._backlog.popleft(), "broker unavailable"))
+        for command, reason in expired:
+            self.failed += 1
+            _resolve(command.future, error=TimeoutError(reason))
+
+    def publish_many(self, commands: Iterable[Tuple[int, str]]) -> List[PendingCommand]:
+        """线程安全：一次发出一批指令，返回各自的 PendingCommand (不等待确认)"""
+        if self._client is None:
+            self.start()
+        self._sweep()
+        pending = [PendingCommand(device_id, action) for device_id, action in commands]
+        outgoing = []
+        with self._lock:
+            client = self._client
+            for command in pending:
+                if client is not None and self._connected.is_set():
+                    outgoing.append(command)
+                elif len(self._backlog) < MQTT_PUBLISH_QUEUE:
+                    self._backlog.append(command)
+                else:
+                    self.failed += 1
+                    _resolve(command.future, error=RuntimeError("command queue full"))
+        for command in outgoing:
+            self._send(client, command)
+        return pending
+
+    def publish(self, device_id: int, action: str) -> PendingCommand:
+        return self.publish_many([(device_id, action)])[0]
+
+    async def send_many(self, commands: Iterable[Tuple[int, str]], timeout: float = MQTT_ACK_TIMEOUT) -> List[dict]:
+        """
+        批量下发并等待 PUBACK，返回每台设备的结果：
+        {"device_id", "action", "ok", "latency_ms", "error"}；超时未确认的指令仍会在后台继续等待确认
+        """
+        pending = self.publish_many(commands)
+        if not pending:
+            return []
+        # 不用 wait_for：超时后不取消底层 Future，迟到的 PUBACK 仍然计入统计
+        waiters = [asyncio.wrap_future(command.future) for command in pending]
+        await asyncio.wait(waiters, timeout=timeout)
+        results = []
+        for command, waiter in zip(pending, waiters):
+            item = {"device_id": command.device_id, "action": command.action, "ok": False, "latency_ms": None, "error": None}
+            if not waiter.done():
+                item["error"] = "ack timeout" if command.mid is not None else "queued (broker disconnected)"
+            elif waiter.exception() is not None:
+                item["error"] = str(waiter.exception())
+            else:
+                item["ok"] = True
+                item["latency_ms"] = round(waiter.result() * 1000, 2)
+            results.append(item)
+        return results
+
+    async def send(self, device_id: int, action: str, timeout: float = MQTT_ACK_TIMEOUT) -> dict:
+        return (await self.send_many([(device_id, action)], timeout))[0]
+
+    def stats(self) -> dict:
+        return {
+            "broker": f"{MQTT_BROKER}:{MQTT_PORT}",
+            "connected": self.connected,
+            "queued": len(self._backlog),
+            "inflight": len(self._inflight),
+            "published": self.published,
+            "acked": self.acked,
+            "failed": self.failed,
+            "connects": self.connects,
+            "disconnects": self.disconnects,
+            "avg_ack_ms": round(self.ack_seconds / self.acked * 1000, 2) if self.acked else None,
+        }
+
+
+# 全局单例
+command_publisher = CommandPublisher()
+
 
 def publish_control_command(device_id: int, action: str):
     """
-    发送反向控制指令给设备
+    发送反向控制指令给设备 (不等待确认；需要确认结果时使用 command_publisher.send)
     :param device_id: 设备ID
     :param action: "start" | "stop"
     """
     try:
-        # 创建一个临时客户端发送单条指令
-        # 注意：高并发场景下应维护全局连接，但这里演示够用了
-        client = mqtt.Client()
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        
-        topic = f"mine/control/{device_id}"
-        payload = json.dumps({
-            "command": action, 
-            "device_id": device_id
-        })
-        
-        client.publish(topic, payload, qso=1)
-        client.disconnect()
-        
+        command = command_publisher.publish(device_id, action)
+        if command.future.done() and command.future.exception() is not None:
+            raise command.future.exception()
         print(f"📡 [指令下发] To ID:{device_id} -> {action}")
         return True
     except Exception as e:
         print(f"❌ 指令发送失败: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -1,94 +1,322 @@
 import os
 import json
-import asyncio
+import time
+import threading
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 from datetime import datetime
-from sqlmodel import Session
-from app.core.database import engine
-from app.services.data_processor import process_device_data
+from app.core.logger import logger
+from app.core.database import late_data_refresher
+from app.core.redis import RedisClient
+from app.services.ingest_pipeline import ingest_pipeline
+from app.services.anomaly import anomaly_detector
+from app.services.device_registry import device_registry
 
 # 配置
 MQTT_BROKER = os.getenv("MQTT_BROKER", "127.0.0.1")
+MQTT_PORT = int(os.getenv("MQTT_PORT", "1883"))
 MQTT_TOPIC = "mine/telemetry"
 
+# 源端分区：设备把遥测发到 mine/telemetry/<device_id % MQTT_TELEMETRY_PARTITIONS>，
+# 每个分区主题只由归属的消费者订阅，消息不需要在消费者之间转发 (0 = 设备仍然发到 mine/telemetry)
+# 分区数建议取消费者数的整数倍，并且固定不变 (扩容时只调整消费者数)
+MQTT_TELEMETRY_PARTITIONS = int(os.getenv("MQTT_TELEMETRY_PARTITIONS", "0"))
+
+# 消费组配置 (MQTT v5)
+# - MQTT_CONSUMER_GROUP 为空: 传统模式，单个客户端订阅 mine/telemetry (以及全部分区主题)
+# - MQTT_CONSUMER_GROUP=ingest: 订阅本进程负责的分区主题；尚未改发分区主题的设备
+#   仍发到 mine/telemetry，以 $share/ingest/mine/telemetry 共享订阅后转发给归属进程
+MQTT_CONSUMER_GROUP = os.getenv("MQTT_CONSUMER_GROUP", "")
+MQTT_CONSUMER_COUNT = int(os.getenv("MQTT_CONSUMER_COUNT", "1"))   # 组内消费者总数 (分区数)
+MQTT_CONSUMER_INDEX = int(os.getenv("MQTT_CONSUMER_INDEX", "0"))   # 本进程负责的分区号
+MQTT_ROUTE_PREFIX = os.getenv("MQTT_ROUTE_PREFIX", "mine/ingest")  # 分区转发主题前缀
+CONSUMER_STATS_KEY = "ems:ingest:consumers"                        # Redis 中各消费者状态的 hash
+CONSUMER_STATS_INTERVAL = float(os.getenv("CONSUMER_STATS_INTERVAL", "5"))
+# 消费组模式使用持久会话：消费者重启期间 broker 为它保留分区主题 / 转发主题的 QoS1 消息 (秒)
+MQTT_SESSION_EXPIRY = int(os.getenv("MQTT_SESSION_EXPIRY", "3600"))
+
+
+class ConsumerStats:
+    """
+    消费者运行统计：收到 / 转发 / 本地处理条数，以及消费延迟 (当前时间 - 读数时间戳)
+    forward_ratio = 转发条数 / 收到条数：共享订阅的 mine/telemetry 上约 (N-1)/N 的消息要转发一次，
+    即这部分流量经过 broker 两次；全部设备改发分区主题后应当降到 0
+    """
+
+    def __init__(self):
+        self.received = 0
+        self.forwarded = 0
+        self.processed = 0
+        self.unknown = 0
+        self.lag_avg = 0.0
+        self.lag_max = 0.0
+
+    def observe_lag(self, reading_ts: float):
+        lag = max(0.0, time.time() - reading_ts)
+        self.lag_avg = lag if self.processed <= 1 else self.lag_avg * 0.99 + lag * 0.01
+        self.lag_max = max(self.lag_max, lag)
+
+    def snapshot(self, reset_max: bool = False) -> dict:
+        data = {
+            "group": MQTT_CONSUMER_GROUP or None,
+            "index": MQTT_CONSUMER_INDEX,
+            "count": MQTT_CONSUMER_COUNT,
+            "pid": os.getpid(),
+            "received": self.received,
+            "forwarded": self.forwarded,
+            "forward_ratio": round(self.forwarded / self.received, 4) if self.received else 0.0,
+            "processed": self.processed,
+            "unknown": self.unknown,
+            "lag_avg_seconds": round(self.lag_avg, 3),
+            "lag_max_seconds": round(self.lag_max, 3),
+            "ingest": ingest_pipeline.stats(),
+            "reported_at": time.time(),
+        }
+        if reset_max:
+            # 最大延迟按上报周期重新统计
+            self.lag_max = 0.0
+        return data
+
+
+consumer_stats = ConsumerStats()
+
+
+def _create_client():
+    if MQTT_CONSUMER_GROUP:
+        # 共享订阅需要 MQTT v5；client_id 按分区号固定，重启后接回 broker 保留的会话
+        return mqtt.Client(
+            client_id=f"ems-ingest-{MQTT_CONSUMER_GROUP}-{MQTT_CONSUMER_INDEX}",
+            protocol=mqtt.MQTTv5,
+        )
+    return mqtt.Client()
+
+
 # 全局客户端实例
-client = mqtt.Client()
+client = _create_client()
+
+
+def _connect(mqtt_client):
+    """消费组模式用持久会话连接 (clean_start=False + 会话过期时间)，其余情况保持原来的连接方式"""
+    if not MQTT_CONSUMER_GROUP:
+        mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        return
+    properties = Properties(PacketTypes.CONNECT)
+    properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY
+    mqtt_client.connect(MQTT_BROKER, MQTT_PORT, 60, clean_start=False, properties=properties)
+
 
-def process_data(payload_str, broadcast_callback=None):
+def consumer_topics():
+    """本进程需要订阅的主题列表"""
+    if not MQTT_CONSUMER_GROUP:
+        if MQTT_TELEMETRY_PARTITIONS:
+            return [MQTT_TOPIC, f"{MQTT_TOPIC}/+"]
+        return [MQTT_TOPIC]
+    return [
+        f"$share/{MQTT_CONSUMER_GROUP}/{MQTT_TOPIC}",
+        route_topic(MQTT_CONSUMER_INDEX),
+    ] + [telemetry_topic(p) for p in owned_partitions()]
+
+
+def telemetry_topic(partition: int) -> str:
+    """设备发布遥测的分区主题"""
+    return f"{MQTT_TOPIC}/{partition}"
+
+
+def owned_partitions():
+    """本进程负责的源端分区"""
+    return [p for p in range(MQTT_TELEMETRY_PARTITIONS) if p % MQTT_CONSUMER_COUNT == MQTT_CONSUMER_INDEX]
+
+
+def route_topic(partition: int) -> str:
+    return f"{MQTT_ROUTE_PREFIX}/{MQTT_CONSUMER_GROUP}/{partition}"
+
+
+def owner_of(device_id: int) -> int:
     """
-    处理消息：
-    1. 存入数据库 (同步)
+    设备归属的消费者：同一设备永远由同一个消费者处理，保证报警状态机 / 异常检测状态一致
+    转发与分区主题必须算出同一个归属，所以先取源端分区再映射到消费者
+    """
+    if MQTT_TELEMETRY_PARTITIONS:
+        return device_id % MQTT_TELEMETRY_PARTITIONS % MQTT_CONSUMER_COUNT
+    return device_id % MQTT_CONSUMER_COUNT
+
+
+def process_record(data: dict, broadcast_callback=None):
+    """
+    处理一条已解析的消息：
+    1. 放入批量入库管道 (不在 MQTT 网络线程里碰数据库)
     2. 如果有回调，通过 WebSocket 广播 (异步)
     """
+    device_id = int(data['device_id'])
+    # 未注册的设备直接丢弃，不进入入库管道 (否则写库时外键冲突，要拆批重试才能隔离出来)，也不推送给前端
+    if not device_registry.exists(device_id):
+        consumer_stats.unknown += 1
+        return
+    raw_ts = data.get('timestamp', time.time())
+    ts = datetime.fromtimestamp(raw_ts)
+    voltage = float(data['voltage'])
+    current = float(data['current'])
+    power = float(data['power'])
+    energy = float(data['energy'])
+
+    # 1. 入队，由 ingest_pipeline 的后台线程按批次落库 + 报警判断
+    ingest_pipeline.put((device_id, ts, voltage, current, power, energy))
+    consumer_stats.processed += 1
+    consumer_stats.observe_lag(raw_ts)
+
+    # 2. WebSocket 广播 (构建前端需要的数据格式)
+    if broadcast_callback:
+        ws_msg = {
+            "type": "telemetry_update",
+            "data": {
+                "device_id": device_id,
+                "voltage": voltage,
+                "current": current,
+                "power": power,
+                "energy": energy,
+                "timestamp": ts.strftime("%Y-%m-%d %H:%M:%S")
+            }
+        }
+        # 因为 MQTT 回调是同步的，而 broadcast 是异步的，需要这就用 run_coroutine_threadsafe
+        # 或者简单的方案：我们在 main.py 里定义 callback 时处理 event loop
+        broadcast_callback(ws_msg)
+
+
+def process_data(payload_str, broadcast_callback=None, topic=MQTT_TOPIC):
+    """
+    处理消息：
+    - 传统模式: 直接处理
+    - 消费组模式: 分区主题 / 转发主题上的消息都归本进程，直接处理；
+      从共享订阅的 mine/telemetry 收到、但设备不归本进程的消息，转发到归属进程的专用主题。
+      转发的代价：N 个消费者时约 (N-1)/N 的消息要再经过 broker 一次 (见 forward_ratio)，
+      同一设备直连与转发的读数可能先后颠倒，入库批次会按 (device_id, timestamp) 重新排序，
+      但跨批次的顺序无法保证 —— 设备改发分区主题 (MQTT_TELEMETRY_PARTITIONS) 后没有这些问题
+    """
     try:
         data = json.loads(payload_str)
-        device_id = data['device_id']
-        ts = datetime.fromtimestamp(data.get('timestamp', datetime.now().timestamp()))
-        
-        # 1. 存库 (复用之前的逻辑)
-        with Session(engine) as session:
-            # 调用公共服务处理数据和报警
-            record = process_device_data(
-                session=session,
-                device_id=device_id,
-                voltage=data['voltage'],
-                current=data['current'],
-                power=data['power'],
-                energy=data['energy'],
-                timestamp=ts
-            )
-            
-        # 2. WebSocket 广播 (构建前端需要的数据格式)
-        if broadcast_callback:
-            ws_msg = {
-                "type": "telemetry_update",
-                "data": {
-                    "device_id": device_id,
-                    "voltage": record.voltage,
-                    "current": record.current,
-                    "power": record.power,
-                    "energy": record.energy,
-                    "timestamp": record.timestamp.strftime("%Y-%m-%d %H:%M:%S")
-                }
-            }
-            # 因为 MQTT 回调是同步的，而 broadcast 是异步的，需要这就用 run_coroutine_threadsafe
-            # 或者简单的方案：我们在 main.py 里定义 callback 时处理 event loop
-            broadcast_callback(ws_msg)
+        consumer_stats.received += 1
+
+        if MQTT_CONSUMER_GROUP and MQTT_CONSUMER_COUNT > 1 and topic == MQTT_TOPIC:
+            owner = owner_of(int(data['device_id']))
+            if owner != MQTT_CONSUMER_INDEX:
+                client.publish(route_topic(owner), payload_str, qos=1)
+                consumer_stats.forwarded += 1
+                return
+
+        process_record(data, broadcast_callback)
 
     except json.JSONDecodeError:
         print("❌ JSON 解析失败")
     except Exception as e:
         print(f"❌ 数据处理错误: {e}")
 
+
+# --- 消费者状态上报 (Redis)，供 /system/ingest 汇总所有进程的消费延迟 ---
+_stats_stop = threading.Event()
+
+
+def _report_stats_loop():
+    field = f"{MQTT_CONSUMER_GROUP or 'default'}:{MQTT_CONSUMER_INDEX}:{os.getpid()}"
+    while not _stats_stop.wait(CONSUMER_STATS_INTERVAL):
+        try:
+            RedisClient.get_sync_client().hset(CONSUMER_STATS_KEY, field, json.dumps(consumer_stats.snapshot(reset_max=True)))
+        except Exception as e:
+            logger.debug(f"[MQTT] 消费者状态上报失败: {e}")
+
+
+def _start_stats_reporter():
+    _stats_stop.clear()
+    threading.Thread(target=_report_stats_loop, name="mqtt-consumer-stats", daemon=True).start()
+
+
+def _on_connect_factory():
+    def on_connect_internal(client, userdata, flags, rc, properties=None):
+        print(f"✅ [系统内部] MQTT 已连接 (代码: {rc})")
+        for topic in consumer_topics():
+            client.subscribe(topic, qos=1)
+        if MQTT_CONSUMER_GROUP:
+            logger.info(
+                f"📡 [MQTT] 已加入消费组 {MQTT_CONSUMER_GROUP} "
+                f"(消费者 {MQTT_CONSUMER_INDEX}/{MQTT_CONSUMER_COUNT}, 源端分区 {owned_partitions()})"
+            )
+    return on_connect_internal
+
+
 # --- 新增：专门给 FastAPI 调用的非阻塞启动函数 ---
 def start_mqtt_background(on_message_callback):
-    
-    def on_connect_internal(client, userdata, flags, rc):
-        print(f"✅ [系统内部] MQTT 已连接 (代码: {rc})")
-        client.subscribe(MQTT_TOPIC)
 
     def on_message_internal(client, userdata, msg):
         payload = msg.payload.decode()
         # 将接收到的消息传给处理函数，并带上回调
-        process_data(payload, broadcast_callback=on_message_callback)
+        process_data(payload, broadcast_callback=on_message_callback, topic=msg.topic)
 
-    client.on_connect = on_connect_internal
+    client.on_connect = _on_connect_factory()
     client.on_message = on_message_internal
-    
+
+    # 先启动入库管道，再开始收消息
+    ingest_pipeline.start()
+    _start_stats_reporter()
+
     try:
-        client.connect(MQTT_BROKER, 1883, 60)
+        _connect(client)
         # loop_start 会启动一个后台线程自动处理网络循环，不会阻塞主程序
         client.loop_start()
     except Exception as e:
         print(f"❌ MQTT 连接失败: {e}")
 
+def stop_mqtt_background():
+    """停止 MQTT 监听，并把入库管道里剩余的数据全部落库 (在 lifespan 关闭阶段调用)"""
+    _stats_stop.set()
+    try:
+        client.loop_stop()
+        client.disconnect()
+    except Exception as e:
+        print(f"⚠️ MQTT 断开失败: {e}")
+    ingest_pipeline.stop()
+    anomaly_detector.checkpoint()  # 保存异常检测状态，重启后无需重新预热
+
+
+def run_consumer():
+    """
+    无界面消费者进程入口 (scripts/run_consumers.py 使用)：
+    只负责订阅 + 入库 + 报警 (开启 WS_BACKPLANE 时顺带发布实时消息)，阻塞运行直到进程退出
+    """
+    from app.core.ws_backplane import WS_BACKPLANE, ws_backplane
+
+    # 开启 WS_BACKPLANE 时，消费者把实时消息发布到 Redis，由各 API 进程推给 WebSocket 客户端
+    broadcast = ws_backplane.publish if WS_BACKPLANE else None
+    client.on_connect = _on_connect_factory()
+    client.on_message = lambda c, u, m: process_data(m.payload.decode(), broadcast, topic=m.topic)
+    device_registry.start()
+    ingest_pipeline.start()
+    _start_stats_reporter()
+    if WS_BACKPLANE:
+        ws_backplane.start_publisher()
+    _connect(client)
+    try:
+        client.loop_forever()
+    finally:
+        _stats_stop.set()
+        ingest_pipeline.stop()
+        late_data_refresher.stop()
+        anomaly_detector.checkpoint()
+        device_registry.stop()
+        if WS_BACKPLANE:
+            ws_backplane.stop_publisher()
+
+
 # (保留原来的 main 块，以便你可以单独测试这个文件)
 if __name__ == "__main__":
     def dummy_cb(msg):
         print(f"模拟广播: {msg}")
-        
+
     print("单独运行模式...")
-    client.on_connect = lambda c, u, f, r: c.subscribe(MQTT_TOPIC)
-    client.on_message = lambda c, u, m: process_data(m.payload.decode(), dummy_cb)
-    client.connect(MQTT_BROKER, 1883, 60)
-    client.loop_forever()
\ No newline at end of file
+    client.on_connect = _on_connect_factory()
+    client.on_message = lambda c, u, m: process_data(m.payload.decode(), dummy_cb, topic=m.topic)
+    ingest_pipeline.start()
+    client.connect(MQTT_BROKER, MQTT_PORT, 60)
+    try:
+        client.loop_forever()
+    finally:
+        ingest_pipeline.stop()
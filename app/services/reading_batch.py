@@ -0,0 +1,58 @@
+from datetime import datetime
+from typing import List, Sequence, Tuple
+import numpy as np
+
+# 一条遥测读数: (device_id, timestamp, voltage, current, power, energy)
+Reading = Tuple[int, datetime, float, float, float, float]
+
+
+class ReadingBatch:
+    """
+    列式遥测批次：把一批 Reading 拆成 NumPy 数组，供规则引擎 / 异常检测做向量化计算
+    - 行按 (device_id, timestamp) 排序，同一设备的读数连续且按时间先后排列
+    - rows 保存排序后的原始元组，方便写库和拼装报警
+    """
+
+    __slots__ = ("rows", "device_id", "ts", "voltage", "current", "power", "energy")
+
+    def __init__(self, rows: List[Reading], device_id, ts, voltage, current, power, energy):
+        self.rows = rows
+        self.device_id = device_id
+        self.ts = ts
+        self.voltage = voltage
+        self.current = current
+        self.power = power
+        self.energy = energy
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Reading]) -> "ReadingBatch":
+        n = len(rows)
+        device_id = np.fromiter((r[0] for r in rows), dtype=np.int64, count=n)
+        ts = np.fromiter((r[1].timestamp() for r in rows), dtype=np.float64, count=n)
+        # 先按时间、再按设备稳定排序 => 按 (device_id, timestamp) 排序
+        order = np.lexsort((ts, device_id))
+        rows = [rows[i] for i in order]
+        return cls(
+            rows=rows,
+            device_id=device_id[order],
+            ts=ts[order],
+            voltage=np.fromiter((r[2] for r in rows), dtype=np.float64, count=n),
+            current=np.fromiter((r[3] for r in rows), dtype=np.float64, count=n),
+            power=np.fromiter((r[4] for r in rows), dtype=np.float64, count=n),
+            energy=np.fromiter((r[5] for r in rows), dtype=np.float64, count=n),
+        )
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def segment_starts(self) -> np.ndarray:
+        """每一行是否为该设备在本批次中的第一行"""
+        starts = np.ones(len(self.device_id), dtype=bool)
+        starts[1:] = self.device_id[1:] != self.device_id[:-1]
+        return starts
+
+    def segment_ends(self) -> np.ndarray:
+        """每一行是否为该设备在本批次中的最后一行"""
+        ends = np.ones(len(self.device_id), dtype=bool)
+        ends[:-1] = self.device_id[1:] != self.device_id[:-1]
+        return ends
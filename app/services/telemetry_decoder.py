@@ -0,0 +1,133 @@
+import json
+import math
+import os
+from datetime import datetime
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+from app.services.reading_batch import Reading
+
+# 数组形式的读数: [device_id, timestamp, voltage, current, power, energy]
+FIELDS = ("device_id", "timestamp", "voltage", "current", "power", "energy")
+
+# 单次批量上传最多接受的条数 / 请求体字节数 (超过返回 413)，以及最多返回的错误条数
+MAX_BATCH_ITEMS = int(os.getenv("TELEMETRY_BATCH_MAX_ITEMS", "50000"))
+MAX_BATCH_BYTES = int(os.getenv("TELEMETRY_BATCH_MAX_BYTES", str(16 * 1024 * 1024)))
+MAX_REPORTED_ERRORS = 1000
+
+
+class PayloadTooLarge(ValueError):
+    pass
+
+
+def _parse_timestamp(value: Any) -> datetime:
+    if value is None:
+        return datetime.now()
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        # 兼容毫秒时间戳
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    raise ValueError("timestamp 格式错误")
+
+
+def _as_float(value: Any, name: str) -> float:
+    if isinstance(value, bool) or value is None:
+        raise ValueError(f"{name} 缺失或类型错误")
+    number = float(value)
+    if not math.isfinite(number):
+        raise ValueError(f"{name} 不是有限数值")
+    return number
+
+
+def decode_items(items: Iterable[Any], known: Optional[Callable[[int], bool]] = None) -> Tuple[List[Reading], List[list]]:
+    """
+    校验并转换一批原始读数 (不实例化 Pydantic 模型)：
+    - 支持对象形式 {"device_id":..,"voltage":..} 和数组形式 [device_id, ts, v, i, p, e]
+    - known: 设备是否已注册 (设备注册表)，未注册的设备在这里拒绝，不再等数据库外键报错
+    - 返回 (合法读数列表, 拒绝列表 [[下标, 原因], ...])
+    """
+    rows: List[Reading] = []
+    rejects: List[list] = []
+    for index, item in enumerate(items):
+        if index >= MAX_BATCH_ITEMS:
+            raise PayloadTooLarge(f"单次最多上传 {MAX_BATCH_ITEMS} 条")
+        try:
+            if isinstance(item, dict):
+                device_id, ts, v, c, p, e = (item.get(name) for name in FIELDS)
+            elif isinstance(item, (list, tuple)) and len(item) == len(FIELDS):
+                device_id, ts, v, c, p, e = item
+            else:
+                raise ValueError("格式错误")
+            if not isinstance(device_id, int) or isinstance(device_id, bool):
+                raise ValueError("device_id 必须为整数")
+            if known is not None and not known(device_id):
+                raise ValueError(f"未注册的设备 ID: {device_id}")
+            rows.append((
+                device_id,
+                _parse_timestamp(ts),
+                _as_float(v, "voltage"),
+                _as_float(c, "current"),
+                _as_float(p, "power"),
+                _as_float(e, "energy"),
+            ))
+        except (ValueError, TypeError, OverflowError, OSError) as exc:
+            if len(rejects) < MAX_REPORTED_ERRORS:
+                rejects.append([index, str(exc)])
+    return rows, rejects
+
+
+def iter_json_array(body: bytes) -> List[Any]:
+    """JSON 数组 (也兼容 {"readings": [...]} 包装)"""
+    data = json.loads(body)
+    if isinstance(data, dict):
+        data = data.get("readings")
+    if not isinstance(data, list):
+        raise ValueError("请求体必须是 JSON 数组")
+    return data
+
+
+def iter_msgpack(body: bytes) -> List[Any]:
+    """msgpack 数组 (msgpack 为可选依赖)"""
+    try:
+        import msgpack
+    except ImportError:
+        raise RuntimeError("服务器未安装 msgpack，无法解析 application/msgpack")
+    data = msgpack.unpackb(body, raw=False)
+    if isinstance(data, dict):
+        data = data.get("readings")
+    if not isinstance(data, list):
+        raise ValueError("请求体必须是 msgpack 数组")
+    return data
+
+
+class NdjsonDecoder:
+    """
+    流式 NDJSON 解析：按到达的分块逐行解析，无需先把整个请求体读入内存
+    无法解析的行记为 None，由 decode_items 统一计入拒绝列表
+    """
+
+    def __init__(self):
+        self._tail = b""
+        self.items: List[Any] = []
+
+    def _parse_line(self, line: bytes):
+        line = line.strip()
+        if not line:
+            return
+        try:
+            self.items.append(json.loads(line))
+        except ValueError:
+            self.items.append(None)
+        if len(self.items) > MAX_BATCH_ITEMS:
+            raise PayloadTooLarge(f"单次最多上传 {MAX_BATCH_ITEMS} 条")
+
+    def feed(self, chunk: bytes):
+        data = self._tail + chunk
+        lines = data.split(b"\n")
+        self._tail = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+
+    def close(self) -> List[Any]:
+        self._parse_line(self._tail)
+        self._tail = b""
+        return self.items
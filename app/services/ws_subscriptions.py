@@ -0,0 +1,130 @@
+"""
+WebSocket 订阅协议 (客户端 -> 服务器，JSON 文本帧)
+
+    {"action": "subscribe", "device_ids": [1, 2], "device_types": ["电表"], "locations": ["主井"], "max_rate": 2}
+    {"action": "subscribe", "all": true}              # 恢复订阅全部设备 (默认状态)
+    {"action": "unsubscribe", "device_ids": [2]}      # 不带任何筛选条件时表示全部取消
+    {"action": "set_rate", "max_rate": 1}             # 每个设备每秒最多推送 1 次，0 表示实时
+    {"action": "ping"}
+
+服务器回复:
+    {"type": "subscription", "data": {"device_ids": [...] | null, "max_rate": 2}}
+    {"type": "error", "data": {"message": "..."}}
+    {"type": "pong", "data": {"ts": ...}}
+
+device_type / location 在订阅时按进程内设备注册表解析为具体设备号 (不查数据库；之后新增的设备需要重新订阅，
+前端断线重连时会重发最近一次订阅)
+"""
+import json
+import time
+from typing import List, Optional
+from fastapi import WebSocket
+from app.core.logger import logger
+from app.core.socket_manager import manager
+from app.services.device_registry import device_registry
+
+
+class SubscriptionError(ValueError):
+    pass
+
+
+def _int_list(value, field: str) -> List[int]:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise SubscriptionError(f"{field} 必须是数组")
+    try:
+        return [int(v) for v in value]
+    except (TypeError, ValueError):
+        raise SubscriptionError(f"{field} 只能包含整数")
+
+
+def _str_list(value, field: str) -> List[str]:
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise SubscriptionError(f"{field} 必须是数组")
+    return [str(v) for v in value]
+
+
+def _parse_rate(value) -> float:
+    try:
+        rate = float(value)
+    except (TypeError, ValueError):
+        raise SubscriptionError("max_rate 必须是数字")
+    if rate < 0:
+        raise SubscriptionError("max_rate 不能为负数")
+    return rate
+
+
+def resolve_device_ids(
+    device_ids: List[int], device_types: List[str], locations: List[str], all_devices: bool = False
+) -> Optional[List[int]]:
+    """把设备号 / 设备类型 / 安装位置 合并解析为设备号列表 (读设备注册表快照)；全部为空时返回 None"""
+    if not all_devices and not device_types and not locations:
+        return device_ids if device_ids else None
+
+    snapshot = device_registry.snapshot
+    if snapshot is None:
+        raise SubscriptionError("设备列表尚未加载，请稍后重试")
+    types, places = set(device_types), set(locations)
+    matched = {
+        d.id for d in snapshot.by_id.values()
+        if all_devices or d.device_type in types or d.location in places
+    }
+    return sorted(set(device_ids) | matched)
+
+
+async def handle_client_message(websocket: WebSocket, text: str):
+    """处理客户端发来的一条消息，回复通过 manager.send_personal 走该连接的发送队列"""
+    try:
+        try:
+            message = json.loads(text)
+        except json.JSONDecodeError:
+            raise SubscriptionError("消息不是合法的 JSON")
+        if not isinstance(message, dict):
+            raise SubscriptionError("消息必须是 JSON 对象")
+
+        action = message.get("action")
+        if action == "ping":
+            manager.send_personal(websocket, {"type": "pong", "data": {"ts": time.time()}})
+            return
+
+        if action not in ("subscribe", "unsubscribe", "set_rate"):
+            raise SubscriptionError(f"未知的 action: {action}")
+
+        state = None
+        if action in ("subscribe", "unsubscribe"):
+            device_ids = _int_list(message.get("device_ids"), "device_ids")
+            device_types = _str_list(message.get("device_types"), "device_types")
+            locations = _str_list(message.get("locations"), "locations")
+
+            if action == "subscribe":
+                if message.get("all"):
+                    state = manager.subscribe(websocket, None)
+                else:
+                    ids = resolve_device_ids(device_ids, device_types, locations)
+                    if ids is None:
+                        raise SubscriptionError("subscribe 需要 device_ids / device_types / locations 或 all")
+                    state = manager.subscribe(websocket, ids)
+            else:
+                ids = resolve_device_ids(device_ids, device_types, locations)
+                client = manager.active_connections.get(websocket)
+                if ids is not None and client is not None and client.device_ids is None:
+                    # 当前订阅的是全部设备：先展开为具体设备集合再做差集
+                    manager.subscribe(websocket, resolve_device_ids([], [], [], all_devices=True))
+                state = manager.unsubscribe(websocket, ids)
+
+        if "max_rate" in message:
+            state = manager.set_rate(websocket, _parse_rate(message["max_rate"]))
+        elif action == "set_rate":
+            raise SubscriptionError("set_rate 需要 max_rate")
+
+        if state is not None:
+            manager.send_personal(websocket, {"type": "subscription", "data": state})
+
+    except SubscriptionError as e:
+        manager.send_personal(websocket, {"type": "error", "data": {"message": str(e)}})
+    except Exception as e:
+        logger.error(f"❌ [WebSocket] 处理订阅消息失败: {e}")
+        manager.send_personal(websocket, {"type": "error", "data": {"message": "订阅处理失败，请稍后重试"}})
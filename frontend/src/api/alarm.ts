@@ -6,6 +6,10 @@ export interface Alarm {
   message: string
   timestamp: string
   is_resolved: boolean
+  rule_code?: string        // 触发的规则
+  occurrence_count?: number // 本次报警事件内累计违规次数
+  first_seen?: string
+  last_seen?: string
 }
 
 // 获取未处理报警
@@ -35,4 +35,36 @@ export function deleteDevice(id: number) {
 // 5. 启停控制 (反向控制)
 export function toggleDeviceStatus(id: number, active: boolean) {
   return request.post<any, Device>(`/devices/${id}/toggle?active=${active}`)
-}
\ No newline at end of file
+}
+// 6. 批量启停 (按设备 ID / 类型 / 位置)，返回每台设备的指令确认耗时
+export interface BulkControlRequest {
+  action: 'start' | 'stop'
+  device_ids?: number[]
+  device_type?: string
+  location?: string
+  update_status?: boolean
+  timeout?: number
+}
+
+export interface BulkControlResult {
+  device_id: number
+  action: string
+  ok: boolean
+  latency_ms: number | null
+  error: string | null
+}
+
+export interface BulkControlSummary {
+  action: string
+  requested: number
+  acked: number
+  failed: number
+  missing: number[]
+  elapsed_ms: number
+  latency_ms: { min: number | null; p50: number | null; p95: number | null; max: number | null }
+  results: BulkControlResult[]
+}
+
+export function bulkControlDevices(data: BulkControlRequest) {
+  return request.post<any, BulkControlSummary>('/devices/control/bulk', data)
+}
@@ -5,9 +5,11 @@ export interface FDDReport {
   device_name: string
   alarm_count: number
   health_score: number
+  last_alarm_at?: string | null
+  occurrences?: number // 仅按时间窗口统计时返回
 }
 
-// 获取 FDD 诊断排行
-export function getFDDStats() {
-  return request.get<any, FDDReport[]>('/fdd/stats')
-}
\ No newline at end of file
+// 获取 FDD 诊断排行 (hours: 只统计最近 N 小时的报警；不传则读取增量维护的健康度)
+export function getFDDStats(hours?: number) {
+  return request.get<any, FDDReport[]>('/fdd/stats', { params: hours ? { hours } : undefined })
+}
@@ -14,4 +14,58 @@ export function downloadReport() {
   return request.get('/reports/export_csv', {
     responseType: 'blob' // 关键：指定响应类型为二进制流
   })
-}
\ No newline at end of file
+}
+
+// 通用导出 (遥测 / 报警，CSV / Parquet / Arrow)
+export interface ExportParams {
+  dataset?: 'telemetry' | 'alarms'
+  format?: 'csv' | 'parquet' | 'arrow'
+  device_ids?: number[]
+  start?: string
+  end?: string
+  columns?: string
+  gzip?: boolean
+}
+
+export function downloadExport(params: ExportParams) {
+  return request.get('/reports/export', {
+    params,
+    paramsSerializer: { indexes: null }, // device_ids=1&device_ids=2
+    responseType: 'blob'
+  })
+}
+
+// 后台导出任务：提交 -> 轮询进度 -> 下载
+export interface ExportJob {
+  id: string
+  status: 'queued' | 'running' | 'done' | 'failed' | 'cancelled'
+  filename: string
+  rows: number
+  bytes: number
+  estimated_rows: number | null
+  progress: number | null
+  eta_seconds: number | null
+  expires_at: number | null
+  error: string | null
+  deduplicated?: boolean
+}
+
+export function createExportJob(params: ExportParams) {
+  return request.post<any, ExportJob>('/reports/jobs', params)
+}
+
+export function listExportJobs() {
+  return request.get<any, ExportJob[]>('/reports/jobs')
+}
+
+export function getExportJob(id: string) {
+  return request.get<any, ExportJob>(`/reports/jobs/${id}`)
+}
+
+export function cancelExportJob(id: string) {
+  return request.delete<any, ExportJob>(`/reports/jobs/${id}`)
+}
+
+export function downloadExportJob(id: string) {
+  return request.get(`/reports/jobs/${id}/download`, { responseType: 'blob' })
+}
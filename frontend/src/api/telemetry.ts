@@ -26,6 +26,27 @@ export function getHistory(deviceId: number, limit: number = 50) {
   return request.get<any, DeviceData[]>(`/telemetry/${deviceId}?limit=${limit}`)
 }
 
+// 降采样后的历史曲线 (列式数组，timestamps 为毫秒时间戳)
+export interface HistorySeries {
+  device_id: number
+  mode: 'raw' | 'lttb' | 'bucket'
+  source: string
+  bucket_seconds: number | null
+  count: number
+  timestamps: number[]
+  voltage: number[]
+  current: number[]
+  power: number[]
+  energy: number[]
+}
+
+// 按时间范围获取历史趋势，服务端降采样到最多 maxPoints 个点
+export function getHistoryRange(deviceId: number, start: string, end: string, maxPoints: number = 1000) {
+  return request.get<any, HistorySeries>(`/telemetry/${deviceId}`, {
+    params: { start, end, max_points: maxPoints }
+  })
+}
+
 // 获取单个设备的实时分析数据 (用于仪表盘卡片)
 export function getAnalysis(deviceId: number) {
   return request.get<any, DeviceAnalysis>(`/analysis/${deviceId}`)
@@ -7,6 +7,8 @@ export const useSocketStore = defineStore('socket', () => {
   const latestMessage = ref<any>(null) // 存放最新收到的遥测数据
   let ws: WebSocket | null = null
   let retryCount = 0
+  // 最近一次订阅：重连后服务器端是新连接 (默认推送全部设备)，需要重新发送
+  let lastSubscription: Record<string, any> | null = null
 
   function connect() {
     if (ws) return // 避免重复连接
@@ -25,6 +27,7 @@ export const useSocketStore = defineStore('socket', () => {
       console.log('✅ [WebSocket] 连接成功')
       isConnected.value = true
       retryCount = 0
+      if (lastSubscription) send(lastSubscription)
     }
 
     ws.onmessage = (event) => {
@@ -53,12 +56,32 @@ export const useSocketStore = defineStore('socket', () => {
     }
   }
 
+  // 订阅指定设备 / 类型 / 位置，并可限制推送频率 (每个设备每秒最多 maxRate 次，0 表示实时)
+  // 不调用时默认接收全部设备的实时数据；连接尚未建立时在连接成功后发送
+  function subscribe(options: { deviceIds?: number[]; deviceTypes?: string[]; locations?: string[]; maxRate?: number }) {
+    lastSubscription = {
+      action: 'subscribe',
+      device_ids: options.deviceIds,
+      device_types: options.deviceTypes,
+      locations: options.locations,
+      max_rate: options.maxRate
+    }
+    send(lastSubscription)
+  }
+
+  function send(payload: Record<string, any>) {
+    if (ws && ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify(payload))
+    }
+  }
+
   function disconnect() {
+    lastSubscription = null
     if (ws) {
       ws.close()
       ws = null
     }
   }
 
-  return { isConnected, latestMessage, connect, disconnect }
+  return { isConnected, latestMessage, connect, disconnect, subscribe, send }
 })
\ No newline at end of file
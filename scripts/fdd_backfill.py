@@ -0,0 +1,61 @@
+"""
+FDD 离线回溯：用当前的阈值配置 / 异常检测参数重新诊断历史遥测数据
+
+用法:
+    python -m scripts.fdd_backfill --start 2026-01-01 --end 2026-04-01
+    python -m scripts.fdd_backfill --start 2026-01-01 --end 2026-04-01 --devices 3,5 --workers 4
+    python -m scripts.fdd_backfill --resume <run_id>          # 继续被中断 / 取消的任务
+
+- 按 hypertable chunk 逐段读取每台设备的读数 (时间有序)，检测逻辑与入库时的在线检测完全一致
+- 设备分发到进程池并行处理，每个分片的检测结果与进度在同一事务内提交，中断后可继续
+- 结果写入 fddfinding 表，也可通过 GET /fdd/findings?run_id=... 查看
+"""
+import argparse
+from datetime import datetime
+
+
+def _print_progress(progress: dict):
+    print(
+        f"⏳ {progress['devices_done']}/{progress['devices_total']} 台设备, "
+        f"{progress['rows']} 行, {progress['findings']} 条结果, 进度 {progress['progress'] * 100:.1f}%"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FDD 离线回溯")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="开始时间 (ISO 格式)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="结束时间 (ISO 格式，不含)")
+    parser.add_argument("--devices", default="", help="逗号分隔的设备 ID，不填表示全部设备")
+    parser.add_argument("--workers", type=int, default=None, help="进程数 (默认 CPU 核数 - 1)")
+    parser.add_argument("--resume", metavar="RUN_ID", help="继续执行已有的任务")
+    parser.add_argument("--force", action="store_true", help="接管状态仍为 running 的任务")
+    args = parser.parse_args()
+
+    from app.core.database import init_db
+    from app.services.fdd_backfill import create_run, execute_run
+
+    init_db()
+    if args.resume:
+        run_id = args.resume
+    else:
+        if not args.start or not args.end:
+            parser.error("需要 --start 和 --end (或使用 --resume)")
+        device_ids = [int(d) for d in args.devices.split(",") if d.strip()] or None
+        run_id = create_run(args.start, args.end, device_ids).id
+    print(f"🔎 回溯任务 {run_id}")
+
+    try:
+        result = execute_run(run_id, workers=args.workers, force=args.force, on_progress=_print_progress)
+    except KeyboardInterrupt:
+        from app.services.fdd_backfill import cancel_run
+        cancel_run(run_id)
+        print(f"\n👋 已取消，可使用 --resume {run_id} 继续")
+        return
+    if result is None:
+        print("⚠️ 任务不存在、已完成或正在其他进程中执行 (确认原进程已退出后可加 --force 接管)")
+        return
+    print(f"✅ {result['status']}: {result['rows']} 行, {result['findings']} 条结果")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+启动 N 个无界面的 MQTT 入库消费者进程 (MQTT v5 共享订阅)
+
+用法:
+    python -m scripts.run_consumers --count 4 --group ingest
+
+- 设备按 device_id 归属到固定的消费者，保证同一设备的报警状态始终由同一个进程维护
+- 推荐设备直接发到分区主题 mine/telemetry/<device_id % P> (MQTT_TELEMETRY_PARTITIONS=P，取 count 的整数倍)，
+  每个进程只订阅自己负责的分区，消息不需要转发
+- 仍发到 mine/telemetry 的设备由 $share/<group>/mine/telemetry 共享订阅接收，不归本进程的消息
+  转发给归属进程：约 (count-1)/count 的消息多经过 broker 一次，转发比例见 /system/ingest 的 forward_ratio
+- 各进程使用持久会话 (client_id 按分区号固定)，进程重启期间 broker 为它保留分区 / 转发主题上的消息
+- 各进程的消费延迟定期写入 Redis (ems:ingest:consumers)，可通过 GET /system/ingest 查看
+"""
+import argparse
+import multiprocessing
+import os
+
+
+def _consumer_main(index: int, count: int, group: str):
+    # 必须在导入 app 模块之前设置好环境变量 (配置在模块导入时读取)
+    os.environ["MQTT_CONSUMER_GROUP"] = group
+    os.environ["MQTT_CONSUMER_COUNT"] = str(count)
+    os.environ["MQTT_CONSUMER_INDEX"] = str(index)
+
+    from app.services.mqtt_worker import run_consumer
+    print(f"🚀 消费者 {index}/{count} 已启动 (pid={os.getpid()}, group={group})")
+    run_consumer()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动 MQTT 入库消费组")
+    parser.add_argument("--count", type=int, default=os.cpu_count() or 1, help="消费者进程数")
+    parser.add_argument("--group", default=os.getenv("MQTT_CONSUMER_GROUP") or "ingest", help="共享订阅组名")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_consumer_main, args=(i, args.count, args.group), name=f"ingest-{i}")
+        for i in range(args.count)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        # Ctrl+C 同时发给了子进程，子进程会自行排空入库管道后退出；超时仍未退出的再强制结束
+        print("\n👋 正在等待所有消费者排空数据...")
+        for p in processes:
+            p.join(30)
+            if p.is_alive():
+                p.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+TimescaleDB 存储管理：查看 chunk 大小 / 压缩率，应用生命周期策略，手动压缩
+
+用法:
+    python -m scripts.timescale_admin stats                     # 超表 / 连续聚合体积、压缩率、各 chunk 明细
+    python -m scripts.timescale_admin apply                     # 按环境变量重新应用策略 (幂等)
+    python -m scripts.timescale_admin apply --compress-after "3 days" --retention "90 days"
+    python -m scripts.timescale_admin compress --older-than "7 days"
+
+- 策略默认值来自 TS_CHUNK_INTERVAL / TS_COMPRESS_AFTER / TS_RAW_RETENTION，服务每次启动时也会自动应用
+- 传入空字符串 (例如 --retention "") 表示移除对应策略
+"""
+import argparse
+
+
+def _size(n) -> str:
+    if n is None:
+        return "-"
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if abs(n) < 1024 or unit == "TB":
+            return f"{n:.1f}{unit}" if unit != "B" else f"{n}{unit}"
+        n /= 1024
+
+
+def _print_stats(stats: dict):
+    size, compression = stats["size"], stats["compression"]
+    print(f"📦 {stats['table']}: 总计 {_size(size.get('total_bytes'))} "
+          f"(表 {_size(size.get('table_bytes'))}, 索引 {_size(size.get('index_bytes'))}, TOAST {_size(size.get('toast_bytes'))})")
+    print(f"🗜️ 压缩: {compression.get('number_compressed_chunks') or 0}/{compression.get('total_chunks') or 0} 个 chunk, "
+          f"{_size(compression.get('before_compression_total_bytes'))} -> {_size(compression.get('after_compression_total_bytes'))}, "
+          f"压缩比 {compression.get('ratio') or '-'}")
+    print(f"⚙️ 策略: {stats['policy']}")
+    print()
+    print(f"{'chunk':<28}{'起始':<22}{'结束':<22}{'压缩':<6}{'大小':>10}{'压缩前':>10}{'压缩比':>8}")
+    for c in stats["chunks"]:
+        print(f"{c['chunk_name']:<28}{str(c['range_start'])[:19]:<22}{str(c['range_end'])[:19]:<22}"
+              f"{'是' if c['is_compressed'] else '否':<6}{_size(c['total_bytes']):>10}"
+              f"{_size(c['before_compression_total_bytes']):>10}{c['ratio'] or '-':>8}")
+    print()
+    for a in stats["aggregates"]:
+        print(f"📈 {a['view_name']}: {_size(a['total_bytes'])}")
+    for j in stats["jobs"]:
+        print(f"⏱️ job {j['job_id']} {j['proc_name']} ({j['hypertable_name']}) 每 {j['schedule_interval']}, "
+              f"上次 {j['last_run_status'] or '-'}, 下次 {j['next_start']}, 失败 {j['total_failures'] or 0} 次")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TimescaleDB 存储管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    stats = sub.add_parser("stats", help="查看存储概况")
+    stats.add_argument("--limit", type=int, default=100, help="最多列出多少个 chunk (按时间倒序)")
+    apply = sub.add_parser("apply", help="应用生命周期策略")
+    apply.add_argument("--chunk-interval", default=None, help="新 chunk 的时间跨度，如 '1 day'")
+    apply.add_argument("--compress-after", default=None, help="压缩早于该时长的 chunk，如 '7 days'")
+    apply.add_argument("--retention", default=None, help="删除早于该时长的原始 chunk，如 '180 days'")
+    compress = sub.add_parser("compress", help="立即压缩历史 chunk")
+    compress.add_argument("--older-than", default="7 days", help="压缩早于该时长的 chunk")
+    args = parser.parse_args()
+
+    from app.core import timescale
+    from app.core.database import engine
+
+    if args.command == "stats":
+        _print_stats(timescale.storage_stats(engine, limit=args.limit))
+    elif args.command == "apply":
+        result = timescale.apply_lifecycle_policies(
+            engine,
+            chunk_interval=timescale.TS_CHUNK_INTERVAL if args.chunk_interval is None else args.chunk_interval,
+            compress_after=timescale.TS_COMPRESS_AFTER if args.compress_after is None else args.compress_after,
+            retention=timescale.TS_RAW_RETENTION if args.retention is None else args.retention,
+        )
+        for change in result["changed"]:
+            print(f"✅ {change}")
+        for item in result["skipped"]:
+            print(f"➖ 无变化: {item}")
+        for error in result["errors"]:
+            print(f"❌ {error}")
+    elif args.command == "compress":
+        result = timescale.compress_chunks(engine, args.older_than)
+        print(f"✅ 已压缩 {result['chunks']} 个 chunk，耗时 {result['elapsed']}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+测试公共夹具
+- 需要数据库的用例通过 run_db 执行：使用 ASYNC_DATABASE_URL (asyncpg) 连接 TimescaleDB，
+  所有写入都在一个事务里完成并在结束时回滚；数据库不可用时自动跳过
+"""
+import asyncio
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.core.database import ASYNC_DATABASE_URL
+from app.models.tables import Device, DeviceData
+
+# 测试数据：一台设备，从 SERIES_START 开始 SERIES_SECONDS 秒的 1Hz 读数
+SERIES_START = datetime(2020, 1, 1, 0, 0, 0)
+SERIES_SECONDS = 600
+
+
+async def _run(body):
+    engine = create_async_engine(ASYNC_DATABASE_URL)
+    try:
+        try:
+            conn = await asyncio.wait_for(engine.connect(), timeout=5)
+        except Exception as e:
+            pytest.skip(f"数据库不可用: {e}")
+        try:
+            has_timescale = (await conn.execute(
+                text("SELECT 1 FROM pg_extension WHERE extname = 'timescaledb'")
+            )).first()
+            if not has_timescale:
+                pytest.skip("数据库未安装 TimescaleDB 扩展")
+            transaction = await conn.begin()
+            try:
+                await conn.run_sync(SQLModel.metadata.create_all)
+                session = AsyncSession(bind=conn, expire_on_commit=False)
+                device = Device(name="pytest", sn=f"pytest-{datetime.now().timestamp()}", device_type="test")
+                session.add(device)
+                await session.flush()
+                session.add_all([
+                    DeviceData(
+                        device_id=device.id,
+                        timestamp=SERIES_START + timedelta(seconds=i),
+                        voltage=380.0, current=10.0 + i % 60, power=5.0 + i % 60, energy=float(i),
+                    )
+                    for i in range(SERIES_SECONDS)
+                ])
+                await session.flush()
+                return await body(session, device.id)
+            finally:
+                await transaction.rollback()
+        finally:
+            await conn.close()
+    finally:
+        await engine.dispose()
+
+
+@pytest.fixture
+def run_db(monkeypatch):
+    """run_db(async def body(session, device_id)) -> body 的返回值；强制查询走原始超表 (事务内的数据不会进入连续聚合)"""
+    from app.services import aggregates
+    monkeypatch.setattr(aggregates, "_available", set())
+    return lambda body: asyncio.run(_run(body))
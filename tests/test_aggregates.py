@@ -0,0 +1,42 @@
+import asyncio
+from datetime import timedelta
+from app.services import aggregates
+from app.services.aggregates import query_series
+from tests.conftest import SERIES_SECONDS, SERIES_START
+
+
+class _CapturingSession:
+    """只记录 execute 的参数，不连接数据库"""
+
+    def __init__(self):
+        self.params = None
+
+    async def execute(self, statement, params=None):
+        self.params = params
+
+        class _Result:
+            def all(self):
+                return []
+        return _Result()
+
+
+def test_series_width_is_bound_as_timedelta(monkeypatch):
+    # asyncpg 对 interval 参数只接受 timedelta，传字符串会在执行时报 DataError
+    monkeypatch.setattr(aggregates, "_available", set())
+    session = _CapturingSession()
+    asyncio.run(query_series(session, 1, SERIES_START, SERIES_START + timedelta(hours=1), resolution=60))
+    assert session.params["width"] == timedelta(seconds=60)
+
+
+def test_query_series_through_asyncpg(run_db):
+    end = SERIES_START + timedelta(seconds=SERIES_SECONDS)
+
+    async def body(session, device_id):
+        return await query_series(session, device_id, SERIES_START, end, resolution=60)
+
+    series = run_db(body)
+    assert series["source"] == aggregates.RAW_SOURCE
+    assert series["bucket_seconds"] == 60
+    assert len(series["timestamps"]) == SERIES_SECONDS // 60
+    assert series["samples"] == [60] * (SERIES_SECONDS // 60)
+    assert series["energy_used"][0] == 59.0
@@ -0,0 +1,93 @@
+"""
+向量化规则引擎：阈值下标 / 默认值回退、跨批次状态的延续，以及只有 commit() 之后状态才推进
+"""
+from datetime import datetime, timedelta
+import numpy as np
+from app.core.config import DeviceLimits
+from app.services.alarm_rules import CompiledLimits, CurrentRateRule, RuleEngine, StuckValueRule
+from app.services.reading_batch import ReadingBatch
+
+START = datetime(2024, 1, 1)
+
+
+def _limits(**per_device_current_max) -> CompiledLimits:
+    default = DeviceLimits(device_id=None, current_max=45.0, voltage_min=190.0, voltage_max=250.0,
+                           current_rate_max=20.0, stuck_samples=4)
+    per_device = {
+        int(key[1:]): DeviceLimits(device_id=int(key[1:]), current_max=value, voltage_min=190.0, voltage_max=250.0,
+                                   current_rate_max=5.0, stuck_samples=0)
+        for key, value in per_device_current_max.items()
+    }
+    return CompiledLimits(default, per_device, version=1)
+
+
+def _engine(limits: CompiledLimits) -> RuleEngine:
+    engine = RuleEngine(rules=[CurrentRateRule(), StuckValueRule()])
+    engine.limits = lambda: limits  # 不读配置文件
+    return engine
+
+
+def _batch(first_second: int, currents, device_id: int = 1) -> ReadingBatch:
+    return ReadingBatch.from_rows([
+        (device_id, START + timedelta(seconds=first_second + i), 220.0, float(c), 10.0, 0.0)
+        for i, c in enumerate(currents)
+    ])
+
+
+def test_limits_lookup_falls_back_to_default_slot():
+    limits = _limits(d2=80.0, d5=120.0)
+    ids = np.array([0, 2, 5, 6, -1, 1000])
+    idx = limits.index(ids)
+    assert idx[-1] == idx[-2] == idx[-3] == limits.default_slot
+    assert limits.current_max[idx].tolist() == [45.0, 80.0, 120.0, 45.0, 45.0, 45.0]
+    assert limits.stuck_samples[idx].tolist() == [4, 0, 0, 4, 4, 4]
+
+
+def test_limits_without_per_device_entries_use_default():
+    limits = _limits()
+    assert limits.current_max[limits.index(np.array([0, 7]))].tolist() == [45.0, 45.0]
+
+
+def test_current_rate_uses_last_reading_of_previous_batch():
+    engine = _engine(_limits(d2=80.0))
+    engine.commit(engine.evaluate(_batch(0, [10.0])))
+    ctx = engine.evaluate(_batch(1, [40.0, 41.0]))
+    # 跨批次的 30A/s 突变 > 默认 20A/s；批内 1A/s 不报
+    assert ctx.masks["current_rate"].tolist() == [True, False]
+
+    # 设备 2 单独配置 5A/s，且与设备 1 的状态互不影响
+    engine.commit(engine.evaluate(_batch(0, [10.0], device_id=2)))
+    ctx = engine.evaluate(_batch(1, [16.0], device_id=2))
+    assert ctx.masks["current_rate"].tolist() == [True]
+
+
+def test_stuck_run_is_carried_across_batches():
+    engine = _engine(_limits())
+    for first in (0, 2):
+        ctx = engine.evaluate(_batch(first, [7.0, 7.0]))
+        engine.commit(ctx)
+    # 连续第 4 个相同读数才触发 (stuck_samples=4)
+    assert ctx.masks["stuck_value"].tolist() == [False, True]
+    assert engine.state.stuck_run[1] == 3
+
+    ctx = engine.evaluate(_batch(4, [8.0, 8.0]))
+    assert ctx.masks["stuck_value"].tolist() == [False, False]
+    assert ctx.stuck_run.tolist() == [0, 1]
+
+
+def test_state_does_not_advance_without_commit():
+    engine = _engine(_limits())
+    first = engine.evaluate(_batch(0, [7.0, 7.0, 7.0]))
+    assert not engine.state.has_last[1]
+    assert engine.state.stuck_run[1] == 0
+
+    # 同一批次重试：结果与第一次一致，不会把未提交的读数算两遍
+    retry = engine.evaluate(_batch(0, [7.0, 7.0, 7.0]))
+    assert retry.stuck_run.tolist() == first.stuck_run.tolist() == [0, 1, 2]
+    assert not retry.prev_valid[0]
+
+    engine.commit(retry)
+    assert engine.state.has_last[1]
+    assert engine.state.last_current[1] == 7.0
+    assert engine.state.stuck_run[1] == 2
+    assert engine.evaluate(_batch(3, [60.0])).masks["current_rate"].tolist() == [True]
@@ -0,0 +1,125 @@
+"""
+报警状态机：事务失败后重试同一批次，事件状态不能被提前推进
+(入库管道对暂时性错误整批重试、对数据错误拆半重写，都会让同一批读数再走一遍 process)
+"""
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.dml import Insert, Update
+from app.services.alarm_rules import AlarmRule, RuleEngine
+from app.services.alarm_state import AlarmTracker
+from app.services.reading_batch import ReadingBatch
+
+START = datetime(2024, 1, 1)
+
+
+class HighCurrentRule(AlarmRule):
+    code = "high_current"
+
+    def evaluate(self, ctx):
+        return ctx.batch.current > 100
+
+    def message(self, ctx, i):
+        return f"current {ctx.batch.current[i]}"
+
+
+class FakeAlarmDb:
+    """只模拟 alarm 表的 INSERT ... RETURNING / UPDATE ... RETURNING 与事务提交 / 回滚"""
+
+    def __init__(self):
+        self.committed = {}   # id -> occurrence_count
+        self.pending = {}
+        self.next_id = 1
+
+    def exec(self, statement):
+        if statement.table.name != "alarm":
+            return []  # 健康度 upsert 与本测试无关
+        params = statement.compile(dialect=postgresql.dialect()).params
+        if isinstance(statement, Insert):
+            counts = [v for k, v in params.items() if k.startswith("occurrence_count")]
+            ids = []
+            for count in counts:
+                self.pending[self.next_id] = count
+                ids.append((self.next_id,))
+                self.next_id += 1
+            return ids
+        if isinstance(statement, Update):
+            values = list(params.values())
+            alive = []
+            for alarm_id, count, _seen in zip(values[0::3], values[1::3], values[2::3]):
+                if alarm_id in self.committed or alarm_id in self.pending:
+                    self.pending[alarm_id] = count
+                    alive.append((alarm_id,))
+            return alive
+        raise AssertionError(f"unexpected statement: {statement}")
+
+    def commit(self):
+        self.committed.update(self.pending)
+        self.pending = {}
+
+    def rollback(self):
+        self.pending = {}
+
+
+def _batch(first_second: int, currents):
+    rows = [
+        (1, START + timedelta(seconds=first_second + i), 220.0, float(c), 10.0, 0.0)
+        for i, c in enumerate(currents)
+    ]
+    return ReadingBatch.from_rows(rows)
+
+
+def _write(engine, tracker, db, batch, fail=False):
+    """与 process_device_batch 相同的顺序：评估 -> 报警写入 -> 提交 -> 推进状态"""
+    ctx = engine.evaluate(batch)
+    tracker.process(db, ctx)
+    if fail:
+        db.rollback()
+        return
+    db.commit()
+    engine.commit(ctx)
+
+
+def _setup():
+    engine = RuleEngine(rules=[HighCurrentRule()])
+    tracker = AlarmTracker(engine=engine, min_hold_seconds=0, renotify_seconds=0)
+    return engine, tracker, FakeAlarmDb()
+
+
+def test_failed_insert_is_retried_once():
+    engine, tracker, db = _setup()
+    batch = _batch(0, [150] * 5)
+
+    _write(engine, tracker, db, batch, fail=True)
+    assert tracker.active_count() == 0
+
+    _write(engine, tracker, db, batch)
+    assert list(db.committed.values()) == [5]  # 序列号与 PostgreSQL 一样不随回滚退回
+    assert tracker.active_count() == 1
+
+
+def test_failed_update_does_not_double_count_or_drop_episode():
+    engine, tracker, db = _setup()
+    _write(engine, tracker, db, _batch(0, [150] * 5))
+
+    second = _batch(5, [150] * 3)
+    _write(engine, tracker, db, second, fail=True)
+    _write(engine, tracker, db, second)
+
+    assert list(db.committed.values()) == [8]
+    assert tracker.active_count() == 1
+    assert tracker.stats()["inserted"] == 1
+
+
+def test_split_retry_after_failure_keeps_single_alarm():
+    engine, tracker, db = _setup()
+    batch = _batch(0, [150] * 6)
+    _write(engine, tracker, db, batch, fail=True)
+
+    # 拆半重写：前一半开启事件，后一半累计到同一个事件上
+    rows = batch.rows
+    _write(engine, tracker, db, ReadingBatch.from_rows(rows[:3]))
+    _write(engine, tracker, db, ReadingBatch.from_rows(rows[3:]))
+
+    assert list(db.committed.values()) == [6]
+    assert np.isclose(tracker._episodes[(1, "high_current")].last_seen, batch.ts[-1])
@@ -0,0 +1,64 @@
+import time
+from app.core import auth_cache
+from app.core.auth_cache import AuthInvalidationListener, invalidate_user, token_cache, user_cache
+from app.models.tables import User
+
+
+class _FakePubSub:
+    def __init__(self, bus):
+        self.bus = bus
+
+    def subscribe(self, channel):
+        self.channel = channel
+
+    def get_message(self, timeout=None):
+        if self.bus.messages:
+            return {"type": "message", "channel": self.channel, "data": self.bus.messages.pop(0)}
+        time.sleep(0.01)
+        return None
+
+    def reset(self):
+        pass
+
+
+class _FakeRedis:
+    """同一个 "频道" 上的发布 / 订阅，模拟多个 API 进程共用的 Redis"""
+
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, channel, message):
+        assert channel == auth_cache.AUTH_INVALIDATE_CHANNEL
+        self.messages.append(message)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return _FakePubSub(self)
+
+
+def _cache(username: str):
+    user_cache.put(User(id=1, username=username, hashed_password="x", is_active=True))
+    token_cache.put(f"token-{username}", username, time.time() + 60)
+
+
+def test_invalidation_reaches_other_processes(monkeypatch):
+    redis = _FakeRedis()
+    monkeypatch.setattr(auth_cache.RedisClient, "get_sync_client", classmethod(lambda cls: redis))
+
+    invalidate_user("alice")
+    assert redis.messages == ["alice"]
+
+    # 另一个进程：收到通知后清除自己缓存的用户信息与 Token
+    _cache("alice")
+    _cache("bob")
+    listener = AuthInvalidationListener()
+    listener.start()
+    try:
+        deadline = time.monotonic() + 2
+        while user_cache.get("alice") is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        listener.stop()
+    assert user_cache.get("alice") is None
+    assert token_cache.get("token-alice") is None
+    assert user_cache.get("bob") is not None
+    assert listener.notifications == 1
@@ -0,0 +1,43 @@
+import json
+from app.core import config
+from app.core.config import ConfigService
+
+
+def _write(path, content):
+    path.write_text(content if isinstance(content, str) else json.dumps(content), encoding="utf-8")
+
+
+def test_broken_file_keeps_current_limits(tmp_path, monkeypatch):
+    path = tmp_path / "settings.json"
+    monkeypatch.setattr(config, "CONFIG_PATH", str(path))
+    _write(path, {"default": {"current_max": 80}, "device_thresholds": {"3": {"current_max": 120}}})
+
+    service = ConfigService(check_interval=0)
+    assert service.limits_for(3).current_max == 120
+    version = service.version
+
+    # 保存到一半的文件：不能退回内置默认阈值
+    _write(path, '{"default": {"current_max": ')
+    assert service.reload() is False
+    assert service.version == version
+    assert service.limits_for(3).current_max == 120
+    assert service.limits_for(9).current_max == 80
+    assert service.last_error and service.info()["error"] == service.last_error
+
+    # 数值写错同样不生效
+    _write(path, {"default": {"current_max": 80, "electricity_price": "abc"}})
+    assert service.reload(force=True) is False
+    assert service.version == version
+
+    _write(path, {"default": {"current_max": 60}})
+    assert service.reload() is True
+    assert service.version == version + 1
+    assert service.limits_for(3).current_max == 60
+    assert service.last_error is None
+
+
+def test_missing_file_uses_builtin_defaults(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "CONFIG_PATH", str(tmp_path / "missing.json"))
+    service = ConfigService(check_interval=0)
+    assert service.limits_for(1).current_max == config.BUILTIN_DEFAULTS["current_max"]
+    assert service.last_error is None
@@ -0,0 +1,44 @@
+import asyncio
+from datetime import timedelta
+from app.services import aggregates, history
+from app.services.history import query_history
+from tests.conftest import SERIES_SECONDS, SERIES_START
+from tests.test_aggregates import _CapturingSession
+
+END = SERIES_START + timedelta(seconds=SERIES_SECONDS)
+
+
+def test_bucket_mode_binds_timedelta(monkeypatch):
+    monkeypatch.setattr(aggregates, "_available", set())
+    monkeypatch.setattr(history, "HISTORY_RAW_MAX_SECONDS", 100)
+    session = _CapturingSession()
+    result = asyncio.run(query_history(session, 1, SERIES_START, END, max_points=10))
+    assert result["mode"] == "bucket"
+    assert session.params["width"] == timedelta(seconds=60)
+
+
+def test_history_bucket_mode_through_asyncpg(monkeypatch, run_db):
+    # 区间超过原始读取上限 -> time_bucket 聚合
+    monkeypatch.setattr(history, "HISTORY_RAW_MAX_SECONDS", 100)
+
+    async def body(session, device_id):
+        return await query_history(session, device_id, SERIES_START, END, max_points=10)
+
+    result = run_db(body)
+    assert result["mode"] == "bucket"
+    assert result["bucket_seconds"] == 60
+    assert result["count"] == 10
+    assert result["samples"] == [60] * 10
+    assert result["energy"][0] == 59.0
+
+
+def test_history_lttb_mode_through_asyncpg(run_db):
+    # 细区间、行数超过 max_points -> 原始读数 + LTTB 选点
+    async def body(session, device_id):
+        return await query_history(session, device_id, SERIES_START, END, max_points=100)
+
+    result = run_db(body)
+    assert result["mode"] == "lttb"
+    assert result["raw_count"] == SERIES_SECONDS
+    assert result["count"] == 100
+    assert result["timestamps"][0] == int(SERIES_START.timestamp() * 1000)
@@ -0,0 +1,165 @@
+"""
+本地预写 spool 与入库管道：崩溃 / 损坏恢复、prepend 顺序、游标持久化，以及数据库不可用时的重试路径
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.exc import OperationalError
+from app.services.ingest_pipeline import IngestPipeline
+from app.services.ingest_spool import HEADER_SIZE, RECORD_SIZE, SegmentSpool
+
+START = datetime(2024, 1, 1)
+
+
+def _reading(i: int, device_id: int = 1):
+    return (device_id, START + timedelta(seconds=i), float(i), 1.0, 2.0, 3.0)
+
+
+def _open(directory, segment_records: int = 8) -> SegmentSpool:
+    spool = SegmentSpool(str(directory), segment_records=segment_records)
+    assert spool.open()
+    return spool
+
+
+def _drain(spool: SegmentSpool, limit: int = 3):
+    values = []
+    while spool.depth:
+        rows, position, consumed = spool.read(limit)
+        spool.commit(position, consumed, len(rows))
+        values.extend(int(r[2]) for r in rows)
+    return values
+
+
+def _segment_path(directory, seq: int) -> str:
+    return os.path.join(str(directory), f"seg-{seq:012d}.spool")
+
+
+def test_round_trip_preserves_readings(tmp_path):
+    spool = _open(tmp_path)
+    readings = [_reading(i, device_id=i % 3 + 1) for i in range(20)]
+    spool.append_many(readings)
+    rows, position, consumed = spool.read(100)
+    assert consumed == 20
+    assert rows == readings
+    spool.close()
+
+
+def test_cursor_survives_reopen(tmp_path):
+    spool = _open(tmp_path)
+    spool.append_many([_reading(i) for i in range(20)])
+    rows, position, consumed = spool.read(7)
+    spool.commit(position, consumed, len(rows))
+    # 读出但未 commit 的一批在重新打开后要再读到一次
+    spool.read(5)
+    spool.close()
+
+    spool = _open(tmp_path)
+    assert spool.depth == 13
+    assert _drain(spool) == list(range(7, 20))
+    spool.close()
+
+    spool = _open(tmp_path)
+    assert spool.depth == 0
+    assert len([n for n in os.listdir(tmp_path) if n.endswith(".spool")]) == 1  # 回放完的段已删除
+    spool.close()
+
+
+def test_torn_tail_is_ignored_on_reopen(tmp_path):
+    spool = _open(tmp_path, segment_records=16)
+    spool.append_many([_reading(i) for i in range(5)])
+    seq = spool.stats()["cursor"][0]
+    spool.close()
+
+    # 模拟崩溃时最后一条记录只写了一半：CRC 不符
+    with open(_segment_path(tmp_path, seq), "r+b") as f:
+        f.seek(HEADER_SIZE + 4 * RECORD_SIZE + 10)
+        f.write(b"\xff\xff\xff")
+
+    spool = _open(tmp_path, segment_records=16)
+    assert _drain(spool) == [0, 1, 2, 3]
+    assert spool.corrupt == 1
+    spool.close()
+
+
+def test_corrupt_record_in_middle_is_skipped(tmp_path):
+    spool = _open(tmp_path, segment_records=16)
+    spool.append_many([_reading(i) for i in range(6)])
+    seq = spool.stats()["cursor"][0]
+    spool.close()
+
+    with open(_segment_path(tmp_path, seq), "r+b") as f:
+        f.seek(HEADER_SIZE + 2 * RECORD_SIZE)
+        f.write(b"\x00" * 8)
+
+    spool = _open(tmp_path, segment_records=16)
+    assert _drain(spool) == [0, 1, 3, 4, 5]  # 损坏记录之后的数据不丢
+    assert spool.corrupt == 1
+    spool.close()
+
+
+def test_prepend_goes_before_spooled_data_and_resumes_mid_segment(tmp_path):
+    spool = _open(tmp_path)
+    spool.append_many([_reading(i) for i in range(100, 112)])
+    rows, position, consumed = spool.read(4)
+    spool.commit(position, consumed, len(rows))  # 游标停在段中间
+
+    spool.prepend_many([_reading(i) for i in range(50, 53)])
+    spool.prepend_many([_reading(i) for i in range(10, 12)])
+    assert spool.depth == 13
+    spool.close()
+
+    spool = _open(tmp_path)
+    assert spool.depth == 13
+    assert _drain(spool) == [10, 11, 50, 51, 52] + list(range(104, 112))
+    spool.close()
+
+
+def test_prepend_on_empty_spool_appends(tmp_path):
+    spool = _open(tmp_path)
+    spool.prepend_many([_reading(i) for i in range(3)])
+    spool.append_many([_reading(i) for i in range(3, 5)])
+    assert _drain(spool) == [0, 1, 2, 3, 4]
+    spool.close()
+
+
+class FlakyDb:
+    """flush_handler 第一次写入后 "提交成功但连接断开"，之后的重试只允许走幂等的回放路径"""
+
+    def __init__(self):
+        self.rows = {}
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def flush(self, rows):
+        with self.lock:
+            self.calls.append("flush")
+            for r in rows:
+                self.rows[(r[0], r[1])] = r
+            if self.calls.count("flush") == 1:
+                raise OperationalError("COMMIT", {}, Exception("server closed the connection unexpectedly"))
+
+    def replay(self, rows):
+        with self.lock:
+            self.calls.append("replay")
+            for r in rows:
+                self.rows.setdefault((r[0], r[1]), r)
+
+
+def test_retry_after_transient_error_uses_idempotent_handler(tmp_path):
+    db = FlakyDb()
+    pipeline = IngestPipeline(
+        batch_size=10, flush_interval=0.01, flush_handler=db.flush, replay_handler=db.replay,
+        spool=SegmentSpool(str(tmp_path)),
+    )
+    pipeline.start()
+    for i in range(10):
+        pipeline.put(_reading(i))
+    deadline = time.monotonic() + 5
+    while pipeline.written < 10 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    pipeline.stop()
+
+    assert db.calls[:2] == ["flush", "replay"]
+    assert len(db.rows) == 10
+    assert pipeline.written == 10
@@ -0,0 +1,77 @@
+import asyncio
+import json
+from datetime import datetime, timedelta
+import pytest
+from fastapi import HTTPException
+from app.api.endpoints import telemetry
+from app.services import data_processor, telemetry_decoder
+
+START = datetime(2024, 1, 1)
+
+
+class _FakeRequest:
+    def __init__(self, body: bytes, content_type: str = "application/json", declared: bool = True, chunk: int = 1024):
+        self.headers = {"content-type": content_type}
+        if declared:
+            self.headers["content-length"] = str(len(body))
+        self._chunks = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+
+    async def stream(self):
+        for chunk in self._chunks:
+            yield chunk
+
+
+def _post(request):
+    with pytest.raises(HTTPException) as info:
+        asyncio.run(telemetry.upload_telemetry_batch(request))
+    return info.value.status_code
+
+
+def _body(n: int) -> bytes:
+    return json.dumps([[1, i, 220.0, 10.0, 2.2, 0.0] for i in range(n)]).encode()
+
+
+def test_oversized_body_is_rejected_with_413(monkeypatch):
+    monkeypatch.setattr(telemetry, "MAX_BATCH_BYTES", 1000)
+    assert _post(_FakeRequest(_body(100))) == 413
+    # 没有 Content-Length (分块传输) 时边读边计数
+    assert _post(_FakeRequest(_body(100), declared=False)) == 413
+    assert _post(_FakeRequest(_body(100).replace(b"], [", b"]\n["), content_type="application/x-ndjson", declared=False)) == 413
+
+
+def test_too_many_items_is_rejected_with_413(monkeypatch):
+    monkeypatch.setattr(telemetry_decoder, "MAX_BATCH_ITEMS", 10)
+    assert _post(_FakeRequest(_body(11))) == 413
+
+
+class _CopyFailsSession:
+    """COPY 失败后回退为 INSERT ... RETURNING：库里已有前两条读数"""
+
+    def __init__(self, existing):
+        self.existing = set(existing)
+        self.rolled_back = False
+
+    def connection(self):
+        raise RuntimeError("COPY 不可用")
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def exec(self, statement):
+        params = statement.compile().params
+        keys = [(params[f"device_id_m{i}"], params[f"timestamp_m{i}"]) for i in range(len(params) // 6)]
+        inserted = [k for k in keys if k not in self.existing]
+        self.existing.update(inserted)
+
+        class _Result:
+            def all(self):
+                return inserted
+        return _Result()
+
+
+def test_copy_fallback_returns_only_new_rows():
+    rows = [(1, START + timedelta(seconds=i), 220.0, 10.0, 2.2, 0.0) for i in range(5)]
+    session = _CopyFailsSession(existing=[(r[0], r[1]) for r in rows[:2]])
+    fresh = data_processor.bulk_insert_readings(session, rows, use_copy=True)
+    assert session.rolled_back
+    assert fresh == rows[2:]
@@ -0,0 +1,67 @@
+import time
+from datetime import datetime, timedelta
+from app.core.timescale import AGGREGATES, LateDataRefresher, refresh_window
+
+
+class _CapturingEngine:
+    """只记录 refresh_continuous_aggregate 的参数，不连接数据库"""
+
+    def __init__(self):
+        self.calls = []
+
+    def connect(self):
+        return self
+
+    def execution_options(self, **_):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, statement, params=None):
+        if "refresh_continuous_aggregate" in str(statement):
+            self.calls.append((params["view"], params["start"], params["end"]))
+
+
+def test_refresh_window_is_aligned_outward():
+    one_minute, one_hour = AGGREGATES[0], AGGREGATES[1]
+    start, end = datetime(2024, 1, 1, 10, 15, 30), datetime(2024, 1, 1, 11, 0, 0)
+    assert refresh_window(one_minute, start, end) == (datetime(2024, 1, 1, 10, 15), datetime(2024, 1, 1, 11, 1))
+    assert refresh_window(one_hour, start, end) == (datetime(2024, 1, 1, 10), datetime(2024, 1, 1, 12))
+
+
+def test_only_levels_outside_their_policy_window_are_refreshed():
+    engine = _CapturingEngine()
+    refresher = LateDataRefresher(engine, interval=60)
+
+    # 5 小时前：超出 1m 的刷新窗口 (3 hours)，仍在 1h / 1d 的窗口内
+    start = datetime.now() - timedelta(hours=5)
+    refresher.refresh(start, start + timedelta(minutes=10))
+    assert [c[0] for c in engine.calls] == ["devicedata_1m"]
+
+    # 60 天前：三级都要按顺序刷新
+    engine.calls.clear()
+    start = datetime.now() - timedelta(days=60)
+    refresher.refresh(start, start + timedelta(minutes=10))
+    assert [c[0] for c in engine.calls] == ["devicedata_1m", "devicedata_1h", "devicedata_1d"]
+
+
+def test_mark_skips_recent_data_and_merges_late_windows():
+    engine = _CapturingEngine()
+    refresher = LateDataRefresher(engine, interval=3600)
+    now = time.time()
+
+    refresher.mark(now - 10, now)
+    assert refresher._window is None
+
+    refresher.mark(now - 86400, now - 86000)
+    refresher.mark(now - 90000, now - 89000)
+    assert refresher._window == (now - 90000, now - 86000)
+
+    refresher.stop()
+    assert refresher._window is None
+    assert [c[0] for c in engine.calls] == ["devicedata_1m"]
+    assert engine.calls[0][1] <= datetime.fromtimestamp(now - 90000)
@@ -0,0 +1,30 @@
+import pytest
+from app.models.tables import Device
+from app.services.device_registry import RegistrySnapshot, device_registry
+from app.services.ws_subscriptions import SubscriptionError, resolve_device_ids
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    devices = [
+        Device(id=1, name="主井电表", sn="A1", device_type="电表", location="主井"),
+        Device(id=2, name="副井电表", sn="A2", device_type="电表", location="副井"),
+        Device(id=3, name="排水泵", sn="P1", device_type="水泵", location="主井"),
+        Device(id=4, name="风机", sn="F1", device_type="风机", location=None),
+    ]
+    monkeypatch.setattr(device_registry, "_snapshot", RegistrySnapshot(devices))
+
+
+def test_types_and_locations_resolve_from_registry(registry):
+    assert resolve_device_ids([], ["电表"], []) == [1, 2]
+    assert resolve_device_ids([4], [], ["主井"]) == [1, 3, 4]
+    assert resolve_device_ids([], ["电表"], ["主井"]) == [1, 2, 3]
+    assert resolve_device_ids([], [], [], all_devices=True) == [1, 2, 3, 4]
+
+
+def test_plain_device_ids_do_not_need_registry(monkeypatch):
+    monkeypatch.setattr(device_registry, "_snapshot", None)
+    assert resolve_device_ids([5, 6], [], []) == [5, 6]
+    assert resolve_device_ids([], [], []) is None
+    with pytest.raises(SubscriptionError):
+        resolve_device_ids([], ["电表"], [])
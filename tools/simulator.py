@@ -1,3 +1,4 @@
+import os
 import random
 import time
 import json
@@ -9,6 +10,8 @@ import paho.mqtt.client as mqtt
 MQTT_BROKER = "127.0.0.1"
 MQTT_PORT = 1883
 MQTT_TOPIC_TELEMETRY = "mine/telemetry"    # 发送：遥测数据
+# 源端分区数 (与入库端的 MQTT_TELEMETRY_PARTITIONS 一致)：>0 时发到 mine/telemetry/<device_id % 分区数>
+MQTT_TELEMETRY_PARTITIONS = int(os.getenv("MQTT_TELEMETRY_PARTITIONS", "0"))
 MQTT_TOPIC_CONTROL_PREFIX = "mine/control/" # 接收：控制指令前缀 (mine/control/1)
 
 # 2. HTTP 配置 (负责登录和同步初始状态)
@@ -221,7 +224,10 @@ def start_simulation():
                 }
 
                 # 发送 MQTT 消息
-                client.publish(MQTT_TOPIC_TELEMETRY, json.dumps(payload))
+                topic = MQTT_TOPIC_TELEMETRY
+                if MQTT_TELEMETRY_PARTITIONS:
+                    topic = f"{MQTT_TOPIC_TELEMETRY}/{dev_id % MQTT_TELEMETRY_PARTITIONS}"
+                client.publish(topic, json.dumps(payload))
                 
                 # 为了控制台清爽，只打印部分日志
                 # 打印 ID=1 的，或者刚刚被停机的，或者发生过载的